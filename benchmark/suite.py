@@ -0,0 +1,288 @@
+"""
+Layered benchmark suite
+
+Measures each layer of Preql separately, on Sqlite and DuckDB:
+
+- parse     : Parsing code into an AST (parse_stmts)
+- compile   : Compiling an AST into SQL (compile_to_inst + finalize_with_subqueries)
+- finalize  : Finalizing the SQL of a function call, with new argument values each time, with and without the SQL cache
+- roundtrip : Calling a Preql function that runs a point query, vs. running its SQL directly
+- import    : Importing the rows of a wide table, and of a tall table, into Python
+- insert    : Inserting rows in bulk, with new[]
+- display   : Rendering a table for the REPL
+
+The results are written as JSON, and can be compared to a stored baseline.
+
+Usage:
+    python benchmark/suite.py run [-o results.json] [--db sqlite,duck] [--iters N] [-k pattern]
+    python benchmark/suite.py compare baseline.json results.json [--threshold 0.2]
+
+'compare' exits with status 1 if any benchmark is slower than its baseline by more than
+the threshold (i.e. 0.2 means 20% slower).
+"""
+
+import sys
+import json
+import time
+import platform
+import argparse
+from pathlib import Path
+from statistics import median
+
+from preql import Preql, __version__
+from preql.core.parser import parse_stmts
+
+DATABASES = {
+    'sqlite': 'sqlite://:memory:',
+    'duck': 'duck://:memory:',
+}
+
+TALL_ROWS = 20000
+WIDE_ROWS = 1000
+WIDE_COLUMNS = 50
+INSERT_ROWS = 1000
+FINALIZE_CALLS = 2000
+
+BUILTINS_PQL = Path(__file__).parent.parent / 'preql' / 'modules' / '__builtins__.pql'
+
+JOIN_QUERY = '''
+join(t: tall, o: other) {t.s => total: sum(o.y), n: count(o.id)} [total > 1] order {^total} [..10]
+'''
+
+
+_benchmarks = []
+
+def bench(layer, name, iters, uses_db=True):
+    "Registers a benchmark. The decorated function sets it up, and returns the function to measure."
+    def register(setup):
+        _benchmarks.append((layer, name, iters, uses_db, setup))
+        return setup
+    return register
+
+
+def _run(p, code):
+    "Runs code whose result can't be returned to Python (e.g. new[])"
+    p(code + '\nnull')
+
+def _create_tables(p):
+    p('table tall {i: int, f: float, s: string}')
+    _run(p, f'new[] tall([0..{TALL_ROWS}] {{i: item, f: item / 3, s: "row" + string(item % 100)}})')
+    p('table other {t: tall, y: float}')
+    _run(p, 'new[] other(tall[i < 1000] {t: id, y: f * 2})')
+
+
+@bench('parse', 'builtins', 20, uses_db=False)
+def parse_builtins(p):
+    code = BUILTINS_PQL.read_text(encoding='utf8')
+    return lambda: parse_stmts(code, '<benchmark>')
+
+
+@bench('compile', 'join_groupby', 200)
+def compile_join(p):
+    _create_tables(p)
+    expr ,= parse_stmts(JOIN_QUERY, '<benchmark>')
+    interp = p._interp
+    db = interp.state.db
+
+    def run():
+        with interp.setup_context():
+            inst = expr.simplify().compile_to_inst()
+            return db.compile_sql(inst.code, inst.subqueries)
+    return run
+
+
+def _function_calls(p, count):
+    "Returns the SQL trees of calls to get(), each with a different argument"
+    _create_tables(p)
+    p('func get(id_) = tall[id==id_]{i}')
+    interp = p._interp
+    with interp.setup_context():
+        return interp.state.db, [p._run_code(f'get({i})', '<benchmark>') for i in range(count)]
+
+def _finalize_calls(p, clear_cache):
+    db, calls = _function_calls(p, FINALIZE_CALLS)
+    calls = iter(calls)
+    interp = p._interp
+
+    def run():
+        inst = next(calls)
+        with interp.setup_context():
+            if clear_cache:
+                db._sql_cache.clear()
+            return db._compile_query(inst.code, inst.subqueries, ())
+    return run
+
+@bench('finalize', 'cached', FINALIZE_CALLS - 1)
+def finalize_cached(p):
+    return _finalize_calls(p, False)
+
+@bench('finalize', 'uncached', FINALIZE_CALLS - 1)
+def finalize_uncached(p):
+    return _finalize_calls(p, True)
+
+
+@bench('roundtrip', 'preql', 1000)
+def roundtrip_preql(p):
+    _create_tables(p)
+    p('func get(id_) = tall[id==id_]{i}')
+    return lambda: p.get(7).to_json()
+
+
+@bench('roundtrip', 'sql', 1000)
+def roundtrip_sql(p):
+    _create_tables(p)
+    code = p('inspect_sql(tall[id==7]{i})')
+    interp = p._interp
+    conn = interp.state.db._conn
+
+    def fetch(c):
+        c.execute(code)
+        c.fetchall()
+
+    def run():
+        with interp.setup_context():
+            conn.execute_with_cursor(code, fetch)
+    return run
+
+
+@bench('import', 'tall', 10)
+def import_tall(p):
+    _create_tables(p)
+    return lambda: p('tall').to_json()
+
+
+@bench('import', 'wide', 10)
+def import_wide(p):
+    columns = ['c%d' % i for i in range(WIDE_COLUMNS)]
+    p('table wide {%s}' % ', '.join('%s: int' % c for c in columns))
+    _run(p, 'new[] wide([0..%d] {%s})' % (WIDE_ROWS, ', '.join('%s: item' % c for c in columns)))
+    return lambda: p('wide').to_json()
+
+
+@bench('insert', 'new_bulk', 20)
+def insert_bulk(p):
+    p('table target {i: int, s: string}')
+    p(f'table source = [0..{INSERT_ROWS}] {{i: item, s: "row" + string(item)}}')
+    return lambda: _run(p, 'new[] target(source{i, s})')
+
+
+@bench('display', 'table', 50)
+def display_table(p):
+    _create_tables(p)
+    table = p('tall')
+    return lambda: repr(table)
+
+
+def measure(f, iters):
+    "Returns timing statistics of calling f, in seconds per call"
+    f()     # Warm up (e.g. fill the caches)
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': median(times), 'mean': sum(times) / iters, 'iters': iters}
+
+
+def run_benchmarks(dbs, iters=None, pattern=None):
+    results = {}
+    for layer, name, default_iters, uses_db, setup in _benchmarks:
+        for db in (dbs if uses_db else ['any']):
+            key = f'{db}/{layer}/{name}'
+            if pattern and pattern not in key:
+                continue
+
+            p = Preql(DATABASES[db] if uses_db else DATABASES['sqlite'])
+            try:
+                res = measure(setup(p), iters or default_iters)
+            finally:
+                p.close()
+
+            results[key] = res
+            print('%-30s %10.3f ms  (median of %d)' % (key, res['median'] * 1000, res['iters']))
+    return results
+
+
+def compare(baseline, results, threshold, stat='median'):
+    "Returns a list of (key, baseline_time, new_time, ratio), and the keys of the regressions"
+    rows = []
+    regressions = []
+    for key, res in results.items():
+        if key not in baseline:
+            continue
+        old = baseline[key][stat]
+        new = res[stat]
+        ratio = new / old if old else float('inf')
+        rows.append((key, old, new, ratio))
+        if ratio > 1 + threshold:
+            regressions.append(key)
+    return rows, regressions
+
+
+def cmd_run(args):
+    dbs = args.db.split(',')
+    unknown = set(dbs) - set(DATABASES)
+    if unknown:
+        sys.exit('Unknown database: %s' % ', '.join(sorted(unknown)))
+
+    results = run_benchmarks(dbs, args.iters, args.k)
+    output = {
+        'meta': {
+            'preql': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print('Results written to', args.output)
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    with open(args.results) as f:
+        results = json.load(f)['results']
+
+    rows, regressions = compare(baseline, results, args.threshold, args.stat)
+    print('%-30s %12s %12s %8s' % ('benchmark', 'baseline ms', 'current ms', 'ratio'))
+    for key, old, new, ratio in rows:
+        mark = '  <-- regression' if key in regressions else ''
+        print('%-30s %12.3f %12.3f %7.2fx%s' % (key, old * 1000, new * 1000, ratio, mark))
+
+    missing = set(baseline) - set(results)
+    if missing:
+        print('Not in results:', ', '.join(sorted(missing)))
+
+    if regressions:
+        print('%d regression(s), over the threshold of %d%%' % (len(regressions), args.threshold * 100))
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Layered benchmark suite for Preql')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    run = sub.add_parser('run', help='Run the benchmarks, and write the results as JSON')
+    run.add_argument('-o', '--output', default='benchmark_results.json')
+    run.add_argument('--db', default=','.join(DATABASES), help='Comma-separated list of: %s' % ', '.join(DATABASES))
+    run.add_argument('--iters', type=int, help='Override the number of iterations of every benchmark')
+    run.add_argument('-k', help='Only run benchmarks whose key contains this string')
+    run.set_defaults(func=cmd_run)
+
+    cmp = sub.add_parser('compare', help='Compare results to a baseline, and fail on regressions')
+    cmp.add_argument('baseline')
+    cmp.add_argument('results')
+    cmp.add_argument('--threshold', type=float, default=0.2)
+    cmp.add_argument('--stat', choices=['min', 'median', 'mean'], default='median')
+    cmp.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Benchmark for the time it takes to create a new Preql instance
+
+Compares construction with and without the caches of parsed files,
+imported modules, and the builtins namespace.
+"""
+
+import time
+
+from preql import Preql, settings
+
+ITERS = 20
+
+
+def measure(iters=ITERS):
+    Preql()     # Warm up (e.g. fill the caches)
+    start = time.time()
+    for i in range(iters):
+        Preql()
+    return (time.time() - start) / iters
+
+
+def main():
+    settings.parse_cache = False
+    settings.module_cache = False
+    uncached = measure()
+
+    settings.parse_cache = True
+    settings.module_cache = True
+    cached = measure()
+
+    print('Preql() construction (average of %d)' % ITERS)
+    print('    * Without caches: %.4f' % uncached)
+    print('    * With caches   : %.4f\t(x%.1f faster)' % (cached, uncached / cached))
+
+
+main()
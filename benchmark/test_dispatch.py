@@ -0,0 +1,136 @@
+"""
+Benchmark for the overhead of multiple dispatch
+
+Compares runtype's dispatch to Preql's memoized dispatch (preql.utils.Dispatch), on the
+same set of functions:
+- class    : Dispatch on Python classes (like dsp)
+- instance : Dispatch on the Preql type of an instance, here a table (like dp_inst)
+- type     : Dispatch on a Preql type (like dp_type)
+
+Then it measures the call overhead of a point query, as in test_get.py (without SqlAlchemy).
+"""
+
+import time
+
+import runtype
+from preql import Preql
+from preql.utils import Dispatch
+from preql.core.pql_types import T, TS_Preql, TS_Preql_subclass
+
+CALLS = 20000
+REPEAT = 10
+GET_CALLS = 1000
+VECTOR_COUNT = 1000
+
+
+class Inst:
+    def __init__(self, type_):
+        self.type = type_
+
+class A: pass
+class B(A): pass
+class C(B): pass
+
+
+def class_funcs(dp):
+    @dp
+    def f(a: A, b: A):
+        return 1
+    @dp
+    def f(a: B, b: A):
+        return 2
+    @dp
+    def f(a: C, b: B):
+        return 3
+    @dp
+    def f(a: object, b: object):
+        return 0
+    return f, (C(), B())
+
+
+def _preql_funcs(dp):
+    @dp
+    def f(t: T.primitive):
+        return 1
+    @dp
+    def f(t: T.union[T.table, T.struct]):
+        return 2
+    @dp
+    def f(t: T.json_array[T.union[T.primitive, T.nulltype]]):
+        return 3
+    @dp
+    def f(t: T.any):
+        return 0
+    return f
+
+def _table_type():
+    return T.table({'c%d' % i: T.int for i in range(20)}, name='bench')
+
+def instance_funcs(dp):
+    return _preql_funcs(dp), (Inst(_table_type()),)
+
+def type_funcs(dp):
+    return _preql_funcs(dp), (_table_type(),)
+
+
+def time_calls(f, args, count, repeat=REPEAT):
+    "Returns the best time, out of a few repeats, to make count calls"
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(count):
+            f(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_dispatch():
+    benchmarks = [
+        ('class', class_funcs, runtype.Dispatch(), Dispatch()),
+        ('instance', instance_funcs, runtype.Dispatch(TS_Preql()), Dispatch(TS_Preql(), TS_Preql().dispatch_key)),
+        ('type', type_funcs, runtype.Dispatch(TS_Preql_subclass()), Dispatch(TS_Preql_subclass(), TS_Preql_subclass().dispatch_key)),
+    ]
+
+    print('%-10s %14s %14s %8s' % ('dispatch', 'runtype us', 'memoized us', 'speedup'))
+    for name, make_funcs, runtype_dp, memoized_dp in benchmarks:
+        f1, args = make_funcs(runtype_dp)
+        f2, _ = make_funcs(memoized_dp)
+        assert f1(*args) == f2(*args)
+
+        t1 = time_calls(f1, args, CALLS)
+        t2 = time_calls(f2, args, CALLS)
+        print('%-10s %14.3f %14.3f %7.2fx' % (name, t1 / CALLS * 1e6, t2 / CALLS * 1e6, t1 / t2))
+
+
+def bench_get():
+    pql = Preql()
+    pql('''
+        table Vector {
+            id: t_id
+            v: int
+        }
+        func get(id_) = Vector[id==id_]{v}
+    ''')
+    pql(f'new[] Vector([0..{VECTOR_COUNT}] {{v: item}})\nnull')
+
+    def pql_get(id_):
+        res = pql.get(id_).to_json()
+        if len(res) != 1:
+            raise ValueError()
+
+    for i in range(100):    # Warm up
+        pql_get(i + 1)
+
+    start = time.perf_counter()
+    for i in range(GET_CALLS):
+        pql_get(i % (VECTOR_COUNT//2) + 1)
+    t = time.perf_counter() - start
+    print('\npql_get: %.3f ms per call' % (t / GET_CALLS * 1000))
+
+
+def main():
+    bench_dispatch()
+    bench_get()
+
+
+main()
@@ -0,0 +1,61 @@
+"""
+Benchmark for the time it takes to import preql
+
+Runs `python -X importtime -c "import preql"` in a fresh process, and fails
+if the cumulative import time exceeds IMPORT_BUDGET (in milliseconds).
+
+Preql is imported once beforehand with writing bytecode enabled, so the time to compile
+its source (e.g. when PYTHONDONTWRITEBYTECODE is set) isn't measured as import time.
+
+Usage: python benchmark/test_importtime.py [budget_ms]
+"""
+
+import os
+import sys
+import subprocess
+
+IMPORT_BUDGET = 450     # ms
+ITERS = 5
+TOP = 15
+
+
+def measure():
+    "Returns a dict of {module: (self_us, cumulative_us)}"
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import preql'],
+                         stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            times[name.strip()] = int(self_us), int(cumulative_us)
+        except ValueError:
+            pass    # Header line
+    return times
+
+
+def main():
+    budget = int(sys.argv[1]) if len(sys.argv) > 1 else IMPORT_BUDGET
+
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    subprocess.run([sys.executable, '-c', 'import preql'], env=env, check=True)
+
+    # Take the best run, to reduce noise
+    runs = [measure() for i in range(ITERS)]
+    best = min(runs, key=lambda t: t['preql'][1])
+    total = best['preql'][1] / 1000
+
+    print('Slowest modules (self time, ms):')
+    for name, (self_us, _) in sorted(best.items(), key=lambda x: -x[1][0])[:TOP]:
+        print('    %-40s %8.1f' % (name, self_us / 1000))
+    print()
+    print('import preql: %.1f ms (budget %d ms, best of %d)' % (total, budget, ITERS))
+
+    if total > budget:
+        print('Import time exceeds budget!')
+        sys.exit(1)
+
+
+main()
@@ -0,0 +1,194 @@
+"""
+TPC-H style benchmark
+
+Runs the TPC-H queries written in Preql (see tpch_queries.py) on Sqlite and DuckDB, and
+compares them to the hand-written SQL of the same queries, on data from tpch_dbgen.py.
+
+For each query, it measures:
+- compile : Compiling the Preql code to SQL
+- preql   : Executing the SQL generated by Preql
+- sql     : Executing the hand-written SQL
+
+and reports the ratio of preql to sql, which shows the cost of the generated SQL. It also
+checks that both return the same rows.
+
+The generated data is kept in the data directory, and reused on the next run with the same
+scale factor. For large scale factors, use --db-dir to keep the databases on disk.
+
+The results are written as JSON, in the format of suite.py, so they can be compared to a
+baseline with 'python benchmark/suite.py compare'.
+
+Usage:
+    python benchmark/test_tpch.py [--sf 0.01] [--db sqlite,duck] [--iters 3] [-q q01,q06] [-o tpch_results.json]
+"""
+
+import sys
+import json
+import math
+import time
+import platform
+import argparse
+from pathlib import Path
+
+from preql import Preql, __version__
+
+from suite import measure
+from tpch_dbgen import TABLES, generate
+from tpch_queries import QUERIES
+
+DATABASES = {
+    'sqlite': ('sqlite://:memory:', 'sqlite://%s'),
+    'duck': ('duck://:memory:', 'duck://%s'),
+}
+
+# Indexes on the primary and foreign keys, as allowed by the specification
+INDEXES = {
+    'nation': ['n_nationkey'],
+    'supplier': ['s_suppkey'],
+    'customer': ['c_custkey'],
+    'part': ['p_partkey'],
+    'partsupp': ['ps_partkey, ps_suppkey'],
+    'orders': ['o_orderkey', 'o_custkey'],
+    'lineitem': ['l_orderkey', 'l_partkey, l_suppkey'],
+}
+
+
+def connect(db, db_dir):
+    memory_uri, file_uri = DATABASES[db]
+    if not db_dir:
+        return Preql(memory_uri)
+
+    path = Path(db_dir) / f'tpch.{db}'
+    if path.exists():
+        path.unlink()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return Preql(file_uri % path, auto_create=True)
+
+
+def load(p, paths):
+    for name, columns in TABLES.items():
+        p('table %s {%s}' % (name, ', '.join(f'{c}: {t}' for c, t in columns)))
+        p(f'import_csv({name}, filename)', filename=str(paths[name]))
+
+    for table, indexes in INDEXES.items():
+        for i, columns in enumerate(indexes):
+            execute_sql(p, f'CREATE INDEX {table}_{i} ON {table}({columns})', fetch=False)
+    p.commit()
+
+
+def compile_query(p, code, params):
+    "Compiles the Preql code to SQL. The last statement must be a table expression."
+    interp = p._interp
+    inst = p._run_code(code, '<tpch>', params)
+    with interp.setup_context():
+        return interp.state.db.compile_sql(inst.code, inst.subqueries)
+
+
+def execute_sql(p, sql_code, fetch=True):
+    interp = p._interp
+    rows = []
+    def run(c):
+        c.execute(sql_code)
+        if fetch:
+            rows.extend(c.fetchall())
+    with interp.setup_context():
+        interp.state.db._conn.execute_with_cursor(sql_code, run)
+    return rows
+
+
+def _bind(sql_code, params):
+    for name, value in params.items():
+        sql_code = sql_code.replace(':' + name, repr(value))
+    return sql_code
+
+
+def _same_value(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        return a is not None and b is not None and math.isclose(a, b, rel_tol=1e-6, abs_tol=1e-6)
+    return a == b
+
+def same_rows(rows1, rows2):
+    if len(rows1) != len(rows2):
+        return False
+    return all(len(r1) == len(r2) and all(map(_same_value, r1, r2)) for r1, r2 in zip(rows1, rows2))
+
+
+def run_queries(p, db, queries, params, iters):
+    results = {}
+    print('%-6s %12s %12s %12s %8s  %s' % ('query', 'compile ms', 'preql ms', 'sql ms', 'ratio', 'rows'))
+    for name in queries:
+        preql_code, sql_code = QUERIES[name]
+        sql_code = _bind(sql_code, params)
+
+        compiled = compile_query(p, preql_code, params)
+        preql_rows = execute_sql(p, compiled)
+        sql_rows = execute_sql(p, sql_code)
+        check = len(sql_rows) if same_rows(preql_rows, sql_rows) else 'MISMATCH (%d vs %d)' % (len(preql_rows), len(sql_rows))
+
+        timings = {
+            'compile': measure(lambda: compile_query(p, preql_code, params), iters),
+            'preql': measure(lambda: execute_sql(p, compiled), iters),
+            'sql': measure(lambda: execute_sql(p, sql_code), iters),
+        }
+        for phase, res in timings.items():
+            results[f'{db}/tpch/{name}/{phase}'] = res
+
+        ratio = timings['preql']['median'] / timings['sql']['median']
+        print('%-6s %12.2f %12.2f %12.2f %7.2fx  %s' % (name, timings['compile']['median'] * 1000,
+              timings['preql']['median'] * 1000, timings['sql']['median'] * 1000, ratio, check))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TPC-H style benchmark for Preql')
+    parser.add_argument('--sf', type=float, default=0.01, help='Scale factor (1 is about 1GB)')
+    parser.add_argument('--db', default=','.join(DATABASES), help='Comma-separated list of: %s' % ', '.join(DATABASES))
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('-q', '--queries', help='Comma-separated list of queries to run (e.g. q01,q06)')
+    parser.add_argument('-o', '--output', default='tpch_results.json')
+    parser.add_argument('--data-dir', help='Where to keep the generated data (default: benchmark/tpch_data/sf<SF>)')
+    parser.add_argument('--db-dir', help='Keep the databases in this directory, instead of in memory')
+    args = parser.parse_args()
+
+    dbs = args.db.split(',')
+    queries = args.queries.split(',') if args.queries else list(QUERIES)
+    unknown = set(dbs) - set(DATABASES)
+    if unknown:
+        sys.exit('Unknown database: %s' % ', '.join(sorted(unknown)))
+    unknown = set(queries) - set(QUERIES)
+    if unknown:
+        sys.exit('Unknown query: %s' % ', '.join(sorted(unknown)))
+
+    data_dir = args.data_dir or Path(__file__).parent / 'tpch_data' / f'sf{args.sf:g}'
+    paths = generate(data_dir, args.sf)
+    params = {'fraction': 0.0001 / args.sf}
+
+    results = {}
+    for db in dbs:
+        print(f'\n== {db} (SF {args.sf:g})')
+        p = connect(db, args.db_dir)
+        try:
+            start = time.time()
+            load(p, paths)
+            print('Loaded in %.1f seconds' % (time.time() - start))
+            results.update(run_queries(p, db, queries, params, args.iters))
+        finally:
+            p.close()
+
+    output = {
+        'meta': {
+            'preql': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'sf': args.sf,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print('Results written to', args.output)
+
+
+if __name__ == '__main__':
+    main()
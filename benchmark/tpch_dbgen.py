@@ -0,0 +1,229 @@
+"""
+Data generator for the TPC-H style benchmark (see test_tpch.py)
+
+Generates the 8 tables of TPC-H as CSV files, at a given scale factor (SF 1 is about 1GB),
+following the distributions of the specification closely enough for its queries to be
+selective in the same way. It is not a conformant dbgen replacement:
+
+- Dates are written as ISO strings, so the same hand-written SQL runs on every database
+- Decimals are written as floats
+- Comments are random words, instead of the specification's text grammar
+
+The output is deterministic for a given scale factor and seed.
+"""
+
+import os
+import csv
+import random
+from datetime import date, timedelta
+from pathlib import Path
+
+TABLES = {
+    'region': [('r_regionkey', 'int'), ('r_name', 'string'), ('r_comment', 'string')],
+    'nation': [('n_nationkey', 'int'), ('n_name', 'string'), ('n_regionkey', 'int'), ('n_comment', 'string')],
+    'supplier': [('s_suppkey', 'int'), ('s_name', 'string'), ('s_address', 'string'), ('s_nationkey', 'int'),
+                 ('s_phone', 'string'), ('s_acctbal', 'float'), ('s_comment', 'string')],
+    'customer': [('c_custkey', 'int'), ('c_name', 'string'), ('c_address', 'string'), ('c_nationkey', 'int'),
+                 ('c_phone', 'string'), ('c_acctbal', 'float'), ('c_mktsegment', 'string'), ('c_comment', 'string')],
+    'part': [('p_partkey', 'int'), ('p_name', 'string'), ('p_mfgr', 'string'), ('p_brand', 'string'),
+             ('p_type', 'string'), ('p_size', 'int'), ('p_container', 'string'), ('p_retailprice', 'float'),
+             ('p_comment', 'string')],
+    'partsupp': [('ps_partkey', 'int'), ('ps_suppkey', 'int'), ('ps_availqty', 'int'), ('ps_supplycost', 'float'),
+                 ('ps_comment', 'string')],
+    'orders': [('o_orderkey', 'int'), ('o_custkey', 'int'), ('o_orderstatus', 'string'), ('o_totalprice', 'float'),
+               ('o_orderdate', 'string'), ('o_orderpriority', 'string'), ('o_clerk', 'string'),
+               ('o_shippriority', 'int'), ('o_comment', 'string')],
+    'lineitem': [('l_orderkey', 'int'), ('l_partkey', 'int'), ('l_suppkey', 'int'), ('l_linenumber', 'int'),
+                 ('l_quantity', 'float'), ('l_extendedprice', 'float'), ('l_discount', 'float'), ('l_tax', 'float'),
+                 ('l_returnflag', 'string'), ('l_linestatus', 'string'), ('l_shipdate', 'string'),
+                 ('l_commitdate', 'string'), ('l_receiptdate', 'string'), ('l_shipinstruct', 'string'),
+                 ('l_shipmode', 'string'), ('l_comment', 'string')],
+}
+
+REGIONS = ['AFRICA', 'AMERICA', 'ASIA', 'EUROPE', 'MIDDLE EAST']
+NATIONS = [
+    ('ALGERIA', 0), ('ARGENTINA', 1), ('BRAZIL', 1), ('CANADA', 1), ('EGYPT', 4), ('ETHIOPIA', 0),
+    ('FRANCE', 3), ('GERMANY', 3), ('INDIA', 2), ('INDONESIA', 2), ('IRAN', 4), ('IRAQ', 4), ('JAPAN', 2),
+    ('JORDAN', 4), ('KENYA', 0), ('MOROCCO', 0), ('MOZAMBIQUE', 0), ('PERU', 1), ('CHINA', 2), ('ROMANIA', 3),
+    ('SAUDI ARABIA', 4), ('VIETNAM', 2), ('RUSSIA', 3), ('UNITED KINGDOM', 3), ('UNITED STATES', 1),
+]
+
+SEGMENTS = ['AUTOMOBILE', 'BUILDING', 'FURNITURE', 'MACHINERY', 'HOUSEHOLD']
+PRIORITIES = ['1-URGENT', '2-HIGH', '3-MEDIUM', '4-NOT SPECIFIED', '5-LOW']
+SHIP_INSTRUCT = ['DELIVER IN PERSON', 'COLLECT COD', 'NONE', 'TAKE BACK RETURN']
+SHIP_MODES = ['REG AIR', 'AIR', 'RAIL', 'SHIP', 'TRUCK', 'MAIL', 'FOB']
+TYPE_SYLLABLES = [
+    ['STANDARD', 'SMALL', 'MEDIUM', 'LARGE', 'ECONOMY', 'PROMO'],
+    ['ANODIZED', 'BURNISHED', 'PLATED', 'POLISHED', 'BRUSHED'],
+    ['TIN', 'NICKEL', 'BRASS', 'STEEL', 'COPPER'],
+]
+CONTAINER_SYLLABLES = [
+    ['SM', 'LG', 'MED', 'JUMBO', 'WRAP'],
+    ['CASE', 'BOX', 'BAG', 'JAR', 'PKG', 'PACK', 'CAN', 'DRUM'],
+]
+COLORS = [
+    'almond', 'antique', 'aquamarine', 'azure', 'beige', 'bisque', 'black', 'blanched', 'blue', 'blush',
+    'brown', 'burlywood', 'burnished', 'chartreuse', 'chiffon', 'chocolate', 'coral', 'cornflower',
+    'cornsilk', 'cream', 'cyan', 'dark', 'deep', 'dim', 'dodger', 'drab', 'firebrick', 'floral', 'forest',
+    'frosted', 'gainsboro', 'ghost', 'goldenrod', 'green', 'grey', 'honeydew', 'hot', 'indian', 'ivory',
+    'khaki', 'lace', 'lavender', 'lawn', 'lemon', 'light', 'lime', 'linen', 'magenta', 'maroon', 'medium',
+    'metallic', 'midnight', 'mint', 'misty', 'moccasin', 'navajo', 'navy', 'olive', 'orange', 'orchid',
+    'pale', 'papaya', 'peach', 'peru', 'pink', 'plum', 'powder', 'puff', 'purple', 'red', 'rose', 'rosy',
+    'royal', 'saddle', 'salmon', 'sandy', 'seashell', 'sienna', 'sky', 'slate', 'smoke', 'snow', 'spring',
+    'steel', 'tan', 'thistle', 'tomato', 'turquoise', 'violet', 'wheat', 'white', 'yellow',
+]
+WORDS = [
+    'furiously', 'sly', 'careful', 'blithely', 'quickly', 'fluffily', 'slyly', 'ironic', 'final', 'regular',
+    'express', 'bold', 'pending', 'silent', 'even', 'unusual', 'deposits', 'packages', 'accounts', 'theodolites',
+    'foxes', 'ideas', 'pinto', 'beans', 'instructions', 'dependencies', 'excuses', 'platelets', 'asymptotes',
+    'courts', 'dolphins', 'sleep', 'wake', 'are', 'cajole', 'haggle', 'nag', 'use', 'boost', 'affix', 'detect',
+    'integrate', 'among', 'across', 'about', 'above', 'after', 'along', 'the', 'of',
+]
+
+START_DATE = date(1992, 1, 1)
+CURRENT_DATE = date(1995, 6, 17)
+END_DATE = date(1998, 12, 31)
+ORDER_DAYS = (END_DATE - START_DATE).days - 151
+
+
+def _comment(rng, words=5):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, words)))
+
+def _phone(rng, nationkey):
+    return '%d-%d-%d-%d' % (nationkey + 10, rng.randint(100, 999), rng.randint(100, 999), rng.randint(1000, 9999))
+
+def _money(rng, low, high):
+    return rng.randint(int(low * 100), int(high * 100)) / 100
+
+def retail_price(partkey):
+    return (90000 + ((partkey // 10) % 20001) + 100 * (partkey % 1000)) / 100
+
+def part_supplier(partkey, i, suppliers):
+    "Returns the key of the i-th (0-3) supplier of the part"
+    return (partkey + i * (suppliers // 4 + (partkey - 1) // suppliers)) % suppliers + 1
+
+
+class _Generator:
+    def __init__(self, sf, seed):
+        self.rng = random.Random(seed)
+        self.suppliers = max(4, int(10000 * sf))
+        self.customers = max(3, int(150000 * sf))
+        self.parts = max(1, int(200000 * sf))
+        self.orders = max(1, int(1500000 * sf))
+        self.dates = [(START_DATE + timedelta(days=i)).isoformat() for i in range((END_DATE - START_DATE).days + 200)]
+
+    def region(self):
+        for i, name in enumerate(REGIONS):
+            yield [i, name, _comment(self.rng)]
+
+    def nation(self):
+        for i, (name, region) in enumerate(NATIONS):
+            yield [i, name, region, _comment(self.rng)]
+
+    def supplier(self):
+        rng = self.rng
+        for key in range(1, self.suppliers + 1):
+            nation = rng.randrange(len(NATIONS))
+            comment = _comment(rng)
+            if rng.random() < 0.0005:
+                comment += ' Customer %s Complaints' % rng.choice(WORDS)
+            yield [key, 'Supplier#%09d' % key, _comment(rng, 3), nation, _phone(rng, nation),
+                   _money(rng, -999.99, 9999.99), comment]
+
+    def customer(self):
+        rng = self.rng
+        for key in range(1, self.customers + 1):
+            nation = rng.randrange(len(NATIONS))
+            yield [key, 'Customer#%09d' % key, _comment(rng, 3), nation, _phone(rng, nation),
+                   _money(rng, -999.99, 9999.99), rng.choice(SEGMENTS), _comment(rng)]
+
+    def part(self):
+        rng = self.rng
+        for key in range(1, self.parts + 1):
+            mfgr = rng.randint(1, 5)
+            yield [key, ' '.join(rng.sample(COLORS, 5)), 'Manufacturer#%d' % mfgr,
+                   'Brand#%d%d' % (mfgr, rng.randint(1, 5)), ' '.join(rng.choice(s) for s in TYPE_SYLLABLES),
+                   rng.randint(1, 50), ' '.join(rng.choice(s) for s in CONTAINER_SYLLABLES),
+                   retail_price(key), _comment(rng, 3)]
+
+    def partsupp(self):
+        rng = self.rng
+        for partkey in range(1, self.parts + 1):
+            for i in range(4):
+                yield [partkey, part_supplier(partkey, i, self.suppliers), rng.randint(1, 9999),
+                       _money(rng, 1, 1000), _comment(rng)]
+
+    def orders_and_lineitems(self):
+        "Yields pairs of (order, lineitems), since the order depends on its lineitems"
+        rng = self.rng
+        dates = self.dates
+        current = (CURRENT_DATE - START_DATE).days
+        for orderkey in range(1, self.orders + 1):
+            custkey = rng.randint(1, self.customers)
+            while custkey % 3 == 0:     # A third of the customers have no orders
+                custkey = rng.randint(1, self.customers)
+            orderdate = rng.randint(0, ORDER_DAYS)
+
+            lineitems = []
+            total = 0
+            for linenumber in range(1, rng.randint(1, 7) + 1):
+                partkey = rng.randint(1, self.parts)
+                quantity = rng.randint(1, 50)
+                price = round(quantity * retail_price(partkey), 2)
+                discount = rng.randint(0, 10) / 100
+                tax = rng.randint(0, 8) / 100
+                shipdate = orderdate + rng.randint(1, 121)
+                receiptdate = shipdate + rng.randint(1, 30)
+                returnflag = rng.choice('RA') if receiptdate <= current else 'N'
+                linestatus = 'O' if shipdate > current else 'F'
+                total += price * (1 + tax) * (1 - discount)
+                lineitems.append([orderkey, partkey, part_supplier(partkey, rng.randint(0, 3), self.suppliers),
+                                  linenumber, quantity, price, discount, tax, returnflag, linestatus,
+                                  dates[shipdate], dates[orderdate + rng.randint(30, 90)], dates[receiptdate],
+                                  rng.choice(SHIP_INSTRUCT), rng.choice(SHIP_MODES), _comment(rng, 3)])
+
+            statuses = {l[9] for l in lineitems}
+            status = statuses.pop() if len(statuses) == 1 else 'P'
+            comment = _comment(rng)
+            if rng.random() < 0.01:
+                comment += ' special %s requests' % rng.choice(WORDS)
+            order = [orderkey, custkey, status, round(total, 2), dates[orderdate], rng.choice(PRIORITIES),
+                     'Clerk#%09d' % rng.randint(1, max(1, self.suppliers // 10)), 0, comment]
+            yield order, lineitems
+
+
+def _write_csv(path, rows):
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w', newline='', encoding='utf8') as f:
+        csv.writer(f, lineterminator='\n').writerows(rows)
+    os.replace(tmp, path)
+
+
+def generate(data_dir, sf, seed=0):
+    """Writes the tables as CSV files into data_dir (without a header), unless they already exist
+
+    Returns a dict of {table_name: path}
+    """
+    data_dir = Path(data_dir)
+    paths = {name: data_dir / f'{name}.csv' for name in TABLES}
+    if all(p.exists() for p in paths.values()):
+        return paths
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    gen = _Generator(sf, seed)
+    for name in ['region', 'nation', 'supplier', 'customer', 'part', 'partsupp']:
+        print(f'Generating {name}..')
+        _write_csv(paths[name], getattr(gen, name)())
+
+    print('Generating orders and lineitem..')
+    tmp = paths['lineitem'].with_suffix('.tmp')
+    with open(tmp, 'w', newline='', encoding='utf8') as f:
+        lineitem_writer = csv.writer(f, lineterminator='\n')
+        def orders():
+            for order, lineitems in gen.orders_and_lineitems():
+                lineitem_writer.writerows(lineitems)
+                yield order
+        _write_csv(paths['orders'], orders())
+    os.replace(tmp, paths['lineitem'])
+
+    return paths
@@ -0,0 +1,518 @@
+"""
+The TPC-H queries, written in Preql, alongside their hand-written SQL (see test_tpch.py)
+
+Each query is a pair of (preql, sql). The Preql code may define names before its final
+expression. Both versions return the same columns in the same order, so their results
+can be compared. Q11 depends on the scale factor, through the 'fraction' parameter
+(a Preql variable, and ':fraction' in the SQL).
+
+The parameters are the validation parameters of the specification. Dates are strings (see
+tpch_dbgen.py), so date arithmetic is already applied to the constants, and years are
+extracted with substr(). Queries that order by a non-unique key before a limit have an
+added tie-breaker, so their results are deterministic.
+
+Preql has no correlated subqueries, so the Preql versions of Q2, Q11, Q15, Q17, Q20, Q21
+and Q22 compute them as grouped tables, and join with them instead.
+"""
+
+QUERIES = {}
+
+def query(name, preql, sql):
+    QUERIES[name] = preql.strip(), sql.strip()
+
+
+query('q01', '''
+lineitem[l_shipdate <= "1998-09-02"] {
+    l_returnflag, l_linestatus
+        =>
+    sum_qty: sum(l_quantity)
+    sum_base_price: sum(l_extendedprice)
+    sum_disc_price: sum(l_extendedprice * (1 - l_discount))
+    sum_charge: sum(l_extendedprice * (1 - l_discount) * (1 + l_tax))
+    avg_qty: mean(l_quantity)
+    avg_price: mean(l_extendedprice)
+    avg_disc: mean(l_discount)
+    count_order: count(l_orderkey)
+} order {l_returnflag, l_linestatus}
+''', '''
+SELECT l_returnflag, l_linestatus,
+    sum(l_quantity) AS sum_qty,
+    sum(l_extendedprice) AS sum_base_price,
+    sum(l_extendedprice * (1 - l_discount)) AS sum_disc_price,
+    sum(l_extendedprice * (1 - l_discount) * (1 + l_tax)) AS sum_charge,
+    avg(l_quantity) AS avg_qty,
+    avg(l_extendedprice) AS avg_price,
+    avg(l_discount) AS avg_disc,
+    count(*) AS count_order
+FROM lineitem
+WHERE l_shipdate <= '1998-09-02'
+GROUP BY l_returnflag, l_linestatus
+ORDER BY l_returnflag, l_linestatus
+''')
+
+
+query('q02', '''
+europe = joinall(s: supplier, n: nation, r: region)[
+    s.s_nationkey == n.n_nationkey, n.n_regionkey == r.r_regionkey, r.r_name == "EUROPE"
+] {...s, n.n_name}
+supply = joinall(ps: partsupp, s: europe)[ps.ps_suppkey == s.s_suppkey] {...ps, ...s}
+min_cost = supply{ps_partkey => min_cost: min(ps_supplycost)}
+
+joinall(p: part, e: supply, m: min_cost)[
+    p.p_size == 15, p.p_type like "%BRASS",
+    p.p_partkey == e.ps_partkey, m.ps_partkey == p.p_partkey, e.ps_supplycost == m.min_cost
+] {
+    e.s_acctbal, e.s_name, e.n_name, p.p_partkey, p.p_mfgr, e.s_address, e.s_phone, e.s_comment
+} order {^s_acctbal, n_name, s_name, p_partkey} [..100]
+''', '''
+SELECT s_acctbal, s_name, n_name, p_partkey, p_mfgr, s_address, s_phone, s_comment
+FROM part, supplier, partsupp, nation, region
+WHERE p_partkey = ps_partkey AND s_suppkey = ps_suppkey AND p_size = 15 AND p_type LIKE '%BRASS'
+    AND s_nationkey = n_nationkey AND n_regionkey = r_regionkey AND r_name = 'EUROPE'
+    AND ps_supplycost = (
+        SELECT min(ps_supplycost)
+        FROM partsupp, supplier, nation, region
+        WHERE p_partkey = ps_partkey AND s_suppkey = ps_suppkey AND s_nationkey = n_nationkey
+            AND n_regionkey = r_regionkey AND r_name = 'EUROPE'
+    )
+ORDER BY s_acctbal DESC, n_name, s_name, p_partkey
+LIMIT 100
+''')
+
+
+query('q03', '''
+joinall(c: customer, o: orders, l: lineitem)[
+    c.c_mktsegment == "BUILDING", c.c_custkey == o.o_custkey, l.l_orderkey == o.o_orderkey,
+    o.o_orderdate < "1995-03-15", l.l_shipdate > "1995-03-15"
+] {
+    l.l_orderkey, o.o_orderdate, o.o_shippriority
+        =>
+    revenue: sum(l.l_extendedprice * (1 - l.l_discount))
+} order {^revenue, o_orderdate, l_orderkey} [..10]
+''', '''
+SELECT l_orderkey, o_orderdate, o_shippriority, sum(l_extendedprice * (1 - l_discount)) AS revenue
+FROM customer, orders, lineitem
+WHERE c_mktsegment = 'BUILDING' AND c_custkey = o_custkey AND l_orderkey = o_orderkey
+    AND o_orderdate < '1995-03-15' AND l_shipdate > '1995-03-15'
+GROUP BY l_orderkey, o_orderdate, o_shippriority
+ORDER BY revenue DESC, o_orderdate, l_orderkey
+LIMIT 10
+''')
+
+
+query('q04', '''
+orders[
+    o_orderdate >= "1993-07-01", o_orderdate < "1993-10-01",
+    o_orderkey in lineitem[l_commitdate < l_receiptdate]{l_orderkey}
+] {o_orderpriority => order_count: count(o_orderkey)} order {o_orderpriority}
+''', '''
+SELECT o_orderpriority, count(*) AS order_count
+FROM orders
+WHERE o_orderdate >= '1993-07-01' AND o_orderdate < '1993-10-01'
+    AND EXISTS (SELECT * FROM lineitem WHERE l_orderkey = o_orderkey AND l_commitdate < l_receiptdate)
+GROUP BY o_orderpriority
+ORDER BY o_orderpriority
+''')
+
+
+query('q05', '''
+joinall(c: customer, o: orders, l: lineitem, s: supplier, n: nation, r: region)[
+    c.c_custkey == o.o_custkey, l.l_orderkey == o.o_orderkey, l.l_suppkey == s.s_suppkey,
+    c.c_nationkey == s.s_nationkey, s.s_nationkey == n.n_nationkey, n.n_regionkey == r.r_regionkey,
+    r.r_name == "ASIA", o.o_orderdate >= "1994-01-01", o.o_orderdate < "1995-01-01"
+] {n.n_name => revenue: sum(l.l_extendedprice * (1 - l.l_discount))} order {^revenue}
+''', '''
+SELECT n_name, sum(l_extendedprice * (1 - l_discount)) AS revenue
+FROM customer, orders, lineitem, supplier, nation, region
+WHERE c_custkey = o_custkey AND l_orderkey = o_orderkey AND l_suppkey = s_suppkey
+    AND c_nationkey = s_nationkey AND s_nationkey = n_nationkey AND n_regionkey = r_regionkey
+    AND r_name = 'ASIA' AND o_orderdate >= '1994-01-01' AND o_orderdate < '1995-01-01'
+GROUP BY n_name
+ORDER BY revenue DESC
+''')
+
+
+query('q06', '''
+lineitem[
+    l_shipdate >= "1994-01-01", l_shipdate < "1995-01-01",
+    l_discount >= 0.05, l_discount <= 0.07, l_quantity < 24
+] {=> revenue: sum(l_extendedprice * l_discount)}
+''', '''
+SELECT sum(l_extendedprice * l_discount) AS revenue
+FROM lineitem
+WHERE l_shipdate >= '1994-01-01' AND l_shipdate < '1995-01-01'
+    AND l_discount BETWEEN 0.05 AND 0.07 AND l_quantity < 24
+''')
+
+
+query('q07', '''
+joinall(s: supplier, l: lineitem, o: orders, c: customer, n1: nation, n2: nation)[
+    s.s_suppkey == l.l_suppkey, o.o_orderkey == l.l_orderkey, c.c_custkey == o.o_custkey,
+    s.s_nationkey == n1.n_nationkey, c.c_nationkey == n2.n_nationkey,
+    n1.n_name in ["FRANCE", "GERMANY"], n2.n_name in ["FRANCE", "GERMANY"], n1.n_name != n2.n_name,
+    l.l_shipdate >= "1995-01-01", l.l_shipdate <= "1996-12-31"
+] {
+    supp_nation: n1.n_name, cust_nation: n2.n_name, l_year: l.l_shipdate[..4]
+        =>
+    revenue: sum(l.l_extendedprice * (1 - l.l_discount))
+} order {supp_nation, cust_nation, l_year}
+''', '''
+SELECT supp_nation, cust_nation, l_year, sum(volume) AS revenue
+FROM (
+    SELECT n1.n_name AS supp_nation, n2.n_name AS cust_nation, substr(l_shipdate, 1, 4) AS l_year,
+        l_extendedprice * (1 - l_discount) AS volume
+    FROM supplier, lineitem, orders, customer, nation n1, nation n2
+    WHERE s_suppkey = l_suppkey AND o_orderkey = l_orderkey AND c_custkey = o_custkey
+        AND s_nationkey = n1.n_nationkey AND c_nationkey = n2.n_nationkey
+        AND ((n1.n_name = 'FRANCE' AND n2.n_name = 'GERMANY') OR (n1.n_name = 'GERMANY' AND n2.n_name = 'FRANCE'))
+        AND l_shipdate BETWEEN '1995-01-01' AND '1996-12-31'
+) AS shipping
+GROUP BY supp_nation, cust_nation, l_year
+ORDER BY supp_nation, cust_nation, l_year
+''')
+
+
+query('q08', '''
+all_nations = joinall(p: part, s: supplier, l: lineitem, o: orders, c: customer, n1: nation, n2: nation, r: region)[
+    p.p_partkey == l.l_partkey, s.s_suppkey == l.l_suppkey, l.l_orderkey == o.o_orderkey,
+    o.o_custkey == c.c_custkey, c.c_nationkey == n1.n_nationkey, n1.n_regionkey == r.r_regionkey,
+    r.r_name == "AMERICA", s.s_nationkey == n2.n_nationkey,
+    o.o_orderdate >= "1995-01-01", o.o_orderdate <= "1996-12-31", p.p_type == "ECONOMY ANODIZED STEEL"
+] {
+    o_year: o.o_orderdate[..4]
+    volume: l.l_extendedprice * (1 - l.l_discount)
+    nation: n2.n_name
+}
+
+all_nations {o_year => mkt_share: sum(volume * int(nation == "BRAZIL")) / sum(volume)} order {o_year}
+''', '''
+SELECT o_year, sum(CASE WHEN nation = 'BRAZIL' THEN volume ELSE 0 END) / sum(volume) AS mkt_share
+FROM (
+    SELECT substr(o_orderdate, 1, 4) AS o_year, l_extendedprice * (1 - l_discount) AS volume, n2.n_name AS nation
+    FROM part, supplier, lineitem, orders, customer, nation n1, nation n2, region
+    WHERE p_partkey = l_partkey AND s_suppkey = l_suppkey AND l_orderkey = o_orderkey
+        AND o_custkey = c_custkey AND c_nationkey = n1.n_nationkey AND n1.n_regionkey = r_regionkey
+        AND r_name = 'AMERICA' AND s_nationkey = n2.n_nationkey
+        AND o_orderdate BETWEEN '1995-01-01' AND '1996-12-31' AND p_type = 'ECONOMY ANODIZED STEEL'
+) AS all_nations
+GROUP BY o_year
+ORDER BY o_year
+''')
+
+
+query('q09', '''
+joinall(p: part, s: supplier, l: lineitem, ps: partsupp, o: orders, n: nation)[
+    s.s_suppkey == l.l_suppkey, ps.ps_suppkey == l.l_suppkey, ps.ps_partkey == l.l_partkey,
+    p.p_partkey == l.l_partkey, o.o_orderkey == l.l_orderkey, s.s_nationkey == n.n_nationkey,
+    p.p_name like "%green%"
+] {
+    nation: n.n_name, o_year: o.o_orderdate[..4]
+        =>
+    sum_profit: sum(l.l_extendedprice * (1 - l.l_discount) - ps.ps_supplycost * l.l_quantity)
+} order {nation, ^o_year}
+''', '''
+SELECT nation, o_year, sum(amount) AS sum_profit
+FROM (
+    SELECT n_name AS nation, substr(o_orderdate, 1, 4) AS o_year,
+        l_extendedprice * (1 - l_discount) - ps_supplycost * l_quantity AS amount
+    FROM part, supplier, lineitem, partsupp, orders, nation
+    WHERE s_suppkey = l_suppkey AND ps_suppkey = l_suppkey AND ps_partkey = l_partkey
+        AND p_partkey = l_partkey AND o_orderkey = l_orderkey AND s_nationkey = n_nationkey
+        AND p_name LIKE '%green%'
+) AS profit
+GROUP BY nation, o_year
+ORDER BY nation, o_year DESC
+''')
+
+
+query('q10', '''
+joinall(c: customer, o: orders, l: lineitem, n: nation)[
+    c.c_custkey == o.o_custkey, l.l_orderkey == o.o_orderkey,
+    o.o_orderdate >= "1993-10-01", o.o_orderdate < "1994-01-01",
+    l.l_returnflag == "R", c.c_nationkey == n.n_nationkey
+] {
+    c.c_custkey, c.c_name, c.c_acctbal, n.n_name, c.c_address, c.c_phone, c.c_comment
+        =>
+    revenue: sum(l.l_extendedprice * (1 - l.l_discount))
+} order {^revenue, c_custkey} [..20]
+''', '''
+SELECT c_custkey, c_name, c_acctbal, n_name, c_address, c_phone, c_comment,
+    sum(l_extendedprice * (1 - l_discount)) AS revenue
+FROM customer, orders, lineitem, nation
+WHERE c_custkey = o_custkey AND l_orderkey = o_orderkey
+    AND o_orderdate >= '1993-10-01' AND o_orderdate < '1994-01-01'
+    AND l_returnflag = 'R' AND c_nationkey = n_nationkey
+GROUP BY c_custkey, c_name, c_acctbal, n_name, c_address, c_phone, c_comment
+ORDER BY revenue DESC, c_custkey
+LIMIT 20
+''')
+
+
+query('q11', '''
+german = joinall(ps: partsupp, s: supplier, n: nation)[
+    ps.ps_suppkey == s.s_suppkey, s.s_nationkey == n.n_nationkey, n.n_name == "GERMANY"
+] {ps.ps_partkey, value: ps.ps_supplycost * ps.ps_availqty}
+
+joinall(g: german{ps_partkey => value: sum(value)}, t: german{=> total: sum(value)})[
+    g.value > t.total * fraction
+] {g.ps_partkey, g.value} order {^value, ps_partkey}
+''', '''
+SELECT ps_partkey, sum(ps_supplycost * ps_availqty) AS value
+FROM partsupp, supplier, nation
+WHERE ps_suppkey = s_suppkey AND s_nationkey = n_nationkey AND n_name = 'GERMANY'
+GROUP BY ps_partkey
+HAVING sum(ps_supplycost * ps_availqty) > (
+    SELECT sum(ps_supplycost * ps_availqty) * :fraction
+    FROM partsupp, supplier, nation
+    WHERE ps_suppkey = s_suppkey AND s_nationkey = n_nationkey AND n_name = 'GERMANY'
+)
+ORDER BY value DESC, ps_partkey
+''')
+
+
+query('q12', '''
+joinall(o: orders, l: lineitem)[
+    o.o_orderkey == l.l_orderkey, l.l_shipmode in ["MAIL", "SHIP"],
+    l.l_commitdate < l.l_receiptdate, l.l_shipdate < l.l_commitdate,
+    l.l_receiptdate >= "1994-01-01", l.l_receiptdate < "1995-01-01"
+] {
+    l.l_shipmode, high: int(o.o_orderpriority in ["1-URGENT", "2-HIGH"])
+} {
+    l_shipmode => high_line_count: sum(high), low_line_count: sum(1 - high)
+} order {l_shipmode}
+''', '''
+SELECT l_shipmode,
+    sum(CASE WHEN o_orderpriority = '1-URGENT' OR o_orderpriority = '2-HIGH' THEN 1 ELSE 0 END) AS high_line_count,
+    sum(CASE WHEN o_orderpriority <> '1-URGENT' AND o_orderpriority <> '2-HIGH' THEN 1 ELSE 0 END) AS low_line_count
+FROM orders, lineitem
+WHERE o_orderkey = l_orderkey AND l_shipmode IN ('MAIL', 'SHIP')
+    AND l_commitdate < l_receiptdate AND l_shipdate < l_commitdate
+    AND l_receiptdate >= '1994-01-01' AND l_receiptdate < '1995-01-01'
+GROUP BY l_shipmode
+ORDER BY l_shipmode
+''')
+
+
+query('q13', '''
+customer_orders = leftjoin(c: customer.c_custkey, o: orders[not (o_comment like "%special%requests%")].o_custkey)
+
+customer_orders {c.c_custkey => c_count: count(o.o_orderkey)} {
+    c_count => custdist: count(c_custkey)
+} order {^custdist, ^c_count}
+''', '''
+SELECT c_count, count(*) AS custdist
+FROM (
+    SELECT c_custkey, count(o_orderkey) AS c_count
+    FROM customer LEFT OUTER JOIN orders ON c_custkey = o_custkey AND o_comment NOT LIKE '%special%requests%'
+    GROUP BY c_custkey
+) AS c_orders
+GROUP BY c_count
+ORDER BY custdist DESC, c_count DESC
+''')
+
+
+query('q14', '''
+joinall(l: lineitem, p: part)[
+    l.l_partkey == p.p_partkey, l.l_shipdate >= "1995-09-01", l.l_shipdate < "1995-10-01"
+] {
+    volume: l.l_extendedprice * (1 - l.l_discount), promo: int(p.p_type like "PROMO%")
+} {
+    => promo_revenue: 100.0 * sum(volume * promo) / sum(volume)
+}
+''', '''
+SELECT 100.0 * sum(CASE WHEN p_type LIKE 'PROMO%' THEN l_extendedprice * (1 - l_discount) ELSE 0 END)
+    / sum(l_extendedprice * (1 - l_discount)) AS promo_revenue
+FROM lineitem, part
+WHERE l_partkey = p_partkey AND l_shipdate >= '1995-09-01' AND l_shipdate < '1995-10-01'
+''')
+
+
+query('q15', '''
+revenue0 = lineitem[l_shipdate >= "1996-01-01", l_shipdate < "1996-04-01"] {
+    supplier_no: l_suppkey => total_revenue: sum(l_extendedprice * (1 - l_discount))
+}
+
+joinall(s: supplier, r: revenue0, m: revenue0{=> max_revenue: max(total_revenue)})[
+    s.s_suppkey == r.supplier_no, r.total_revenue == m.max_revenue
+] {s.s_suppkey, s.s_name, s.s_address, s.s_phone, r.total_revenue} order {s_suppkey}
+''', '''
+WITH revenue0 AS (
+    SELECT l_suppkey AS supplier_no, sum(l_extendedprice * (1 - l_discount)) AS total_revenue
+    FROM lineitem
+    WHERE l_shipdate >= '1996-01-01' AND l_shipdate < '1996-04-01'
+    GROUP BY l_suppkey
+)
+SELECT s_suppkey, s_name, s_address, s_phone, total_revenue
+FROM supplier, revenue0
+WHERE s_suppkey = supplier_no AND total_revenue = (SELECT max(total_revenue) FROM revenue0)
+ORDER BY s_suppkey
+''')
+
+
+query('q16', '''
+joinall(ps: partsupp, p: part)[
+    p.p_partkey == ps.ps_partkey, p.p_brand != "Brand#45", not (p.p_type like "MEDIUM POLISHED%"),
+    p.p_size in [49, 14, 23, 45, 19, 3, 36, 9],
+    ps.ps_suppkey !in supplier[s_comment like "%Customer%Complaints%"]{s_suppkey}
+] {
+    p.p_brand, p.p_type, p.p_size, ps.ps_suppkey =>
+} {
+    p_brand, p_type, p_size => supplier_cnt: count(ps_suppkey)
+} order {^supplier_cnt, p_brand, p_type, p_size}
+''', '''
+SELECT p_brand, p_type, p_size, count(DISTINCT ps_suppkey) AS supplier_cnt
+FROM partsupp, part
+WHERE p_partkey = ps_partkey AND p_brand <> 'Brand#45' AND p_type NOT LIKE 'MEDIUM POLISHED%'
+    AND p_size IN (49, 14, 23, 45, 19, 3, 36, 9)
+    AND ps_suppkey NOT IN (SELECT s_suppkey FROM supplier WHERE s_comment LIKE '%Customer%Complaints%')
+GROUP BY p_brand, p_type, p_size
+ORDER BY supplier_cnt DESC, p_brand, p_type, p_size
+''')
+
+
+query('q17', '''
+joinall(l: lineitem, p: part, a: lineitem{l_partkey => avg_qty: mean(l_quantity)})[
+    p.p_partkey == l.l_partkey, p.p_brand == "Brand#23", p.p_container == "MED BOX",
+    a.l_partkey == p.p_partkey, l.l_quantity < 0.2 * a.avg_qty
+] {=> avg_yearly: sum(l.l_extendedprice) / 7.0}
+''', '''
+SELECT sum(l_extendedprice) / 7.0 AS avg_yearly
+FROM lineitem, part
+WHERE p_partkey = l_partkey AND p_brand = 'Brand#23' AND p_container = 'MED BOX'
+    AND l_quantity < (SELECT 0.2 * avg(l_quantity) FROM lineitem WHERE l_partkey = p_partkey)
+''')
+
+
+query('q18', '''
+large_orders = lineitem{l_orderkey => quantity: sum(l_quantity)}[quantity > 300]{l_orderkey}
+
+joinall(c: customer, o: orders, l: lineitem)[
+    o.o_orderkey in large_orders, c.c_custkey == o.o_custkey, o.o_orderkey == l.l_orderkey
+] {
+    c.c_name, c.c_custkey, o.o_orderkey, o.o_orderdate, o.o_totalprice
+        =>
+    total_qty: sum(l.l_quantity)
+} order {^o_totalprice, o_orderdate, o_orderkey} [..100]
+''', '''
+SELECT c_name, c_custkey, o_orderkey, o_orderdate, o_totalprice, sum(l_quantity) AS total_qty
+FROM customer, orders, lineitem
+WHERE o_orderkey IN (SELECT l_orderkey FROM lineitem GROUP BY l_orderkey HAVING sum(l_quantity) > 300)
+    AND c_custkey = o_custkey AND o_orderkey = l_orderkey
+GROUP BY c_name, c_custkey, o_orderkey, o_orderdate, o_totalprice
+ORDER BY o_totalprice DESC, o_orderdate, o_orderkey
+LIMIT 100
+''')
+
+
+query('q19', '''
+joinall(l: lineitem, p: part)[
+    p.p_partkey == l.l_partkey, l.l_shipmode in ["AIR", "AIR REG"], l.l_shipinstruct == "DELIVER IN PERSON",
+    (
+        p.p_brand == "Brand#12" and p.p_container in ["SM CASE", "SM BOX", "SM PACK", "SM PKG"]
+        and l.l_quantity >= 1 and l.l_quantity <= 11 and p.p_size >= 1 and p.p_size <= 5
+    ) or (
+        p.p_brand == "Brand#23" and p.p_container in ["MED BAG", "MED BOX", "MED PKG", "MED PACK"]
+        and l.l_quantity >= 10 and l.l_quantity <= 20 and p.p_size >= 1 and p.p_size <= 10
+    ) or (
+        p.p_brand == "Brand#34" and p.p_container in ["LG CASE", "LG BOX", "LG PACK", "LG PKG"]
+        and l.l_quantity >= 20 and l.l_quantity <= 30 and p.p_size >= 1 and p.p_size <= 15
+    )
+] {=> revenue: sum(l.l_extendedprice * (1 - l.l_discount))}
+''', '''
+SELECT sum(l_extendedprice * (1 - l_discount)) AS revenue
+FROM lineitem, part
+WHERE (
+        p_partkey = l_partkey AND p_brand = 'Brand#12' AND p_container IN ('SM CASE', 'SM BOX', 'SM PACK', 'SM PKG')
+        AND l_quantity >= 1 AND l_quantity <= 11 AND p_size BETWEEN 1 AND 5
+        AND l_shipmode IN ('AIR', 'AIR REG') AND l_shipinstruct = 'DELIVER IN PERSON'
+    ) OR (
+        p_partkey = l_partkey AND p_brand = 'Brand#23' AND p_container IN ('MED BAG', 'MED BOX', 'MED PKG', 'MED PACK')
+        AND l_quantity >= 10 AND l_quantity <= 20 AND p_size BETWEEN 1 AND 10
+        AND l_shipmode IN ('AIR', 'AIR REG') AND l_shipinstruct = 'DELIVER IN PERSON'
+    ) OR (
+        p_partkey = l_partkey AND p_brand = 'Brand#34' AND p_container IN ('LG CASE', 'LG BOX', 'LG PACK', 'LG PKG')
+        AND l_quantity >= 20 AND l_quantity <= 30 AND p_size BETWEEN 1 AND 15
+        AND l_shipmode IN ('AIR', 'AIR REG') AND l_shipinstruct = 'DELIVER IN PERSON'
+    )
+''')
+
+
+query('q20', '''
+shipped = lineitem[l_shipdate >= "1994-01-01", l_shipdate < "1995-01-01"] {
+    l_partkey, l_suppkey => quantity: sum(l_quantity)
+}
+excess = joinall(ps: partsupp, sh: shipped)[
+    ps.ps_partkey in part[p_name like "forest%"]{p_partkey},
+    sh.l_partkey == ps.ps_partkey, sh.l_suppkey == ps.ps_suppkey, ps.ps_availqty > 0.5 * sh.quantity
+] {ps.ps_suppkey}
+
+joinall(s: supplier, n: nation)[
+    s.s_suppkey in excess, s.s_nationkey == n.n_nationkey, n.n_name == "CANADA"
+] {s.s_name, s.s_address} order {s_name}
+''', '''
+SELECT s_name, s_address
+FROM supplier, nation
+WHERE s_suppkey IN (
+        SELECT ps_suppkey FROM partsupp
+        WHERE ps_partkey IN (SELECT p_partkey FROM part WHERE p_name LIKE 'forest%')
+            AND ps_availqty > (
+                SELECT 0.5 * sum(l_quantity) FROM lineitem
+                WHERE l_partkey = ps_partkey AND l_suppkey = ps_suppkey
+                    AND l_shipdate >= '1994-01-01' AND l_shipdate < '1995-01-01'
+            )
+    )
+    AND s_nationkey = n_nationkey AND n_name = 'CANADA'
+ORDER BY s_name
+''')
+
+
+query('q21', '''
+late = lineitem[l_receiptdate > l_commitdate]
+multi_supplier = lineitem{l_orderkey, l_suppkey =>}{l_orderkey => n: count(l_suppkey)}[n > 1]{l_orderkey}
+single_late = late{l_orderkey, l_suppkey =>}{l_orderkey => n: count(l_suppkey)}[n == 1]{l_orderkey}
+
+joinall(s: supplier, l1: late, o: orders, n: nation)[
+    s.s_suppkey == l1.l_suppkey, o.o_orderkey == l1.l_orderkey, o.o_orderstatus == "F",
+    l1.l_orderkey in multi_supplier, l1.l_orderkey in single_late,
+    s.s_nationkey == n.n_nationkey, n.n_name == "SAUDI ARABIA"
+] {s.s_name => numwait: count(l1.l_orderkey)} order {^numwait, s_name} [..100]
+''', '''
+SELECT s_name, count(*) AS numwait
+FROM supplier, lineitem l1, orders, nation
+WHERE s_suppkey = l1.l_suppkey AND o_orderkey = l1.l_orderkey AND o_orderstatus = 'F'
+    AND l1.l_receiptdate > l1.l_commitdate
+    AND EXISTS (SELECT * FROM lineitem l2 WHERE l2.l_orderkey = l1.l_orderkey AND l2.l_suppkey <> l1.l_suppkey)
+    AND NOT EXISTS (
+        SELECT * FROM lineitem l3
+        WHERE l3.l_orderkey = l1.l_orderkey AND l3.l_suppkey <> l1.l_suppkey AND l3.l_receiptdate > l3.l_commitdate
+    )
+    AND s_nationkey = n_nationkey AND n_name = 'SAUDI ARABIA'
+GROUP BY s_name
+ORDER BY numwait DESC, s_name
+LIMIT 100
+''')
+
+
+query('q22', '''
+customers = customer {cntrycode: c_phone[..2], c_custkey, c_acctbal} [
+    cntrycode in ["13", "31", "23", "29", "30", "18", "17"]
+]
+
+joinall(c: customers, a: customers[c_acctbal > 0.0]{=> avg_acctbal: mean(c_acctbal)})[
+    c.c_acctbal > a.avg_acctbal, c.c_custkey !in orders{o_custkey}
+] {c.cntrycode => numcust: count(c.c_custkey), totacctbal: sum(c.c_acctbal)} order {cntrycode}
+''', '''
+SELECT cntrycode, count(*) AS numcust, sum(c_acctbal) AS totacctbal
+FROM (
+    SELECT substr(c_phone, 1, 2) AS cntrycode, c_acctbal
+    FROM customer
+    WHERE substr(c_phone, 1, 2) IN ('13', '31', '23', '29', '30', '18', '17')
+        AND c_acctbal > (
+            SELECT avg(c_acctbal) FROM customer
+            WHERE c_acctbal > 0.00 AND substr(c_phone, 1, 2) IN ('13', '31', '23', '29', '30', '18', '17')
+        )
+        AND NOT EXISTS (SELECT * FROM orders WHERE o_custkey = c_custkey)
+) AS custsale
+GROUP BY cntrycode
+ORDER BY cntrycode
+''')
@@ -3,6 +3,13 @@ from . import _base_imports
 from .api import Preql, T
 from .core.exceptions import Signal
 
+def __getattr__(name):
+    # Imported on first use, so applications that don't use asyncio don't pay for importing it
+    if name == 'AsyncPreql':
+        from .async_api import AsyncPreql
+        return AsyncPreql
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # import importlib.metadata as importlib_metadata
 # __version__ = importlib_metadata.version("prql")
 __version__ = "0.2.16"
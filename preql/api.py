@@ -9,6 +9,7 @@ from .core.pql_types import T
 from .sql_interface import create_engine
 from .utils import dsp
 from .core.exceptions import Signal
+from .core.profiler import Profiler
 
 from .core import display
 display.install_reprs()
@@ -52,8 +53,18 @@ class TablePromise:
 
     def to_pandas(self):
         "Returns table as a Pandas dataframe (requires pandas installed)"
-        from pandas import DataFrame
-        return DataFrame(self)
+        return self._interp.fetch_columns(self._inst, 'pandas')
+
+    def to_numpy(self):
+        """Returns table as a NumPy record array, with a typed array for each column (requires numpy installed)
+
+        Lists are returned as a regular array.
+        """
+        return self._interp.fetch_columns(self._inst, 'numpy')
+
+    def to_arrow(self):
+        "Returns table as a PyArrow table (requires pyarrow installed)"
+        return self._interp.fetch_columns(self._inst, 'arrow')
 
     def __eq__(self, other):
         """Compare the table to a JSON representation of it as list of objects
@@ -68,7 +79,16 @@ class TablePromise:
         return self._interp.cast_to_python(count)
 
     def __iter__(self):
-        return iter(self.to_json())
+        if self._rows is not None:
+            return iter(self._rows)
+        return self.iter_rows()
+
+    def iter_rows(self, batch_size=None):
+        """Returns an iterator over the rows of the table, without loading all of them into memory.
+
+        Rows are fetched from the database in batches of ``batch_size`` (default defined in settings)
+        """
+        return self._interp.stream_table(self._inst, batch_size)
 
     def __getitem__(self, index):
         "Run a slice query on table"
@@ -227,6 +247,25 @@ class Preql:
 
         self.commit()
 
+    @contextmanager
+    def profile(self):
+        """Profile the code that runs inside the block
+
+        Yields a Profiler, which collects the time spent in each statement and function call,
+        by phase (parse, compile, execute, etc.).
+
+        Example:
+            >>> with p.profile() as prof:
+            ...     p.load('script.pql')
+            >>> print(prof.report())
+        """
+        profiler = Profiler()
+        self._interp.set_profiler(profiler)
+        try:
+            yield profiler
+        finally:
+            self._interp.set_profiler(None)
+
     def start_repl(self, *args):
         "Run the interactive prompt"
         from .repl import start_repl
@@ -0,0 +1,216 @@
+import asyncio
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from . import settings
+from .api import Preql, TablePromise
+from .utils import dsp
+
+
+class _Worker:
+    "A thread that runs the calls of the AsyncPreql instances assigned to it"
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='preql-async')
+        self.instances = 0
+
+_workers = []
+_workers_lock = threading.Lock()
+
+def _assign_worker():
+    # Shared by all instances, so the number of threads is bounded (see settings.async_max_workers),
+    # regardless of how many instances there are
+    with _workers_lock:
+        idle = [w for w in _workers if not w.instances]
+        if idle:
+            worker = idle[0]
+        elif len(_workers) < settings.async_max_workers:
+            worker = _Worker()
+            _workers.append(worker)
+        else:
+            worker = min(_workers, key=lambda w: w.instances)
+        worker.instances += 1
+        return worker
+
+
+class _Runner:
+    """Runs blocking calls on the worker thread of an instance, one at a time
+
+    An interpreter can't run code concurrently, and a transaction must run all its statements on the same thread.
+    """
+
+    def __init__(self):
+        self._worker = _assign_worker()
+
+    def run_sync(self, f, *args):
+        return self._worker.executor.submit(f, *args).result()
+
+    async def run(self, f, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._worker.executor, partial(f, *args))
+
+    def release(self):
+        "Lets other instances use the worker"
+        with _workers_lock:
+            if self._worker is not None:
+                self._worker.instances -= 1
+                self._worker = None
+
+
+class AsyncTablePromise:
+    """Returned by AsyncPreql whenever the result is a table
+
+    Like TablePromise, but fetching values must be awaited.
+    """
+
+    def __init__(self, runner, table):
+        self._runner = runner
+        self._table = table
+
+    @property
+    def type(self):
+        return self._table.type
+
+    async def to_json(self):
+        "Returns table as a list of rows, i.e. ``[{col1: value, col2: value, ...}, ...]``"
+        return await self._runner.run(self._table.to_json)
+
+    async def to_pandas(self):
+        "Returns table as a Pandas dataframe (requires pandas installed)"
+        return await self._runner.run(self._table.to_pandas)
+
+    async def to_numpy(self):
+        "Returns table as a NumPy record array (requires numpy installed)"
+        return await self._runner.run(self._table.to_numpy)
+
+    async def to_arrow(self):
+        "Returns table as a PyArrow table (requires pyarrow installed)"
+        return await self._runner.run(self._table.to_arrow)
+
+    async def count(self):
+        "Run a count query on table"
+        return await self._runner.run(len, self._table)
+
+    async def get(self, index):
+        "Run a slice query on table. Returns a row, or an AsyncTablePromise when given a slice."
+        res = await self._runner.run(self._table.__getitem__, index)
+        if isinstance(res, TablePromise):
+            return AsyncTablePromise(self._runner, res)
+        return res
+
+    def __aiter__(self):
+        return self.iter_rows()
+
+    async def iter_rows(self, batch_size=None):
+        """Iterates over the rows of the table, without loading all of them into memory.
+
+        Rows are fetched from the database in batches of ``batch_size`` (default defined in settings)
+        """
+        batch_size = batch_size or settings.stream_batch_size
+        rows = await self._runner.run(self._table.iter_rows, batch_size)
+        while True:
+            batch = await self._runner.run(list, itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            for row in batch:
+                yield row
+
+    def __repr__(self):
+        return repr(self._table)
+
+
+@dsp
+def from_python(value: AsyncTablePromise):
+    return value._table._inst
+
+
+class AsyncPreql:
+    """Provides an asyncio API to run Preql code from Python
+
+    Code runs in a bounded pool of threads (see ``settings.async_max_workers``),
+    so it doesn't block the event loop. Each instance runs one call at a time,
+    and all of its calls run on the same thread.
+
+    Example:
+        >>> p = await AsyncPreql.connect()
+        >>> await p('[1, 2]{item+1}')
+        [2, 3]
+    """
+
+    def __init__(self, *args, **kwargs):
+        "Initialize a new AsyncPreql instance. Accepts the same parameters as Preql()"
+        self._runner = _Runner()
+        self._preql = self._runner.run_sync(partial(Preql, *args, **kwargs))
+
+    @classmethod
+    async def connect(cls, *args, **kwargs):
+        "Like AsyncPreql(), but connects to the database without blocking the event loop"
+        self = cls.__new__(cls)
+        self._runner = _Runner()
+        self._preql = await self._runner.run(partial(Preql, *args, **kwargs))
+        return self
+
+    def __repr__(self):
+        return f'Async{self._preql!r}'
+
+    def _wrap_result(self, res):
+        if isinstance(res, TablePromise):
+            return AsyncTablePromise(self._runner, res)
+        return res
+
+    async def __call__(self, code, **args):
+        res = await self._runner.run(partial(self._preql, code, **args))
+        return self._wrap_result(res)
+
+    async def call(self, fname, *args, **kwargs):
+        "Call the Preql function ``fname`` with the given arguments"
+        def call():
+            return getattr(self._preql, fname)(*args, **kwargs)
+        res = await self._runner.run(call)
+        return self._wrap_result(res)
+
+    async def load(self, filename, rel_to=None):
+        "Load a Preql script (see Preql.load)"
+        return await self._runner.run(self._preql.load, filename, rel_to)
+
+    async def import_pandas(self, **dfs):
+        "Import pandas.DataFrame instances into SQL tables (see Preql.import_pandas)"
+        return await self._runner.run(partial(self._preql.import_pandas, **dfs))
+
+    async def commit(self):
+        return await self._runner.run(self._preql.commit)
+
+    async def rollback(self):
+        return await self._runner.run(self._preql.rollback)
+
+    def transaction(self):
+        "Returns an async context manager, that commits when the block ends, or rolls back on error"
+        return _AsyncTransaction(self)
+
+    async def close(self):
+        try:
+            return await self._runner.run(self._preql.close)
+        finally:
+            self._runner.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class _AsyncTransaction:
+    def __init__(self, pql):
+        self._pql = pql
+
+    async def __aenter__(self):
+        return self._pql
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self._pql.commit()
+        else:
+            await self._pql.rollback()
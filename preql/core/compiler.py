@@ -457,12 +457,54 @@ def compile_to_inst(res: ast.ResolveParameters):
     require_access(AccessLevels.WRITE_DB)
 
     sq2 = SafeDict()
-    code = _resolve_sql_parameters(obj.code, subqueries=sq2)
-    subqueries = {k: _resolve_sql_parameters(v, subqueries=sq2) for k, v in obj.subqueries.items()}
+    code = _resolve_tree_parameters(obj.code, sq2)
+    subqueries = {k: _resolve_tree_parameters(v, sq2) for k, v in obj.subqueries.items()}
 
     return obj.replace(code=code, subqueries=SafeDict(subqueries).update(sq2))
 
 
+def _resolve_parameter(param, subqueries):
+    "Returns a BoundParameter for simple values, or else the instance of the parameter"
+    inst = evaluate( get_var(param.name))
+    if inst.type != param.type:
+        msg = f"Internal error: Parameter is of wrong type ({param.type} != {inst.type})"
+        raise Signal.make(T.CastError, None, msg)
+    if _is_bindable(inst):
+        # Keep the code identical between calls, and let the driver pass the value
+        return sql.BoundParameter(inst.type, inst.local_value)
+    subqueries.update(inst.subqueries)
+    return inst
+
+def _resolve_tree_parameters(obj, subqueries):
+    """Returns the SQL tree with its parameters replaced by their values
+
+    Unlike _resolve_sql_parameters(), it keeps the structure of the tree, so the optimizer can still rewrite it.
+    Nodes without parameters are reused as-is.
+    """
+    if isinstance(obj, sql.Parameter):
+        res = _resolve_parameter(obj, subqueries)
+        return res if isinstance(res, sql.BoundParameter) else res.code
+    elif isinstance(obj, sql.CompiledSQL):
+        if any(isinstance(c, sql.Parameter) for c in obj.code):
+            return _resolve_sql_parameters(obj, subqueries=subqueries)
+        return obj
+    elif isinstance(obj, sql.Sql):
+        changes = {}
+        for name, value in obj:
+            new_value = _resolve_tree_parameters(value, subqueries)
+            if new_value is not value:
+                changes[name] = new_value
+        return obj.replace(**changes) if changes else obj
+    elif isinstance(obj, (list, tuple)):
+        items = [_resolve_tree_parameters(i, subqueries) for i in obj]
+        if any(new is not old for new, old in zip(items, obj)):
+            return type(obj)(items)
+    elif isinstance(obj, dict):
+        items = {k: _resolve_tree_parameters(v, subqueries) for k, v in obj.items()}
+        if any(items[k] is not v for k, v in obj.items()):
+            return items
+    return obj
+
 def _resolve_sql_parameters(compiled_sql, wrap=False, subqueries=None):
     qb = sql.QueryBuilder(False)
 
@@ -472,12 +514,11 @@ def _resolve_sql_parameters(compiled_sql, wrap=False, subqueries=None):
     new_code = []
     for c in compiled_sql.code:
         if isinstance(c, sql.Parameter):
-            inst = evaluate( get_var(c.name))
-            if inst.type != c.type:
-                msg = f"Internal error: Parameter is of wrong type ({c.type} != {inst.type})"
-                raise Signal.make(T.CastError, None, msg)
-            new_code += inst.code.compile_wrap(qb).code
-            subqueries.update(inst.subqueries)
+            res = _resolve_parameter(c, subqueries)
+            if isinstance(res, sql.BoundParameter):
+                new_code.append(res)
+            else:
+                new_code += res.code.compile_wrap(qb).code
         else:
             new_code.append(c)
 
@@ -486,6 +527,11 @@ def _resolve_sql_parameters(compiled_sql, wrap=False, subqueries=None):
         res = res.wrap(qb)
     return res
 
+def _is_bindable(inst):
+    return (isinstance(inst, objects.ValueInstance)
+            and inst.local_value is not None
+            and inst.type <= T.union[T.int, T.float, T.string, T.text])
+
 
 
 
@@ -1,9 +1,5 @@
 import html
 
-import rich.table
-import rich.text
-import rich.console
-import rich.markup
 
 from .exceptions import Signal
 from .pql_types import T, ITEM_NAME
@@ -44,6 +40,7 @@ def pql_repr(t: T.string, value):
     if get_display().format == 'html':
         res = html.escape(res)
     elif get_display().format == 'rich':
+        import rich.markup, rich.text
         color_string = color_theme['string']
         res = rich.markup.escape(res)
         return rich.text.Text.from_markup(f'[{color_string}]{res}[/{color_string}]')
@@ -57,6 +54,7 @@ def pql_repr(t: T.text, value):
 
 @dp_type
 def pql_repr(t: T._rich, value):
+    import rich.text
     r = rich.text.Text.from_markup(str(value))
     if get_display().format == 'html':
         return _rich_to_html(r)
@@ -72,6 +70,7 @@ def pql_repr(t: T.nulltype, value):
 
 
 def _rich_to_html(r):
+    import rich.console
     console = rich.console.Console(record=True)
     console.print(r)
     return console.export_html(code_format='<style>{stylesheet}</style><pre>{code}</pre>').replace('━', '-')
@@ -126,6 +125,7 @@ def _rich_table(name, count_str, rows, offset, has_more, colors=True, show_foote
     if not rows:
         return header
 
+    import rich.table, rich.text, rich.markup
     table = rich.table.Table(title=rich.text.Text(header), show_footer=show_footer, min_width=len(header))
 
     # TODO enable/disable styling
@@ -154,6 +154,7 @@ def _rich_table(name, count_str, rows, offset, has_more, colors=True, show_foote
 
 _g_last_table = None
 _g_last_offset = 0
+_g_last_count = None    # (table, count_str), so paging through a table doesn't count it again
 
 
 def _table_name(table):
@@ -163,38 +164,48 @@ def _table_name(table):
         return ''
 
 def _preview_table(table, size, offset):
-    if size == 0:
-        return []
-    if not (size > 0):
+    """Returns up to 'size' rows of the table, starting at 'offset', and whether there are more rows after them.
+
+    Fetches one extra row to find out, so it takes a single query.
+    """
+    if not (size >= 0):
         raise Signal.make(T.ValueError, table, "Table preview size cannot be negative")
 
     global _g_last_table, _g_last_offset
-    rows = cast_to_python(table_limit(table, size, offset))
+    rows = cast_to_python(table_limit(table, size + 1, offset))
+    has_more = len(rows) > size
+    rows = rows[:size]
     _g_last_table = table
     _g_last_offset = offset + len(rows)
     if table.type <= T.list:
         rows = [{ITEM_NAME: x} for x in rows]
 
-    return rows
+    return rows, has_more
 
 
 def table_inline_repr(self):
     offset = 0
     preview = DisplaySettings.TABLE_PREVIEW_SIZE_SHELL
-    rows = _preview_table(self, preview, offset)
+    rows, _has_more = _preview_table(self, preview, offset)
     return '[%s]' % ', '.join(repr(r) for r in rows)
 
 
 
-def table_repr(self, offset=0):
-    max_count = DisplaySettings.MAX_AUTO_COUNT
-
-    count = cast_to_python_int(call_builtin_func('count', [table_limit(self, max_count)]))
-    if count == max_count:
-        count_str = f'>={count}'
+def _count_str(table, offset, rows, has_more):
+    if rows and not has_more:
+        # The preview reached the end of the table, so no need to count it
+        count_str = f'={offset + len(rows)}'
     else:
-        count_str = f'={count}'
+        max_count = DisplaySettings.MAX_AUTO_COUNT
+        count = cast_to_python_int(call_builtin_func('count', [table_limit(table, max_count)]))
+        if count == max_count:
+            count_str = f'>={count}'
+        else:
+            count_str = f'={count}'
+    return count_str
 
+
+def table_repr(self, offset=0, count_str=None):
     # if len(self.type.elems) == 1:
     #     rows = cast_to_python(table_limit(self, LIST_PREVIEW_SIZE))
     #     post = f', ... ({count_str})' if len(rows) < count else ''
@@ -216,8 +227,12 @@ def table_repr(self, offset=0):
         assert display.format == 'rich'
 
     table_name = _table_name(self)
-    rows = _preview_table(self, preview, offset)
-    has_more = offset + len(rows) < count
+    rows, has_more = _preview_table(self, preview, offset)
+    if count_str is None:
+        count_str = _count_str(self, offset, rows, has_more)
+
+    global _g_last_count
+    _g_last_count = self, count_str
     return table_f(table_name, count_str, rows, offset, has_more, colors=colors)
 
 
@@ -225,7 +240,8 @@ def table_more():
     if not _g_last_table:
         raise Signal.make(T.ValueError, None, "No table yet")
 
-    return table_repr(_g_last_table, _g_last_offset)
+    count_str = _g_last_count[1] if _g_last_count and _g_last_count[0] is _g_last_table else None
+    return table_repr(_g_last_table, _g_last_offset, count_str)
 
 
 def module_repr(module):
@@ -246,6 +262,7 @@ class Display:
         print(repr_)
 
 def _print_rich_exception(console, e):
+    import rich.text
     console.print('[bold]Exception traceback:[/bold]')
     for ref in e.text_refs:
         for line in (ref.get_pinpoint_text(rich=True) if ref else ['???']):
@@ -256,8 +273,15 @@ def _print_rich_exception(console, e):
 class RichDisplay(Display):
     format = "rich"
 
-    def __init__(self):
-        self.console = rich.console.Console()
+    _console = None
+
+    @property
+    def console(self):
+        # Created on first use, since importing rich takes a while
+        if self._console is None:
+            import rich.console
+            self._console = rich.console.Console()
+        return self._console
 
     def print(self, repr_, end="\n"):
         if hasattr(repr_, '__rich_console__'):
@@ -273,6 +297,7 @@ class RichDisplay(Display):
 
 
 def print_to_string(x, format):
+    import rich.console
     console = rich.console.Console(color_system=None)
     with console.capture() as capture: 
         console.print(x)
@@ -291,6 +316,7 @@ class HtmlDisplay(Display):
 
     # print = RichDisplay.print
     def print_exception(self, e):
+        import rich.console
         console = rich.console.Console(record=True)
         _print_rich_exception(console, e)
         res = console.export_html(code_format='<style>{stylesheet}</style><pre>{code}</pre>').replace('━', '-')
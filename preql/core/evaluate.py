@@ -1,5 +1,6 @@
 from typing import List, Optional
-import logging
+import threading
+import weakref
 from pathlib import Path
 
 from preql.utils import safezip, dataclass, SafeDict, listgen, method
@@ -7,13 +8,14 @@ from preql import settings
 from preql.context import context
 
 from .interp_common import assert_type, exclude_fields, call_builtin_func, is_global_scope, cast_to_python_string, cast_to_python_int
-from .state import set_var, use_scope, get_var, unique_name, get_db, catch_access, AccessLevels, get_access_level, reduce_access, has_var
+from .state import set_var, use_scope, get_var, unique_name, get_db, catch_access, AccessLevels, get_access_level, reduce_access, has_var, require_access
 from . import exceptions as exc
 from . import pql_objects as objects
 from . import pql_ast as ast
 from . import sql
+from . import profiler
 from .parser import Str
-from .interp_common import dsp, pyvalue_inst, cast_to_python
+from .interp_common import dsp, pyvalue_inst, cast_to_python, logger
 from .compiler import cast_to_instance
 from .pql_types import T, Type, Object, Id, dp_inst
 from .types_impl import table_params, table_flat_for_insert, flatten_type, pql_repr, kernel_type
@@ -106,9 +108,21 @@ def maybe_autocommit():
         get_db().commit()
 
 
+def _insert_and_get_rowid(q):
+    "Runs the insert, and returns the last inserted id (which must be read in the same transaction)"
+    with context(state=context.state.set_autocommit(False)):
+        db_query(q)
+        rowid = db_query(sql.LastRowId(), modifies=False)
+    maybe_autocommit()
+    return rowid
+
+
 def db_query(sql_code, subqueries=None, *, modifies=True):
+    # Compiling ahead of time (e.g. for caching) must not touch the database
+    require_access(AccessLevels.WRITE_DB if modifies else AccessLevels.READ_DB)
+
     try:
-        res = get_db().query(sql_code, subqueries)
+        res = get_db().query(sql_code, subqueries, cache=not modifies)
     except exc.DatabaseQueryError as e:
         raise Signal.make(T.DbQueryError, None, e.args[0]) from e
 
@@ -117,6 +131,24 @@ def db_query(sql_code, subqueries=None, *, modifies=True):
 
     return res
 
+def stream_table(inst, batch_size=None):
+    "Returns an iterator over the rows of the table, which fetches them from the database in batches"
+    require_access(AccessLevels.READ_DB)
+
+    try:
+        return get_db().query_stream(inst.code, inst.subqueries, batch_size)
+    except exc.DatabaseQueryError as e:
+        raise Signal.make(T.DbQueryError, None, e.args[0]) from e
+
+def fetch_columns(inst, fmt):
+    "Returns the table in a columnar format (one of 'pandas', 'numpy', 'arrow')"
+    require_access(AccessLevels.READ_DB)
+
+    try:
+        return get_db().query_columns(inst.code, inst.subqueries, fmt)
+    except exc.DatabaseQueryError as e:
+        raise Signal.make(T.DbQueryError, None, e.args[0]) from e
+
 def drop_table(table_type):
     name = table_type.options['name']
     code = sql.compile_drop_table(name)
@@ -330,7 +362,8 @@ def _execute(p: ast.Assert):
 @method
 def _execute(cb: ast.CodeBlock):
     for stmt in cb.statements:
-        execute(stmt)
+        with profiler.statement(stmt):
+            execute(stmt)
     return objects.null
 
 
@@ -394,9 +427,55 @@ def find_module(module_name):
     raise Signal.make(T.ImportError, module_name, "Cannot find module")
 
 
-def import_module(state, r):
-    module_path = find_module(r.module_path)
+class ModuleRegistry:
+    """Keeps the imported modules, so that importing a module again doesn't re-evaluate it.
+
+    Modules are kept per database connection, since evaluating a module may define tables in it.
+    A module is evaluated again if its file was modified since.
+    """
+
+    def __init__(self):
+        self._modules = weakref.WeakKeyDictionary()     # {db: {(path, use_core): (mtime, module)}}
+        self._lock = threading.Lock()
+
+    def get(self, db, key, mtime):
+        with self._lock:
+            entry = self._modules.get(db, {}).get(key)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+    def set(self, db, key, mtime, module):
+        with self._lock:
+            self._modules.setdefault(db, {})[key] = mtime, module
+
+    def clear(self):
+        with self._lock:
+            self._modules.clear()
 
+module_registry = ModuleRegistry()
+
+
+def import_module(state, r, reload=False):
+    """Imports the module, or returns it from the registry if it was already imported.
+
+    If reload is true, the module is always evaluated again.
+    """
+    module_path = find_module(r.module_path).resolve()
+    key = module_path, r.use_core
+    mtime = module_path.stat().st_mtime_ns
+    db = state.db
+
+    if settings.module_cache and not reload:
+        module = module_registry.get(db, key, mtime)
+        if module is not None:
+            return module
+
+    module = _evaluate_module(state, r, module_path)
+    if settings.module_cache:
+        module_registry.set(db, key, mtime, module)
+    return module
+
+def _evaluate_module(state, r, module_path):
     # assert state is state.interp.state    # Fix for threaded
     i = state.interp.clone(use_core=r.use_core)
 
@@ -439,7 +518,11 @@ def _execute(t: ast.Throw):
 def execute(stmt):
     if isinstance(stmt, ast.Statement):
         return stmt._execute() or objects.null
-    return evaluate(stmt)
+    res = evaluate(stmt)
+    if isinstance(res, ast.Ast) and get_access_level() < AccessLevels.WRITE_DB:
+        # Skipping it would lose its side-effects (e.g. an update, while compiling)
+        raise exc.InsufficientAccessLevel()
+    return res
 
 
 
@@ -567,7 +650,8 @@ def simplify(funccall: ast.FuncCall):
 
     state.stacktrace.append(funccall.text_ref)
     try:
-        res = eval_func_call(func, args)
+        with profiler.call(func, funccall.text_ref):
+            res = eval_func_call(func, args)
     finally:
         assert state.stacktrace[-1] is funccall.text_ref
         state.stacktrace.pop()
@@ -608,35 +692,20 @@ def eval_func_call(func, args):
         ordered_args = list(ordered_args.values())
         return func.func(*ordered_args)
 
-    # TODO make tests to ensure caching was successful
     expr = func.expr
     if settings.cache:
-        params = {name: ast.Parameter(name, value.type) for name, value in ordered_args.items()}
-        sig = (func.name,) + tuple(a.type for a in ordered_args.values())
-
-        try:
-            with use_scope(params):
-                if sig in state._cache:
-                    compiled_expr = state._cache[sig]
-                else:
-                    logging.info(f"Compiling.. {func}")
-                    with context(state=reduce_access(AccessLevels.COMPILE)):
-                        compiled_expr = _call_expr(func.expr)
-                    logging.info("Compiled successfully")
-                    if isinstance(compiled_expr, objects.Instance):
-                        # XXX a little ugly
-                        qb = sql.QueryBuilder(True)
-                        x = compiled_expr.code.compile(qb)
-                        x = x.optimize()
-                        compiled_expr = compiled_expr.replace(code=x)
-                    state._cache[sig] = compiled_expr
-
+        # The function object is kept in the entry, so its id() can't be reused while cached
+        key = (id(func), get_db().target) + tuple(a.type for a in ordered_args.values())
+        entry = state.func_cache.get(key)
+        if entry is None:
+            entry = func, _compile_func(func, ordered_args)
+            state.func_cache[key] = entry
+
+        _func, compiled_expr = entry
+        assert _func is func
+        if compiled_expr is not None:
             expr = ast.ResolveParameters(compiled_expr, ordered_args)
 
-        except exc.InsufficientAccessLevel:
-            # Don't cache
-            pass
-
     with use_scope({**ordered_args, '__unwind__': []}):
         res = _call_expr(expr)
         # for to_unwind in get_var('__unwind__'):
@@ -644,10 +713,38 @@ def eval_func_call(func, args):
 
     if isinstance(res, ast.ResolveParameters):  # XXX A bit of a hack
         raise exc.InsufficientAccessLevel()
+    if isinstance(res, ast.Statement) and get_access_level() <= AccessLevels.COMPILE:
+        # Body couldn't be evaluated without side-effects, so its result is unknown
+        raise exc.InsufficientAccessLevel()
 
     return res
 
 
+def _compile_func(func, ordered_args):
+    """Compile the function body, with parameters in place of the arguments.
+
+    Returns None if the function can't be compiled ahead of evaluation.
+    Errors aren't reported here; the regular evaluation will raise them, if they are real.
+    """
+    params = {name: ast.Parameter(name, value.type) for name, value in ordered_args.items()}
+    try:
+        with use_scope(params):
+            logger.debug(f"Compiling.. {func}")
+            with context(state=reduce_access(AccessLevels.COMPILE)):
+                compiled_expr = _call_expr(func.expr)
+    except (exc.InsufficientAccessLevel, Signal):
+        return None
+
+    # Only plain SQL expressions are safe to reuse.
+    # Subqueries are named uniquely, so sharing them between calls might cause conflicts.
+    if type(compiled_expr) not in (objects.Instance, objects.TableInstance) or compiled_expr.subqueries:
+        return None
+    logger.debug("Compiled successfully")
+
+    # Keep the SQL tree, so the optimizer can merge it with the query around the call
+    return compiled_expr
+
+
 def _call_expr(expr):
     try:
         return evaluate(expr)
@@ -741,18 +838,28 @@ def apply_database_rw(d: ast.Delete):
     if not 'name' in table.type.options:
         raise Signal.make(T.ValueError, d.table, "Cannot delete. Table is not persistent")
 
-    rows = list(table.localize())
-    if rows:
-        if 'id' not in rows[0]:
-            raise Signal.make(T.TypeError, d, "Delete error: Table does not contain id")
-
-        ids = [row['id'] for row in rows]
+    if 'id' not in table.type.elems:
+        raise Signal.make(T.TypeError, d, "Delete error: Table does not contain id")
 
+    if _modify_by_query(table):
+        db_query(sql.delete_by_query(table), table.subqueries)
+    else:
+        ids = [row['id'] for row in table.localize()]
         for code in sql.deletes_by_ids(table, ids):
             db_query(code, table.subqueries)
 
     return evaluate( d.table)
 
+def _modify_by_query(table):
+    "Returns whether the rows of the table expression can be updated/deleted in one statement, using a subquery"
+    target = get_db().target
+    if target in (sql.mysql, sql.presto):
+        # MySQL can't select from the table being modified, and Presto doesn't support such subqueries
+        return False
+
+    # Other databases don't accept a WITH clause before UPDATE/DELETE
+    return not table.subqueries or target in (sql.sqlite, sql.duck, sql.postgres)
+
 @method
 def apply_database_rw(u: ast.Update):
     catch_access(AccessLevels.WRITE_DB)
@@ -790,15 +897,15 @@ def apply_database_rw(u: ast.Update):
     with use_scope(update_scope):
         proj = {f.name:evaluate( f.value) for f in u.fields}
 
-    rows = list(table.localize())
-    if rows:
-        if 'id' not in rows[0]:
-            raise Signal.make(T.TypeError, u, "Update error: Table does not contain id")
-        if not set(proj) < set(rows[0]):
-            raise Signal.make(T.TypeError, u, "Update error: Not all keys exist in table")
-
-        ids = [row['id'] for row in rows]
+    if 'id' not in table.type.elems:
+        raise Signal.make(T.TypeError, u, "Update error: Table does not contain id")
+    if not set(proj) < set(table.type.elems):
+        raise Signal.make(T.TypeError, u, "Update error: Not all keys exist in table")
 
+    if _modify_by_query(table):
+        db_query(sql.update_by_query(table, proj), table.subqueries)
+    else:
+        ids = [row['id'] for row in table.localize()]
         for code in sql.updates_by_ids(table, proj, ids):
             db_query(code, table.subqueries)
 
@@ -829,22 +936,98 @@ def apply_database_rw(new: ast.NewRows):
 
     arg ,= new.args
 
-    # TODO postgres can do it better!
     table = evaluate( arg.value)
-    rows = table.localize()
 
     # TODO ensure rows are the right type
 
     cons = TableConstructor.make(obj)
 
-    # TODO very inefficient, vectorize this
+    if get_db().target not in (sql.sqlite, sql.duck, sql.postgres, sql.mysql):
+        # No way to get the new ids in bulk. Insert row by row.
+        ids = []
+        for row in table.localize():
+            matched = cons.match_params([objects.from_python(v) for v in row.values()])
+            ids += [_new_row(new, obj, matched).primary_key()]   # XXX return everything, not just pk?
+    else:
+        if 'name' not in obj.options:
+            raise Signal.make(T.TypeError, new, f"'new' expects a persistent table. Instead got a table expression.")
+
+        ids = _insert_select(obj, table, cons)
+        if ids is None:
+            ids = _insert_rows_batched(new, obj, table.localize(), cons)
+        ids = [objects.pyvalue_inst(i) for i in ids]
+
+    # XXX find a nicer way - requires a better typesystem, where id(t) < int
+    return ast.List_(T.list[T.int], ids).set_text_ref(new.text_ref)
+
+
+def _insert_select(table_type, source, cons):
+    """Inserts all the rows of source with a single INSERT .. SELECT .. RETURNING
+
+    Returns the new ids, or None if the database or the columns don't allow it.
+    """
+    if not get_db().supports_returning or cons.param_collector:
+        return None
+
+    if not source.type <= T.table:
+        return None
+
+    # Columns are matched by position, like the arguments of 'new'
+    columns = list(source.type.elems.items())[:len(cons.params)]
+    if len(columns) < len(cons.params):
+        return None
+    for p, (_name, t) in safezip(cons.params, columns):
+        if p.type <= T.struct or t <= T.struct or not t <= p.type:
+            return None
+
+    select = sql.Select(source.type, source.code, [sql.Name(t, n) for n, t in columns])
+    code = sql.Insert(table_type.options['name'], [p.name for p in cons.params], select, returning='id')
+    return db_query(code, source.subqueries)
+
+
+def _insert_rows_batched(new_ast, table_type, rows, cons):
+    """Inserts the rows using multi-row INSERT statements, and returns the new ids
+
+    Ids are returned using RETURNING when supported, or else derived from the last inserted id.
+    (the auto-increment values of a single multi-row insert are consecutive in Sqlite and MySQL)
+    """
+    db = get_db()
+    table_name = table_type.options['name']
+    batch_size = settings.insert_batch_size
+
     ids = []
+    keys = None
+    batch = []
+    def flush():
+        if not batch:
+            return
+        if db.supports_returning:
+            ids.extend(db_query(sql.InsertConsts(table_name, keys, batch, returning='id')))
+        else:
+            rowid = _insert_and_get_rowid(sql.InsertConsts(table_name, keys, batch))
+            if db.target == sql.mysql:
+                ids.extend(range(rowid, rowid + len(batch)))   # MySQL returns the first id
+            else:
+                ids.extend(range(rowid - len(batch) + 1, rowid + 1))
+        batch.clear()
+
     for row in rows:
         matched = cons.match_params([objects.from_python(v) for v in row.values()])
-        ids += [_new_row(new, obj, matched).primary_key()]   # XXX return everything, not just pk?
+        frozen = [(k, freeze(evaluate( v))) for k, v in matched]
+        row_keys, values = _new_row_values(new_ast, frozen)
+        if not row_keys:
+            # No columns to insert
+            flush()
+            ids.append(_new_row(new_ast, table_type, matched).primary_key().local_value)
+            continue
 
-    # XXX find a nicer way - requires a better typesystem, where id(t) < int
-    return ast.List_(T.list[T.int], ids).set_text_ref(new.text_ref)
+        if row_keys != keys or len(batch) >= batch_size:
+            flush()
+            keys = row_keys
+        batch.append(values)
+    flush()
+
+    return ids
 
 
 @listgen
@@ -881,12 +1064,16 @@ def freeze(i: objects.Instance):
 def freeze(i: objects.RowInstance):
     return i.replace(attrs={k: freeze(v) for k, v in i.attrs.items()})
 
-def _new_row(new_ast, table, matched):
-    matched = [(k, freeze(evaluate( v))) for k, v in matched]
+def _new_row_values(new_ast, matched):
     destructured_pairs = _destructure_param_match(new_ast, matched)
 
     keys = [name for (name, _) in destructured_pairs]
     values = [sql.make_value(v) for (_,v) in destructured_pairs]
+    return keys, values
+
+def _new_row(new_ast, table, matched):
+    matched = [(k, freeze(evaluate( v))) for k, v in matched]
+    keys, values = _new_row_values(new_ast, matched)
     # XXX use regular insert?
 
     if 'name' not in table.options:
@@ -905,12 +1092,12 @@ def _new_row(new_ast, table, matched):
         raise Signal.make(T.ValueError, new_ast, "Cannot add a new row to an unnamed table")
 
     q = sql.InsertConsts(table_name, keys, [values])
-    db_query(q)
 
     if get_db().target in (sql.bigquery, sql.snowflake, sql.presto, sql.oracle, sql.redshift):
+        db_query(q)
         return objects.null
 
-    rowid = db_query(sql.LastRowId(), modifies=False)
+    rowid = _insert_and_get_rowid(q)
     d = SafeDict({'id': objects.pyvalue_inst(rowid)})
     d.update({p.name:v for p, v in matched})
     return objects.RowInstance(T.row[table], d)
@@ -983,7 +1170,8 @@ def evaluate(obj_):
     access_level = get_access_level()
 
     # - Generic, non-db related operations
-    obj = obj_.simplify()
+    with profiler.phase('simplify'):
+        obj = obj_.simplify()
     assert obj, obj_
 
     if access_level < AccessLevels.COMPILE:
@@ -993,7 +1181,8 @@ def evaluate(obj_):
     # . Compilation may fail (e.g. due to lack of DB access)
     # . Resulting code generic within the same database, and can be cached
     # obj = compile_to_inst(state.reduce_access(state.AccessLevels.COMPILE), obj)
-    obj = obj.compile_to_inst()
+    with profiler.phase('compile'):
+        obj = obj.compile_to_inst()
 
     if access_level < AccessLevels.EVALUATE:
         return obj
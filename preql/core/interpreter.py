@@ -5,11 +5,14 @@ from functools import wraps
 
 from preql.utils import classify
 from preql.context import context
+from preql import settings
 
 from .exceptions import Signal, pql_SyntaxError, ReturnSignal
-from .evaluate import execute, eval_func_call, import_module, evaluate, cast_to_python
+from .evaluate import execute, eval_func_call, import_module, evaluate, cast_to_python, stream_table, fetch_columns
 from .parser import parse_stmts
+from .parse_cache import parse_file_stmts
 from . import pql_ast as ast
+from . import profiler
 from . import pql_objects as objects
 from .interp_common import pyvalue_inst, call_builtin_func
 from .state import ThreadState
@@ -37,6 +40,36 @@ def entrypoint(f):
     return inner
 
 
+_core_namespaces = {}     # {db target: namespace}
+_core_namespaces_lock = threading.Lock()
+
+def core_namespace(state):
+    """Returns the namespace defined by __builtins__.pql, to be added to the builtins.
+
+    It only depends on the database type, so it's evaluated once per type, and shared between
+    interpreters. Its values must not be modified.
+    """
+    target = state.db.target
+    if settings.module_cache:
+        with _core_namespaces_lock:
+            if target in _core_namespaces:
+                return _core_namespaces[target]
+
+    mns = import_module(state, ast.Import('__builtins__', use_core=False)).namespace
+    bns = state.get_var('__builtins__').namespace
+    # safe-update
+    ns = {}
+    for k, v in mns.items():
+        if not k.startswith('__'):
+            assert k not in bns
+            ns[k] = v
+
+    if settings.module_cache:
+        with _core_namespaces_lock:
+            ns = _core_namespaces.setdefault(target, ns)
+    return ns
+
+
 class LocalCopy(threading.local):
     def __init__(self, **kw):
         self._items = kw
@@ -55,13 +88,8 @@ class Interpreter:
 
         self.state = ThreadState.from_components(self, sqlengine, display, initial_namespace(), autocommit=autocommit)
         if use_core:
-            mns = import_module(self.state, ast.Import('__builtins__', use_core=False)).namespace
             bns = self.state.get_var('__builtins__').namespace
-            # safe-update
-            for k, v in mns.items():
-                if not k.startswith('__'):
-                    assert k not in bns
-                    bns[k] = v
+            bns.update(core_namespace(self.state))
 
         self._local_copies = LocalCopy(state=self.state)
 
@@ -69,27 +97,34 @@ class Interpreter:
     def setup_context(self):
         return context(state=self._local_copies.state)
 
-    def _execute_code(self, code, source_file, args=None):
+    def set_profiler(self, profiler):
+        "Sets the profiler of the code that runs in the current thread (None to stop profiling)"
+        self._local_copies.state.profiler = profiler
+
+    def _execute_code(self, code, source_file, args=None, parse=parse_stmts):
         # assert not args, "Not implemented yet: %s" % args
-        try:
-            stmts = parse_stmts(code, source_file)
-        except pql_SyntaxError as e:
-            raise Signal(T.SyntaxError, [e.text_ref], e.message)
+        with profiler.script(source_file):
+            try:
+                with profiler.phase('parse'):
+                    stmts = parse(code, source_file)
+            except pql_SyntaxError as e:
+                raise Signal(T.SyntaxError, [e.text_ref], e.message)
 
 
-        if stmts:
-            if isinstance(stmts[0], ast.Const) and stmts[0].type == T.string:
-                self.set_var('__doc__', stmts[0].value)
+            if stmts:
+                if isinstance(stmts[0], ast.Const) and stmts[0].type == T.string:
+                    self.set_var('__doc__', stmts[0].value)
 
-        last = None
+            last = None
 
-        # with self.state.ns.use_parameters(args or {}):
-        with context(parameters=args or {}):    # Set parameters for Namespace.get_var()
-            for stmt in stmts:
-                try:
-                    last = execute(stmt)
-                except ReturnSignal:
-                    raise Signal.make(T.CodeError, stmt, "'return' outside of function")
+            # with self.state.ns.use_parameters(args or {}):
+            with context(parameters=args or {}):    # Set parameters for Namespace.get_var()
+                for stmt in stmts:
+                    try:
+                        with profiler.statement(stmt):
+                            last = execute(stmt)
+                    except ReturnSignal:
+                        raise Signal.make(T.CodeError, stmt, "'return' outside of function")
 
         return last
 
@@ -97,7 +132,7 @@ class Interpreter:
         if rel_to:
             fn = Path(rel_to).parent / fn
         with open(fn, encoding='utf8') as f:
-            self._execute_code(f.read(), fn)
+            self._execute_code(f.read(), fn, parse=parse_file_stmts)
 
     def set_var(self, name, value):
         if not isinstance(value, Object):
@@ -142,6 +177,14 @@ class Interpreter:
     def cast_to_python(self, obj):
         return cast_to_python(obj)
 
+    @entrypoint
+    def stream_table(self, inst, batch_size=None):
+        return stream_table(inst, batch_size)
+
+    @entrypoint
+    def fetch_columns(self, inst, fmt):
+        return fetch_columns(inst, fmt)
+
     @entrypoint
     def call_builtin_func(self, name, args):
         return call_builtin_func(name, args)
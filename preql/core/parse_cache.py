@@ -0,0 +1,100 @@
+"""A persistent cache of parsed source files
+
+Parsing is a big part of the time it takes to load a module. So, the parsed statements
+of each file are pickled into the user's cache directory, and reused for as long as the
+file's content, and the parser (grammar and AST classes), stay the same.
+"""
+
+import os
+import sys
+import pickle
+import hashlib
+from pathlib import Path
+
+from preql import settings
+
+from .parser import parse_stmts
+from .pql_types import T, Type
+
+_this_dir = Path(__file__).parent
+
+# Changing any of these may change the resulting AST, and invalidates the cache
+_PARSER_FILES = ['preql.lark', 'parser.py', 'pql_ast.py', 'pql_objects.py', 'pql_types.py', '../utils.py']
+
+_parser_version = None
+
+def parser_version():
+    global _parser_version
+    if _parser_version is None:
+        h = hashlib.sha256(repr(sys.version_info[:2]).encode())
+        for fn in _PARSER_FILES:
+            h.update((_this_dir / fn).read_bytes())
+        _parser_version = h.hexdigest()
+    return _parser_version
+
+
+def cache_dir():
+    if settings.parse_cache_dir:
+        return Path(settings.parse_cache_dir)
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'preql' / 'ast'
+
+
+class _AstPickler(pickle.Pickler):
+    # Builtin types are compared by identity, so they must be pickled by reference
+    def persistent_id(self, obj):
+        if isinstance(obj, Type) and T.get(obj.typename) is obj:
+            return obj.typename
+        return None
+
+class _AstUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        return T[pid]
+
+
+def _cache_path(source_file):
+    name = hashlib.sha256(str(Path(source_file).absolute()).encode()).hexdigest()
+    return cache_dir() / (name + '.pickle')
+
+def _cache_key(code, source_file):
+    h = hashlib.sha256(parser_version().encode())
+    h.update(str(source_file).encode())
+    h.update(b'\0')
+    h.update(code.encode('utf8'))
+    return h.hexdigest()
+
+
+def _load(path, key):
+    try:
+        with open(path, 'rb') as f:
+            cached_key, stmts = _AstUnpickler(f).load()
+    except FileNotFoundError:
+        return None
+    except Exception:
+        return None     # Corrupt or incompatible. Will be overwritten.
+
+    return stmts if cached_key == key else None
+
+def _store(path, key, stmts):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.%d.tmp' % os.getpid())
+        with open(tmp_path, 'wb') as f:
+            _AstPickler(f, pickle.HIGHEST_PROTOCOL).dump((key, stmts))
+        os.replace(tmp_path, path)     # Atomic, so readers never see a partial file
+    except Exception:
+        pass    # Caching is best-effort (e.g. read-only home directory)
+
+
+def parse_file_stmts(code, source_file):
+    "Like parse_stmts(), but uses the cache when possible. Only meant for the code of files."
+    if not settings.parse_cache:
+        return parse_stmts(code, source_file)
+
+    path = _cache_path(source_file)
+    key = _cache_key(code, source_file)
+    stmts = _load(path, key)
+    if stmts is None:
+        stmts = parse_stmts(code, source_file)
+        _store(path, key, stmts)
+    return stmts
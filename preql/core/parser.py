@@ -330,23 +330,30 @@ def _edit_terminals(t):
     if t.name in _operators:
         t.pattern = PatternRE('%s(?!\w)' % t.pattern.value)
 
-parser = Lark.open(
-    'preql.lark',
-    rel_to=__file__,
-    parser='lalr',
-    postlex=Postlexer(),
-    start=['module', 'expr'],
-    maybe_placeholders=True,
-    propagate_positions=True,
-    cache=True,
-    edit_terminals=_edit_terminals,
-)
+_parser = None
+
+def get_parser():
+    # Created on first use, since loading the grammar takes a while
+    global _parser
+    if _parser is None:
+        _parser = Lark.open(
+            'preql.lark',
+            rel_to=__file__,
+            parser='lalr',
+            postlex=Postlexer(),
+            start=['module', 'expr'],
+            maybe_placeholders=True,
+            propagate_positions=True,
+            cache=True,
+            edit_terminals=_edit_terminals,
+        )
+    return _parser
 
 
 def terminal_desc(name):
     if name == '_NL':
         return "<NEWLINE>"
-    p = parser.get_terminal(name).pattern
+    p = get_parser().get_terminal(name).pattern
     if p.type == 'str':
         return p.value
     return '<%s>' % name
@@ -356,7 +363,7 @@ def terminal_list_desc(term_list):
 
 def parse_stmts(s, source_file, wrap_syntax_error=True):
     try:
-        tree = parser.parse(s+"\n", start="module")
+        tree = get_parser().parse(s+"\n", start="module")
     except UnexpectedInput as e:
         if not wrap_syntax_error:
             raise
@@ -4,23 +4,25 @@ import os
 from datetime import datetime
 import csv
 import itertools
+import threading
+from copy import copy
 
-import rich.progress
 import runtype
 
 from preql.utils import safezip, listgen, re_split
-from preql.docstring.autodoc import autodoc, AutoDocError
 from preql.context import context
+from preql import settings
 
-from .exceptions import Signal, ExitInterp
+from .exceptions import Signal, ExitInterp, DatabaseQueryError
 from . import pql_objects as objects
 from . import pql_ast as ast
 from . import sql
+from . import profiler
 from .interp_common import pyvalue_inst, assert_type, cast_to_python_string, cast_to_python_int, cast_to_python
 from .state import get_var, get_db, use_scope, unique_name, get_db, require_access, AccessLevels, set_var
-from .evaluate import evaluate, db_query, maybe_autocommit, TableConstructor, new_table_from_expr, new_table_from_rows
+from .evaluate import evaluate, eval_func_call, db_query, maybe_autocommit, TableConstructor, new_table_from_expr, new_table_from_rows, import_module
 from .pql_types import T, Type, Id
-from .types_impl import join_names
+from .types_impl import join_names, flatten_type, table_flat_for_insert
 from .casts import cast
 from .compiler import cast_to_instance
 
@@ -83,6 +85,65 @@ def pql_inspect_sql(obj: T.object):
     return objects.ValueInstance.make(sql.make_value(s), T.text, [], s)
 
 
+def pql_profile(func: T.function):
+    """Calls the given function (without arguments), and returns the time spent in it, as a table
+
+    The resulting table has a row for each statement and function call, with the columns:
+    kind, name, location, count, total, and the time (in seconds) of each phase:
+    parse, simplify, compile, finalize, execute, fetch, import and other.
+
+    Example:
+        >> func f() = count([1, 2, 3][item > 1])
+        >> profile(f){kind, name, count}
+    """
+    prof = profiler.Profiler()
+    with context(state=context.state.set_profiler(prof)):
+        with prof.call(func, getattr(getattr(func, 'expr', None), 'text_ref', None)):
+            eval_func_call(func, [])
+
+    columns = ['kind', 'name', 'location', 'count', 'total'] + list(profiler.PHASES)
+    table_type = T.table({'kind': T.string, 'name': T.string, 'location': T.string, 'count': T.int,
+                          **{c: T.float for c in columns[4:]}})
+    tuples = [sql.Tuple(T.list[T.any], [sql.make_value(row[c]) for c in columns]) for row in prof.to_json()]
+    return objects.new_const_table(table_type, tuples)
+
+
+def pql_explain(obj: T.object, analyze: T.bool = ast.false):
+    """Returns the plan that the database would use to evaluate the given object, as a table
+
+    The object is compiled the same way as when it's evaluated, and the plan is
+    fetched using the database's variant of EXPLAIN.
+
+    The resulting table has the columns: id, parent, operation, detail, est_cost, est_rows,
+    actual_rows and actual_time (in milliseconds). Values the database doesn't provide are null.
+
+    Parameters:
+        obj: The object (usually a table) to explain
+        analyze: If true, the query is executed, and the plan includes the actual rows and time.
+                 Not supported by all databases.
+
+    Example:
+        >> explain([1, 2, 3][item > 1]){operation, detail}
+    """
+    if not isinstance(obj, objects.Instance):
+        raise Signal.make(T.TypeError, None, f"explain() expects a concrete object. Instead got: {obj.type}")
+    analyze = cast_to_python(analyze)
+    require_access(AccessLevels.WRITE_DB if analyze else AccessLevels.READ_DB)
+
+    try:
+        plan = get_db().explain(obj.code, obj.subqueries, analyze)
+    except DatabaseQueryError as e:
+        raise Signal.make(T.DbQueryError, None, e.args[0]) from e
+
+    columns = plan.COLUMNS
+    tuples = [sql.Tuple(T.list[T.any], [sql.make_value(row[c]) for c in columns]) for row in plan.rows]
+    table_type = T.table({
+        'id': T.int, 'parent': T.int.as_nullable(), 'operation': T.string, 'detail': T.string,
+        **{c: T.float.as_nullable() for c in columns[4:]}
+    })
+    return objects.new_const_table(table_type, tuples)
+
+
 def pql_SQL(result_type: T.union[T.table, T.type], sql_code: T.string):
     """Create an object with the given SQL evaluation code, and given result type.
 
@@ -732,6 +793,21 @@ def pql_connect(uri: T.string, load_all_tables: T.bool = ast.false, auto_create:
         state.interp.load_all_tables()     # XXX
     return objects.null
 
+def pql_reload(module: T.module):
+    """Evaluate the module again, update it in place, and return it
+
+    Modules are only evaluated the first time they are imported (per database),
+    or when their file has changed.
+
+    Example:
+        >> import graph
+        >> reload(graph)
+    """
+    new_module = import_module(context.state, ast.Import(module.name), reload=True)
+    module.namespace.clear()
+    module.namespace.update(new_module.namespace)
+    return module
+
 def pql_help(inst: T.any = objects.null):
     """Provides a brief summary for the given object
     """
@@ -758,6 +834,7 @@ def pql_help(inst: T.any = objects.null):
     if table_type:
         inst = T.table
 
+    from preql.docstring.autodoc import autodoc, AutoDocError   # Slow to import (builds a grammar)
     try:
         doc = autodoc(inst).print_text()    # TODO maybe html
         if doc:
@@ -899,86 +976,209 @@ def pql_import_json(table_name: T.string, uri: T.string):
 
 
 
+def _parse_csv_bool(s):
+    s = s.lower()
+    if s in ('true', 't', 'yes', 'y', '1'):
+        return True
+    elif s in ('false', 'f', 'no', 'n', '0'):
+        return False
+    raise ValueError(s)
+
+def _csv_converter(t):
+    "Returns a function that converts a CSV field to a value of type t"
+    if t <= T.bool:
+        parse = _parse_csv_bool
+    elif t <= T.int:
+        parse = int
+    elif t <= T.float:
+        parse = float
+    else:
+        # Strings, and whatever the database knows how to cast from a string
+        return None
+
+    def convert(s):
+        return parse(s) if s else None
+    return convert
+
+def _iter_csv_lines(f, progress, task):
+    # Reading as bytes lets us know our position in the file
+    pos = 0
+    for i, line in enumerate(f):
+        pos += len(line)
+        if i % 1024 == 0:
+            progress.update(task, completed=pos)
+        yield line.decode('utf8')
+    progress.update(task, completed=pos)
+
 def pql_import_csv(table: T.table, filename: T.string, header: T.bool = ast.Const(T.bool, False)):
     """Import a csv file into an existing table
 
+    Columns are matched by their order, and values are converted to the types of the columns.
+    When possible, the database's own CSV loader is used.
+
     Parameters:
         table: A table into which to add the rows.
         filename: A path to the csv file
         header: If true, skips the first line
     """
-    # TODO better error handling, validation
+    require_access(AccessLevels.WRITE_DB)
 
     filename = cast_to_python_string(filename)
     header = cast_to_python(header)
     msg = f"Importing CSV file: '{filename}'"
 
-    max_rows_per_query = get_db().max_rows_per_query
-
-    cons = TableConstructor.make(table.type)
-    keys = []
-    rows = []
+    db = get_db()
+    table_name = table.type.options['name']
+    types = dict(flatten_type(table.type))
+    _read_only, all_columns = table_flat_for_insert(table.type)
+    batch_size = db.max_rows_per_query
 
-    def insert_values():
-        q = sql.InsertConsts2(table.type.options['name'], keys, rows)
-        db_query(q)
+    try:
+        with open(filename, 'rb') as f:
+            first_row = next(csv.reader([f.readline().decode('utf8')]), None)
+    except FileNotFoundError as e:
+        raise Signal.make(T.FileError, None, str(e))
 
+    if not first_row:
+        return table
+    if len(first_row) > len(all_columns):
+        raise Signal.make(T.TypeError, None, f"CSV file has {len(first_row)} columns, but table {table_name} only has {len(all_columns)}")
+    columns = all_columns[:len(first_row)]
 
+    converters = [_csv_converter(types[c]) for c in columns]
+    # Like convert_row() below, an empty field is null, unless the column is a string
+    null_if_empty = {c for c, conv in zip(columns, converters) if conv}
     try:
-        with open(filename, 'r', encoding='utf8') as f:
-            line_count = len(list(f))
-            f.seek(0)
+        loaded = db.load_csv(table_name, columns, filename, header, null_if_empty)
+    except DatabaseQueryError as e:
+        raise Signal.make(T.DbQueryError, None, e.args[0]) from e
+    if loaded:
+        db.invalidate_results({table_name})
+        maybe_autocommit()
+        return table
 
-            reader = csv.reader(f)
-            for i, row in enumerate(rich.progress.track(reader, total=line_count, description=msg)):
-                if i == 0:
-                    matched = cons.match_params(row)
-                    keys = [p.name for (p, _) in matched]
+    def convert_row(row, line):
+        try:
+            if len(row) != len(converters):
+                raise ValueError()
+            return [conv(v) if conv else v for conv, v in zip(converters, row)]
+        except ValueError:
+            raise Signal.make(T.ValueError, None, f"Bad row in CSV file '{filename}', line {line}: {row}")
+
+    import rich.progress
+    with open(filename, 'rb') as f, rich.progress.Progress() as progress:
+        task = progress.add_task(msg, total=os.path.getsize(filename))
+        reader = csv.reader(_iter_csv_lines(f, progress, task))
+        if header:
+            next(reader, None)
 
-                if header and i == 0:
-                    # Skip first line if header=True
-                    continue
+        try:
+            rows = []
+            for row in reader:
+                if not row:
+                    continue    # Empty line
+                rows.append(convert_row(row, reader.line_num))
+                if len(rows) >= batch_size:
+                    db.insert_rows(table_name, columns, rows)
+                    rows = []
+            db.insert_rows(table_name, columns, rows)
+        except DatabaseQueryError as e:
+            raise Signal.make(T.DbQueryError, None, e.args[0]) from e
+        finally:
+            db.invalidate_results({table_name})     # Rows may be inserted without going through query()
 
-                values = ["'%s'" % (v.replace("'", "''")) for v in row]
-                rows.append(values)
+    # All in a single transaction
+    maybe_autocommit()
+    return table
 
-                if (i+1) % max_rows_per_query == 0:
-                    insert_values()
-                    rows = []
 
-        if keys and rows:
-            insert_values()
 
-        maybe_autocommit()
+class _RestWorkers:
+    """Evaluates the requests of serve_rest() in a pool of threads, so they don't block the event loop.
 
-        return table
-    except FileNotFoundError as e:
-        raise Signal.make(T.FileError, None, str(e))
+    Each thread has its own interpreter state (cloned from the server's), while the
+    compiled functions are shared by all of them. Each request runs in its own transaction,
+    so the thread's database connection returns to the pool when it's done.
+    """
 
+    def __init__(self, state, workers=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self._state = state
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(workers or settings.Rest.WORKERS, thread_name_prefix='preql-rest')
+        self._pending = 0
 
+    def _run(self, f, args):
+        try:
+            state = self._local.state
+        except AttributeError:
+            state = self._local.state = copy(self._state)
 
-def _rest_func_endpoint(func):
+        with context(state=state):
+            db = get_db()
+            try:
+                res = f(*args)
+            except BaseException:
+                db.rollback()
+                raise
+            db.commit()
+            return res
+
+    async def run(self, f, *args):
+        "Returns an (status_code, json) tuple, for the result of f(*args)"
+        import asyncio
+        if self._pending >= settings.Rest.MAX_CONCURRENT:
+            return 503, {'error': 'Server is busy'}
+
+        self._pending += 1      # Only accessed from the event loop
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self._run, f, args)
+        # A timed-out evaluation can't be interrupted, and keeps its worker until it's done,
+        # so it stays pending until then (done callbacks run in the event loop)
+        future.add_done_callback(self._job_done)
+        try:
+            res = await asyncio.wait_for(asyncio.shield(future), settings.Rest.TIMEOUT)
+        except asyncio.TimeoutError:
+            return 504, {'error': 'Request timed out'}
+        except Signal as e:
+            return 500, {'error': e.message, 'type': str(e.type)}
+
+        return 200, res
+
+    def _job_done(self, _future):
+        self._pending -= 1
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def _rest_func_endpoint(workers, func):
     from starlette.responses import JSONResponse
+
+    def call(params):
+        return cast_to_python(evaluate( ast.FuncCall(func, params) ))
+
     async def callback(request):
         params = [objects.pyvalue_inst(v) for k, v in request.path_params.items()]
-        expr = ast.FuncCall(func, params)
-        res = evaluate( expr)
-        res = cast_to_python(res)
-        return JSONResponse(res)
+        status_code, res = await workers.run(call, params)
+        return JSONResponse(res, status_code=status_code)
     return callback
 
-def _rest_table_endpoint(table):
+def _rest_table_endpoint(workers, table):
     from starlette.responses import JSONResponse
-    async def callback(request):
+
+    def select(params):
         tbl = table
-        params = dict(request.query_params)
         if params:
             conds = [ast.Compare('=', [ast.Name(k), objects.pyvalue_inst(v)])
                      for k, v in params.items()]
             expr = ast.Selection(tbl, conds)
             tbl = evaluate( expr)
-        res = cast_to_python(tbl)
-        return JSONResponse(res)
+        return cast_to_python(tbl)
+
+    async def callback(request):
+        status_code, res = await workers.run(select, dict(request.query_params))
+        return JSONResponse(res, status_code=status_code)
     return callback
 
 
@@ -992,6 +1192,9 @@ def pql_serve_rest(endpoints: T.struct, port: T.int = pyvalue_inst(8080)):
     Note:
         Requires the `starlette` package for Python. Run `pip install starlette`.
 
+        Requests are evaluated in a pool of threads, each with its own state. See `settings.Rest`
+        for the number of threads, the limit of concurrent requests, and the request timeout.
+
     Example:
         >> func index() = "Hello World!"
         >> serve_rest({index: index})
@@ -1014,6 +1217,7 @@ def pql_serve_rest(endpoints: T.struct, port: T.int = pyvalue_inst(8080)):
         raise Signal.make(T.ImportError, None, "uvicorn not installed! Run 'pip install uvicorn'")
 
     port_ = cast_to_python_int(port)
+    workers = _RestWorkers(context.state)
 
     async def root(_request):
         return JSONResponse(list(endpoints.attrs))
@@ -1028,15 +1232,18 @@ def pql_serve_rest(endpoints: T.struct, port: T.int = pyvalue_inst(8080)):
             for p in func.params:
                 path += "/{%s}" % p.name
 
-            routes.append(Route(path, endpoint=_rest_func_endpoint(func)))
+            routes.append(Route(path, endpoint=_rest_func_endpoint(workers, func)))
         elif func.type <= T.table:
-            routes.append(Route(path, endpoint=_rest_table_endpoint(func)))
+            routes.append(Route(path, endpoint=_rest_table_endpoint(workers, func)))
         else:
             raise Signal.make(T.TypeError, func, f"Expected a function or a table, got {func.type}")
 
     app = Starlette(debug=True, routes=routes)
 
-    uvicorn.run(app, port=port_)
+    try:
+        uvicorn.run(app, port=port_)
+    finally:
+        workers.close()
     return objects.null
 
 
@@ -1102,6 +1309,7 @@ internal_funcs = create_internal_funcs({
     'env_vars': pql_env_vars,
     'dir': pql_names,
     'connect': pql_connect,
+    'reload': pql_reload,
     'import_table': pql_import_table,
     'count': pql_count,
     'temptable': pql_temptable,
@@ -1111,6 +1319,8 @@ internal_funcs = create_internal_funcs({
     'table_subtract': pql_table_substract,
     'SQL': pql_SQL,
     'inspect_sql': pql_inspect_sql,
+    'explain': pql_explain,
+    'profile': pql_profile,
     'PY': pql_PY,
     'isa': pql_isa,
     'issubclass': pql_issubclass,
@@ -4,16 +4,21 @@ from datetime import datetime
 from dataclasses import field
 from decimal import Decimal
 from collections import defaultdict, deque
+from itertools import count
 
 import arrow
 import runtype
 from runtype.typesystem import TypeSystem
 
-from preql.utils import dataclass
+from preql.utils import dataclass, Dispatch
 from .base import Object
 
 global_methods = {}
 
+# Interned types, for dispatch. See Type.dispatch_key()
+_dispatch_keys = {}
+_next_dispatch_key = count()
+
 class Id:
     def __init__(self, *parts):
         assert all(isinstance(p, str) for p in parts), parts
@@ -104,6 +109,27 @@ class Type(Object):
         assert self not in res
         return res | {self}
 
+    def supertype_names(self):
+        "Returns the typenames of this type and of all its supertypes (memoized)"
+        try:
+            return self._supertype_names
+        except AttributeError:
+            names = frozenset(t.typename for t in self.supertype_chain())
+            self.__dict__['_supertype_names'] = names   # Bypasses the frozen dataclass
+            return names
+
+    def dispatch_key(self):
+        """Returns a key that is the same for all equal types (memoized)
+
+        Unlike the type itself, the key is cheap to hash and compare, which makes dispatch faster.
+        """
+        try:
+            return self._dispatch_key
+        except AttributeError:
+            key = _dispatch_keys.setdefault(self, next(_next_dispatch_key))
+            self.__dict__['_dispatch_key'] = key
+            return key
+
     def __eq__(self, other, memo=None):
         "Repetitive nested equalities are assumed to be true"
 
@@ -148,7 +174,7 @@ class Type(Object):
                 return True
 
         # TODO zip should be aware of lengths
-        if t.typename in (s.typename for s in self.supertype_chain()):
+        if t.typename in self.supertype_names():
             return all(e1.issubtype(e2) for e1, e2 in zip(self.elem_types, t.elem_types))
         return False
 
@@ -405,6 +431,13 @@ class TS_Preql(ProtoTS):
         except AttributeError:
             return type(obj)
 
+    def dispatch_key(self, obj):
+        try:
+            t = obj.type
+        except AttributeError:
+            return type(obj)
+        return t.dispatch_key() if isinstance(t, Type) else t
+
 
 class TS_Preql_subclass(ProtoTS):
     def get_type(self, obj):
@@ -415,6 +448,14 @@ class TS_Preql_subclass(ProtoTS):
         # Regular Python
         return type(obj)
 
+    def dispatch_key(self, obj):
+        if isinstance(obj, Type):
+            return obj.dispatch_key()
+        return type(obj)
+
+
+def _make_dispatch(typesystem):
+    return Dispatch(typesystem, typesystem.dispatch_key)
 
-dp_type = runtype.Dispatch(TS_Preql_subclass())
-dp_inst = runtype.Dispatch(TS_Preql())
+dp_type = _make_dispatch(TS_Preql_subclass())
+dp_inst = _make_dispatch(TS_Preql())
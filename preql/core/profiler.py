@@ -0,0 +1,197 @@
+"""Attributes the time it takes to run Preql code to statements and function calls, by phase
+
+Phases nest (e.g. compiling evaluates sub-expressions), so each moment is counted only once:
+in the innermost phase, of the innermost statement or function call.
+"""
+
+import time
+from typing import Optional
+
+from preql.context import context
+from preql.utils import mut_dataclass, TextReference
+
+PHASES = ('parse', 'simplify', 'compile', 'finalize', 'execute', 'fetch', 'import', 'other')
+
+
+@mut_dataclass
+class ProfileEntry:
+    "The time spent in a statement, or in calls to a function (not including the statements and calls inside it)"
+    kind: str       # 'script', 'statement', or 'call'
+    name: str
+    text_ref: Optional[TextReference]
+    times: dict
+    count: int = 0
+    total: float = 0    # Including the entries inside it
+    _depth: int = 0     # Calls in progress (for recursion)
+
+    @property
+    def location(self):
+        if self.text_ref is None:
+            return ''
+        return '%s:%d' % (self.text_ref.source_file, self.text_ref.ref.start.line)
+
+    def to_json(self):
+        return {'kind': self.kind, 'name': self.name, 'location': self.location,
+                'count': self.count, 'total': self.total, **self.times}
+
+
+class _NoProfile:
+    def __enter__(self):
+        pass
+    def __exit__(self, *exc):
+        pass
+
+_no_profile = _NoProfile()
+
+
+class _Phase:
+    def __init__(self, profiler, entry, phase):
+        self.profiler = profiler
+        self.entry = entry
+        self.phase = phase
+
+    def __enter__(self):
+        self.profiler._push(self.entry, self.phase)
+
+    def __exit__(self, *exc):
+        self.profiler._pop()
+
+
+class _Entry(_Phase):
+    def __enter__(self):
+        entry = self.entry
+        entry.count += 1
+        entry._depth += 1
+        self.start = time.perf_counter()
+        self.profiler._push(entry, 'other')
+
+    def __exit__(self, *exc):
+        self.profiler._pop()
+        entry = self.entry
+        entry._depth -= 1
+        if not entry._depth:    # Don't count recursive calls twice
+            entry.total += time.perf_counter() - self.start
+
+
+class Profiler:
+    """Collects the time spent in each phase of running Preql code
+
+    Use it with Preql.profile(), or the `profile { ... }` statement.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._stack = []    # [entry, phase, start], for every phase that is in progress
+
+    def _get_entry(self, key, kind, name, text_ref):
+        try:
+            return self._entries[key]
+        except KeyError:
+            entry = self._entries[key] = ProfileEntry(kind, name, text_ref, dict.fromkeys(PHASES, 0.0))
+            return entry
+
+    def _push(self, entry, phase):
+        now = time.perf_counter()
+        if self._stack:
+            top = self._stack[-1]
+            top[0].times[top[1]] += now - top[2]
+        self._stack.append([entry, phase, now])
+
+    def _pop(self):
+        now = time.perf_counter()
+        entry, phase, start = self._stack.pop()
+        entry.times[phase] += now - start
+        if self._stack:
+            self._stack[-1][2] = now
+
+    def phase(self, name):
+        if self._stack:
+            entry = self._stack[-1][0]
+        else:
+            # e.g. fetching a table from the Python API
+            entry = self._get_entry('api', 'script', '<api>', None)
+        return _Phase(self, entry, name)
+
+    def statement(self, stmt):
+        text_ref = stmt.text_ref
+        if text_ref is None:
+            return self.phase('other')
+        key = ('statement',) + _ref_key(text_ref)
+        entry = self._get_entry(key, 'statement', _snippet(text_ref), text_ref)
+        return _Entry(self, entry, None)
+
+    def call(self, func, text_ref):
+        name = str(func.name)
+        # Functions are keyed by where they are defined, since different functions may share a name
+        func_ref = getattr(getattr(func, 'expr', None), 'text_ref', None)
+        key = ('call', name) if func_ref is None else ('call', name) + _ref_key(func_ref)
+        entry = self._get_entry(key, 'call', name, text_ref)
+        return _Entry(self, entry, None)
+
+    def script(self, source_file):
+        name = str(source_file)
+        entry = self._get_entry(('script', name), 'script', name, None)
+        return _Entry(self, entry, None)
+
+    @property
+    def entries(self):
+        return list(self._entries.values())
+
+    def to_json(self):
+        "Returns the entries as a list of rows, i.e. ``[{kind: ..., name: ..., parse: seconds, ...}, ...]``"
+        return [e.to_json() for e in self._entries.values()]
+
+    def report(self, limit=20):
+        "Returns a text table of the entries that took the longest"
+        entries = sorted(self._entries.values(), key=lambda e: -e.total)[:limit]
+        header = ['%-40s' % 'statement / call', '%-20s' % 'location', '%6s' % 'count', '%9s' % 'total']
+        header += ['%9s' % p for p in PHASES]
+        lines = [' '.join(header)]
+        for e in entries:
+            name = e.name if len(e.name) <= 40 else e.name[:37] + '...'
+            line = ['%-40s' % name, '%-20s' % e.location[-20:], '%6d' % e.count, '%9.4f' % e.total]
+            line += ['%9.4f' % e.times[p] for p in PHASES]
+            lines.append(' '.join(line))
+        return '\n'.join(lines)
+
+
+def _ref_key(text_ref):
+    # Code that isn't in a file (e.g. '<inline>') always starts at offset 0, so the text is part of the key
+    start = text_ref.ref.start.char_index
+    end = text_ref.ref.end.char_index
+    return text_ref.source_file, start, str(text_ref.text[start:end])
+
+def _snippet(text_ref):
+    start = text_ref.ref.start.char_index
+    end = text_ref.ref.end.char_index
+    return str(text_ref.text[start:end]).strip().split('\n', 1)[0]
+
+
+def _current():
+    state = context.get('state')
+    return state.profiler if state is not None else None
+
+def phase(name):
+    "Returns a context manager, that attributes the time in it to the given phase (if profiling)"
+    profiler = _current()
+    if profiler is None:
+        return _no_profile
+    return profiler.phase(name)
+
+def statement(stmt):
+    profiler = _current()
+    if profiler is None:
+        return _no_profile
+    return profiler.statement(stmt)
+
+def call(func, text_ref):
+    profiler = _current()
+    if profiler is None:
+        return _no_profile
+    return profiler.call(func, text_ref)
+
+def script(source_file):
+    profiler = _current()
+    if profiler is None:
+        return _no_profile
+    return profiler.script(source_file)
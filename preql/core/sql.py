@@ -19,7 +19,7 @@ presto = 'presto'
 oracle = 'oracle'
 
 class QueryBuilder:
-    def __init__(self, is_root=True, start_count=0):
+    def __init__(self, is_root=True, start_count=0, parameters=None):
         self.target = get_db().target
         self.is_root = is_root
 
@@ -27,6 +27,9 @@ class QueryBuilder:
 
         self.table_name = []
 
+        # Values of bound parameters, in order of appearance. If None, they are inlined as literals.
+        self.parameters = parameters
+
     def unique_name(self):
         self.counter += 1
         return 't%d' % self.counter
@@ -34,7 +37,7 @@ class QueryBuilder:
     def replace(self, is_root):
         if is_root == self.is_root:
             return self # Optimize
-        return QueryBuilder(is_root, self.counter)
+        return QueryBuilder(is_root, self.counter, self.parameters)
 
     def push_table(self, t):
         self.table_name.append(t)
@@ -61,14 +64,14 @@ class SqlTree(Sql):
     def compile(self, qb):
         sql_code = self._compile(qb.replace(is_root=False))
         assert isinstance(sql_code, list), self
-        assert all(isinstance(c, (str, Parameter)) for c in sql_code), self
+        assert all(isinstance(c, (str, Parameter, BoundParameter)) for c in sql_code), self
 
         return CompiledSQL(self.type, sql_code, self, self._is_select, self._needs_select)
 
     def finalize_with_subqueries(self, qb, subqueries):
         if subqueries:
             subqs = [q.compile_wrap(qb).finalize(qb) for (name, q) in subqueries.items()]
-            sql_code = ['WITH RECURSIVE '] if qb.target in (postgres, mysql, redshift) else ['WITH ']
+            sql_code = ['WITH RECURSIVE '] if qb.target in (postgres, mysql, redshift, duck) else ['WITH ']
             sql_code += join_comma([q, '\n    '] for q in subqs)
         else:
             sql_code = []
@@ -87,13 +90,14 @@ class CompiledSQL(Sql):
     def finalize(self, qb):
         wrapped = self.wrap(qb)
         assert qb.is_root
-        if wrapped.type <= T.primitive and not wrapped.code[0].lower().startswith('select '):
+        first = wrapped.code[0]
+        if wrapped.type <= T.primitive and not (isinstance(first, str) and first.lower().startswith('select ')):
             code = ['SELECT '] + wrapped.code
             if get_db().target == oracle:
                 code += [' FROM dual']
         else:
             code = wrapped.code
-        return ''.join(code)
+        return _join_code(qb, code)
 
     def wrap(self, qb):
         code = self.code
@@ -150,6 +154,11 @@ class RawSql(SqlTree):
     def _is_select(self):
         return self.text.lstrip().lower().startswith('select')   # XXX Hacky! Is there a cleaner solution?
 
+@dataclass
+class DDL(RawSql):
+    "Raw SQL code that creates or drops the given table"
+    table_name: Id
+
 @dataclass
 class Null(SqlTree):
     type = T.nulltype
@@ -173,6 +182,93 @@ class Parameter(SqlTree):
     def _compile(self, qb):
         return [self]
 
+@dataclass
+class BoundParameter(SqlTree):
+    "A value that is passed to the database separately from the SQL code, as a bind parameter"
+    type: Type
+    value: object
+
+    def _compile(self, qb):
+        return [self]
+
+
+def _join_code(qb, code):
+    if qb.parameters is None:
+        return ''.join(c if isinstance(c, str) else _repr(c.type, c.value) for c in code)
+
+    placeholder = get_db().param_placeholder
+    escape_percent = placeholder == '%s'    # 'format' paramstyle
+    res = []
+    for c in code:
+        if isinstance(c, BoundParameter):
+            qb.parameters.append(c.value)
+            res.append(placeholder)
+        else:
+            res.append(c.replace('%', '%%') if escape_percent else c)
+    return ''.join(res)
+
+
+def structural_key(obj, params=None):
+    """Returns a hashable key, that is equal for SQL trees that compile to the same code.
+
+    If params is a list, the values of bound parameters aren't part of the key. Instead, the
+    parameters are appended to params, in the order of the tree. (so the key only determines the code
+    for as long as the values are passed separately)
+
+    May raise TypeError, if the tree contains an unhashable value.
+    """
+    key, found = _shape(obj)
+    if params is None:
+        values = tuple(p.value for p in found)
+        hash(values)   # Fail early
+        return key, values
+
+    params += found
+    return key
+
+def _shape(obj):
+    """Returns the structural key of obj without the values of bound parameters, and those parameters.
+
+    SQL trees are immutable, so the result is memoized on each node. This makes the key of trees that
+    share most of their nodes (e.g. the results of a cached function) cheap to compute.
+    """
+    if isinstance(obj, Sql):
+        try:
+            return obj.__dict__['_shape']
+        except KeyError:
+            pass
+
+        if isinstance(obj, BoundParameter):
+            res = (BoundParameter, obj.type), (obj,)
+        elif isinstance(obj, CompiledSQL):
+            # The code already determines the output, no need to walk the source tree
+            key, params = _shape(obj.code)
+            res = (CompiledSQL, obj.type, obj._is_select, obj._needs_select, key), params
+        else:
+            key, params = _shape_items([v for _k, v in obj])
+            res = (type(obj),) + key, params
+
+        obj.__dict__['_shape'] = res    # Bypasses the frozen dataclass
+        return res
+
+    elif isinstance(obj, (list, tuple)):
+        return _shape_items(obj)
+    elif isinstance(obj, dict):
+        return _shape_items(list(obj.items()))
+
+    hash(obj)   # Fail early
+    return obj, ()
+
+def _shape_items(items):
+    keys = []
+    params = ()
+    for i in items:
+        key, p = _shape(i)
+        keys.append(key)
+        if p:
+            params += p
+    return tuple(keys), params
+
 
 @dataclass
 class Scalar(SqlTree):
@@ -284,7 +380,9 @@ class Case(SqlTree):
     then: Sql
     else_: Optional[Sql]
 
-    type = T.bool
+    @property
+    def type(self):
+        return self.then.type
 
     def _compile(self, qb):
         cond = self.cond.compile_wrap(qb).code
@@ -518,15 +616,24 @@ class AddIndex(SqlStatement):
             stmt += "IF NOT EXISTS "
         return [ stmt + f"{quote_id(self.index_name)} ON {quote_id(self.table_name)}({', '.join(self.columns)})"]
 
+def _returning_code(returning):
+    return [' RETURNING ', quote_name(returning)] if returning else []
+
 @dataclass
 class Insert(SqlStatement):
     table_name: Id
     columns: List[str]
     query: Sql
+    returning: Optional[str] = None     # Column to return for each inserted row
 
     def _compile(self, qb):
         columns = [quote_name(c) for c in self.columns]
-        return [f'INSERT INTO {quote_id(self.table_name)}({", ".join(columns)}) '] + self.query.compile(qb).code
+        code = [f'INSERT INTO {quote_id(self.table_name)}({", ".join(columns)}) '] + self.query.compile(qb).code
+        return code + _returning_code(self.returning)
+
+    @property
+    def type(self):
+        return T.list[T.int] if self.returning else T.nulltype
 
     def finalize_with_subqueries(self, qb, subqueries):
         if qb.target in (mysql, bigquery, oracle):
@@ -542,6 +649,11 @@ class InsertConsts(SqlStatement):
     table: Id
     cols: List[str]
     tuples: list #List[List[Sql]]
+    returning: Optional[str] = None     # Column to return for each inserted row
+
+    @property
+    def type(self):
+        return T.list[T.int] if self.returning else T.nulltype
 
     def _compile(self, qb):
         cols = self.cols
@@ -549,7 +661,7 @@ class InsertConsts(SqlStatement):
         assert self.tuples, self
 
         if not cols:
-            return ['INSERT INTO', quote_id(self.table), 'DEFAULT VALUES']
+            return ['INSERT INTO', quote_id(self.table), 'DEFAULT VALUES'] + _returning_code(self.returning)
 
         values = join_comma(
             parens(join_comma([e.compile_wrap(qb).code for e in tpl]))
@@ -561,7 +673,7 @@ class InsertConsts(SqlStatement):
              "(", ', '.join(cols), ")",
              "VALUES ",
         ]
-        return [' '.join(q)] + values #+ [';']
+        return [' '.join(q)] + values + _returning_code(self.returning)
 
 @dataclass
 class InsertConsts2(SqlStatement):
@@ -717,34 +829,8 @@ class Select(TableOperation):
     def __post_init__(self):
         assert self.fields, self
 
-    def _is_conds_only(self):
-        if self.group_by or self.order or self.offset or self.limit:
-            return False
-
-        if len(self.fields) == 1 and isinstance(self.fields[0], AllFields):
-            return True
-
-        return False
-
     def _compile(self, qb):
-        # XXX very primitive optimization. Be smarter.
-        #
-        # Simplify
-        #
-        if isinstance(self.table, Select):
-            s1 = self
-            s2 = self.table
-            if s2._is_conds_only():
-                s = s1.replace(conds=list(s1.conds) + list(s2.conds), table=s2.table)
-                return s._compile(qb)
-
-            # elif s1._is_limit_only() and not (s2.offset or s2.limit):
-            #     s = s2.replace(limit=s1.limit, offset=s1.offset)
-            #     return s._compile(qb)
-
-        #
-        # Compile
-        #
+        # Nested selects are simplified beforehand, by the optimizer (see sql_optimizer.py)
         fields_sql = [f.compile_wrap(qb) for f in self.fields]
         select_sql = join_comma(f.code for f in fields_sql)
 
@@ -1060,7 +1146,7 @@ def _compile_type(target, _type: T.json):
 # API
 
 def compile_drop_table(table_name) -> Sql:
-    return RawSql(T.nulltype, f'DROP TABLE {quote_id(table_name)}')
+    return DDL(T.nulltype, f'DROP TABLE {quote_id(table_name)}', table_name)
 
 
 
@@ -1107,22 +1193,94 @@ def compile_type_def(table_name, table) -> Sql:
     else:
         command = "CREATE TEMPORARY TABLE" if table.options.get('temporary', False) else "CREATE TABLE IF NOT EXISTS"
 
-    return RawSql(T.nulltype, f'{command} {quote_id(table_name)} (' + ', '.join(columns + posts) + ')')
-
-
-
+    return DDL(T.nulltype, f'{command} {quote_id(table_name)} (' + ', '.join(columns + posts) + ')', table_name)
+
+
+
+
+def read_tables(sql, subqueries=None):
+    """Returns the set of tables that the given query reads from (not including its subqueries).
+
+    Returns None if it can't be determined, e.g. when the query contains raw SQL code.
+    """
+    local_names = {Id(name) for name in subqueries or ()}
+    tables = set()
+    visited = set()
+
+    def walk(obj):
+        if isinstance(obj, Sql):
+            if id(obj) in visited:
+                return True
+            visited.add(id(obj))
+
+            if isinstance(obj, RawSql):
+                return False
+            elif isinstance(obj, CompiledSQL):
+                return obj.source_tree is not None and walk(obj.source_tree)
+            elif isinstance(obj, TableName):
+                if obj.name not in local_names:
+                    tables.add(obj.name)
+                return True
+            return all(walk(v) for _k, v in obj)
+
+        elif isinstance(obj, (list, tuple)):
+            return all(walk(i) for i in obj)
+        elif isinstance(obj, dict):
+            return all(walk(k) and walk(v) for k, v in obj.items())
+        return True
+
+    if not walk(sql) or not walk(list((subqueries or {}).values())):
+        return None
+    return tables
+
+def written_tables(sql):
+    "Returns the set of tables that the given statement modifies, or None if it can't be determined"
+    if isinstance(sql, DDL):
+        return {sql.table_name}
+    elif isinstance(sql, Insert):
+        return {sql.table_name}
+    elif isinstance(sql, (InsertConsts, InsertConsts2)):
+        return {sql.table}
+    elif isinstance(sql, (Update, Delete)):
+        return {sql.table.name}
+    elif isinstance(sql, RawSql):
+        return None
+    elif isinstance(sql, CompiledSQL):
+        return None if sql.source_tree is None else written_tables(sql.source_tree)
+    return set()
+
+
+def _ids_chunks(ids):
+    chunk_size = get_db().max_rows_per_query
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i+chunk_size]
+        values = Tuple(T.list[T.t_id], [Primitive(T.t_id, repr(id_)) for id_ in chunk])
+        yield Contains('IN', [Name(T.t_id, 'id'), values])
+
+def _ids_in_query(table):
+    ids = Select(T.list[T.t_id], table.code, [Name(T.t_id, 'id')])
+    return Contains('IN', [Name(T.t_id, 'id'), ids])
+
+def _update_fields(proj):
+    # TODO this function is not safe & secure enough
+    return {Name(value.type, name): value.code for name, value in proj.items()}
 
 def deletes_by_ids(table, ids):
-    for id_ in ids:
-        compare = Compare('=', [Name(T.t_id, 'id'), Primitive(T.t_id, repr(id_))])
-        yield Delete(TableName(table.type, table.type.options['name']), [compare])
+    for cond in _ids_chunks(ids):
+        yield Delete(TableName(table.type, table.type.options['name']), [cond])
 
 def updates_by_ids(table, proj, ids):
-    # TODO this function is not safe & secure enough
-    sql_proj = {Name(value.type, name): value.code for name, value in proj.items()}
-    for id_ in ids:
-        compare = Compare('=', [Name(T.t_id, 'id'), Primitive(T.t_id, repr(id_))])
-        yield Update(TableName(table.type, table.type.options['name']), sql_proj, [compare])
+    sql_proj = _update_fields(proj)
+    for cond in _ids_chunks(ids):
+        yield Update(TableName(table.type, table.type.options['name']), sql_proj, [cond])
+
+def delete_by_query(table):
+    "Deletes the rows of the given table expression, by selecting their ids in a subquery"
+    return Delete(TableName(table.type, table.type.options['name']), [_ids_in_query(table)])
+
+def update_by_query(table, proj):
+    "Updates the rows of the given table expression, by selecting their ids in a subquery"
+    return Update(TableName(table.type, table.type.options['name']), _update_fields(proj), [_ids_in_query(table)])
 
 def create_list(name, elems):
     # Assumes all elems have the same type!
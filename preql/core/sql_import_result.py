@@ -17,7 +17,7 @@ import arrow
 from preql.utils import listgen, safezip
 from .pql_types import T, dp_type, dp_inst
 from .exceptions import Signal
-from .types_impl import flatten_type
+from .types_impl import flatten_type, flatten_path
 from preql.context import context
 from .sql import _ARRAY_SEP, sqlite, mysql
 
@@ -173,6 +173,148 @@ def sql_result_to_python(arr: T.table):
 
 
 
+# Columnar import
+#
+# Builds arrays per column, instead of a dict per row, using the table type to choose the dtypes
+
+def _column_type(t):
+    "Returns the primitive type to import the column as, or None if its values need to be converted one by one"
+    if t <= T.t_relation:
+        t = t.elem
+    if t <= T.t_id:
+        return T.int
+    for pt in (T.bool, T.int, T.float, T.string, T.text, T.datetime, T.timestamp):
+        if t <= pt:
+            return pt
+    return None
+
+def _to_pydatetime(s):
+    d = _from_datetime(s)
+    return getattr(d, 'datetime', d)    # Unwrap arrow objects
+
+def _object_array(values):
+    import numpy as np
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+def _numpy_column(t, values):
+    import numpy as np
+    ct = _column_type(t)
+    if ct in (T.int, T.bool):
+        if None in values:
+            return _object_array(values)
+        return np.array(values, dtype='int64' if ct is T.int else bool)
+    elif ct is T.float:
+        return np.array(values, dtype='float64')   # null becomes NaN
+    elif ct in (T.string, T.text):
+        return _object_array([_from_sql_primitive(v) for v in values])
+    elif ct in (T.datetime, T.timestamp):
+        return _object_array([_to_pydatetime(v) for v in values])
+    return _object_array([_restructure_result(t, iter((v,))) for v in values])
+
+def _pandas_column(t, values):
+    import pandas as pd
+    ct = _column_type(t)
+    if ct is T.int and None in values:
+        return pd.array(values, dtype='Int64')
+    elif ct is T.bool and None in values:
+        return pd.array([None if v is None else bool(v) for v in values], dtype='boolean')
+    elif ct in (T.datetime, T.timestamp):
+        return pd.to_datetime([_to_pydatetime(v) for v in values])
+    return _numpy_column(t, values)
+
+def _arrow_column(t, values):
+    import pyarrow as pa
+    ct = _column_type(t)
+    if ct is T.int:
+        return pa.array(values, pa.int64())
+    elif ct is T.bool:
+        return pa.array([None if v is None else bool(v) for v in values], pa.bool_())
+    elif ct is T.float:
+        return pa.array([None if v is None else float(v) for v in values], pa.float64())
+    elif ct in (T.string, T.text):
+        return pa.array([_from_sql_primitive(v) for v in values], pa.string())
+    elif ct in (T.datetime, T.timestamp):
+        return pa.array([_to_pydatetime(v) for v in values], pa.timestamp('us'))
+    return pa.array([_restructure_result(t, iter((v,))) for v in values])
+
+def _column_names(table_type):
+    return [name for name, _t in flatten_type(table_type)]
+
+def import_columns(table_type, columns, fmt):
+    """Converts the result columns (a list of values per column) into the requested format.
+
+    fmt is one of 'pandas', 'numpy', 'arrow'.
+    """
+    fields = flatten_type(table_type)
+    if len(columns) != len(fields):
+        raise Signal.make(T.TypeError, None, f"Expected {len(fields)} columns, but got {len(columns)}")
+    names = [name for name, _t in fields]
+
+    if fmt == 'pandas':
+        from pandas import DataFrame
+        return DataFrame({name: _pandas_column(t, col) for (name, t), col in zip(fields, columns)}, columns=names)
+    elif fmt == 'numpy':
+        arrays = [_numpy_column(t, col) for (_n, t), col in zip(fields, columns)]
+        if table_type <= T.list:
+            array ,= arrays
+            return array
+        import numpy as np
+        return np.rec.fromarrays(arrays, names=names)
+    elif fmt == 'arrow':
+        import pyarrow as pa
+        return pa.table({name: _arrow_column(t, col) for (name, t), col in zip(fields, columns)})
+
+    raise ValueError(fmt)
+
+def import_native_table(table_type, table, fmt):
+    """Converts a dataframe or an arrow table, returned by the database driver, into the requested format.
+
+    Columns are renamed according to the table type.
+    """
+    names = _column_names(table_type)
+    if hasattr(table, 'rename_columns'):    # Arrow table
+        table = table.rename_columns(names)
+        if fmt == 'arrow':
+            return table
+        table = table.to_pandas()
+    else:
+        table.columns = names
+
+    if fmt == 'pandas':
+        return table
+    elif fmt == 'numpy':
+        if table_type <= T.list:
+            return table.iloc[:, 0].to_numpy()
+        return table.to_records(index=False)
+    elif fmt == 'arrow':
+        import pyarrow as pa
+        return pa.Table.from_pandas(table, preserve_index=False)
+
+    raise ValueError(fmt)
+
+def import_rows(table_type, rows, fmt):
+    """Converts the rows returned by sql_result_to_python() into the requested columnar format.
+
+    Used by the backends that can't fetch the result by columns.
+    """
+    from pandas import DataFrame
+    if table_type <= T.list:
+        if table_type.elem <= T.struct:
+            rows = [list(row.values()) for row in rows]
+        else:
+            rows = [[item] for item in rows]
+    else:
+        paths = [path for path, _t in flatten_path([], table_type)]
+        rows = [[_get_path(row, path) for path in paths] for row in rows]
+    return import_native_table(table_type, DataFrame(rows, columns=_column_names(table_type)), fmt)
+
+def _get_path(row, path):
+    for name in path:
+        row = row[name]
+    return row
+
 
 def _bool_from_sql(n):
     if n == 'NO' or n == 'N':
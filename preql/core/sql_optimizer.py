@@ -0,0 +1,545 @@
+"""A rule-based optimizer for SQL trees
+
+Preql stacks selections, projections, orders and slices into nested Selects.
+Before a query is compiled into SQL code, these rules rewrite the nesting into
+simpler, equivalent Selects, which some databases plan much better.
+
+Each rule can be disabled in settings.Optimizer.
+"""
+
+from preql import settings
+
+from .pql_types import Id
+from .types_impl import flatten_type
+from .sql import (Sql, RawSql, CompiledSQL, Table, TableName, Select, Subquery,
+                  AllFields, ColumnAlias, Name, FieldFunc, MakeArray, Primitive, TableQueryValues, quote_name, structural_key)
+
+
+class _CannotRewrite(Exception):
+    pass
+
+
+def enabled_rules():
+    "Returns the names of the rules to apply (part of the key of compiled queries)"
+    if not settings.optimize:
+        return ()
+    o = settings.Optimizer
+    return tuple(name for name, enabled in [
+        ('merge_selects', o.MERGE_SELECTS),
+        ('push_predicates', o.PUSH_PREDICATES),
+        ('push_limits', o.PUSH_LIMITS),
+        ('prune_columns', o.PRUNE_COLUMNS),
+        ('flatten_subqueries', o.FLATTEN_SUBQUERIES),
+        ('dedup_subqueries', o.DEDUP_SUBQUERIES),
+        ('drop_unused_subqueries', o.DROP_UNUSED_SUBQUERIES),
+    ] if enabled)
+
+
+#
+# Expressions
+#
+
+def _is_opaque(obj):
+    # Raw code might reference any column, and tables have their own scope of names
+    return isinstance(obj, (RawSql, CompiledSQL, Table))
+
+def _walk(obj):
+    "Yields obj and all the Sql nodes inside it, without entering opaque nodes"
+    if isinstance(obj, Sql):
+        yield obj
+        if _is_opaque(obj):
+            return
+        for _k, v in obj:
+            yield from _walk(v)
+    elif isinstance(obj, (list, tuple)):
+        for i in obj:
+            yield from _walk(i)
+    elif isinstance(obj, dict):
+        for k, v in obj.items():
+            yield from _walk(k)
+            yield from _walk(v)
+
+def _has_aggregate(expr):
+    # Opaque code might contain an aggregation, so we assume it does
+    return any(_is_opaque(n) or isinstance(n, (FieldFunc, MakeArray)) for n in _walk(expr))
+
+def _names(exprs):
+    "Returns the names that the expressions reference, or None if unknown"
+    names = set()
+    for n in _walk(exprs):
+        if _is_opaque(n):
+            return None
+        if isinstance(n, Name):
+            names.add(n.name)
+    return names
+
+def _substitute(obj, columns):
+    "Replaces the names in obj with the expressions of the columns they refer to"
+    if isinstance(obj, Name):
+        try:
+            return columns[obj.name]
+        except KeyError:
+            raise _CannotRewrite()
+    elif isinstance(obj, Sql):
+        if _is_opaque(obj):
+            raise _CannotRewrite()
+        changes = {k: _substitute(v, columns) for k, v in obj}
+        return obj.replace(**changes)
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_substitute(i, columns) for i in obj)
+    elif isinstance(obj, dict):
+        return {_substitute(k, columns): _substitute(v, columns) for k, v in obj.items()}
+    return obj
+
+
+#
+# Selects
+#
+
+def _all_fields(s):
+    return len(s.fields) == 1 and isinstance(s.fields[0], AllFields)
+
+def _only_limits(s):
+    return _all_fields(s) and not (s.conds or s.group_by or s.order)
+
+def _is_plain(s):
+    return _only_limits(s) and s.offset is None and s.limit is None
+
+def _has_limits(s):
+    return s.offset is not None or s.limit is not None
+
+def _columns(s):
+    """Returns {name: expr} for the output columns of a Select, in terms of the columns of its table.
+
+    Returns None if it selects all fields, and raises _CannotRewrite if the fields are unknown.
+    """
+    if _all_fields(s):
+        return None
+    columns = {}
+    for f in s.fields:
+        if isinstance(f, ColumnAlias):
+            name, value = f.alias, f.value
+        elif isinstance(f, Name):
+            name, value = f.name, f
+        else:
+            raise _CannotRewrite()
+        if name in columns:
+            raise _CannotRewrite()
+        columns[name] = value
+    return columns
+
+def _group_keys(s, columns):
+    "Returns the names of the output columns of a grouped Select that are its group keys"
+    names = list(columns)
+    keys = set()
+    for g in s.group_by:
+        if isinstance(g, Primitive) and g.text.isdigit() and 0 < int(g.text) <= len(names):
+            keys.add(names[int(g.text) - 1])    # By position, e.g. GROUP BY 1
+        else:
+            keys |= {name for name, value in columns.items() if value == g}
+    return keys
+
+def _is_simple(s, columns):
+    "Is every output row of s computed from a single input row? (i.e. no grouping or aggregation)"
+    if s.group_by:
+        return False
+    return columns is None or not any(_has_aggregate(v) for v in columns.values())
+
+def _map_exprs(exprs, columns):
+    if columns is None:
+        return list(exprs)
+    return [_substitute(e, columns) for e in exprs]
+
+def _map_fields(s1, s2, columns):
+    if _all_fields(s1):
+        return list(s2.fields)
+    if columns is None:
+        return list(s1.fields)
+
+    fields = []
+    for f in s1.fields:
+        if isinstance(f, ColumnAlias):
+            fields.append(f.replace(value=_substitute(f.value, columns)))
+        elif isinstance(f, Name):
+            value = _substitute(f, columns)
+            fields.append(value if isinstance(value, Name) and value.name == f.name else ColumnAlias(value, f.name))
+        else:
+            fields.append(_substitute(f, columns))
+    return fields
+
+
+def merge_selects(s1, s2):
+    """Merges a Select into the Select it selects from, when their clauses are compatible.
+
+    e.g. SELECT y FROM (SELECT x AS y FROM t WHERE a) WHERE b  ->  SELECT x AS y FROM t WHERE a AND b
+    """
+    if _is_plain(s1):
+        return s2.replace(type=s1.type)
+
+    columns = _columns(s2)
+    if not _is_simple(s2, columns):
+        return None
+
+    if _has_limits(s2):
+        # Only a projection of each row can be applied after the limit
+        if s1.conds or s1.group_by or s1.order or _has_limits(s1):
+            return None
+        if any(_has_aggregate(f) for f in s1.fields):
+            return None
+        return s2.replace(type=s1.type, fields=_map_fields(s1, s2, columns))
+
+    order = _map_exprs(s1.order, columns)
+    if s2.order:
+        if s1.group_by or any(_has_aggregate(f) for f in s1.fields):
+            return None     # Aggregations like array() depend on the order of s2
+        order += s2.order   # Keep the order of s2, for rows that s1 considers equal
+
+    return Select(
+        s1.type,
+        s2.table,
+        _map_fields(s1, s2, columns),
+        conds=list(s2.conds) + _map_exprs(s1.conds, columns),
+        group_by=_map_exprs(s1.group_by, columns),
+        order=order,
+        offset=s1.offset,
+        limit=s1.limit,
+    )
+
+
+def push_limits(s1, s2):
+    """Combines a limit/offset with the limit/offset of the Select it selects from.
+
+    e.g. SELECT * FROM (SELECT * FROM t LIMIT 10) LIMIT 5 OFFSET 2  ->  SELECT * FROM t LIMIT 5 OFFSET 2
+    """
+    if not _only_limits(s1) or _is_plain(s1):
+        return None
+
+    o1 = s1.offset or 0
+    o2 = s2.offset or 0
+    if s2.limit is None:
+        limit = s1.limit
+    else:
+        remaining = max(s2.limit - o1, 0)
+        limit = remaining if s1.limit is None else min(remaining, s1.limit)
+
+    offset = o1 + o2 if (s1.offset is not None or s2.offset is not None) else None
+    return s2.replace(type=s1.type, offset=offset, limit=limit)
+
+
+def push_predicates(s1, s2):
+    """Moves conditions on the group keys of a grouped Select to before the grouping.
+
+    e.g. SELECT * FROM (SELECT x, count(*) FROM t GROUP BY 1) WHERE x > 1  ->  SELECT * FROM (... WHERE x > 1 GROUP BY 1)
+    """
+    if not s1.conds or not s2.group_by or _has_limits(s2):
+        return None
+
+    columns = _columns(s2)
+    if columns is None:
+        return None
+
+    # Only conditions on the group keys alone have the same result before the grouping
+    keys = _group_keys(s2, columns)
+    pushed = []
+    kept = []
+    for c in s1.conds:
+        names = _names(c)
+        if names is None or not names <= keys:
+            kept.append(c)
+            continue
+        try:
+            mapped = _substitute(c, columns)
+        except _CannotRewrite:
+            kept.append(c)
+            continue
+        if _has_aggregate(mapped):
+            kept.append(c)
+        else:
+            pushed.append(mapped)
+
+    if not pushed:
+        return None
+
+    s2 = s2.replace(conds=list(s2.conds) + pushed)
+    s1 = s1.replace(table=s2, conds=kept)
+    return s2.replace(type=s1.type) if _is_plain(s1) else s1
+
+
+def prune_columns(s1, s2):
+    """Removes the columns of a Select that the Select above it doesn't use.
+
+    e.g. SELECT x FROM (SELECT x, y FROM t LIMIT 1)  ->  SELECT x FROM (SELECT x FROM t LIMIT 1)
+    """
+    if _all_fields(s1) or s2.group_by:
+        return None
+
+    used = _names([s1.fields, s1.conds, s1.group_by, s1.order])
+    if used is None:
+        return None
+    # Names in the clauses of s2 might refer to its own columns
+    own = _names([s2.conds, s2.order])
+    if own is None:
+        return None
+    used |= own
+
+    if _all_fields(s2):
+        if not isinstance(s2.table, TableName):
+            return None
+        all_names = [name for name, _t in flatten_type(s2.table.type)]
+        if not used <= set(all_names):
+            return None
+        fields = [Name(t, name) for name, t in flatten_type(s2.table.type) if name in used]
+    else:
+        columns = _columns(s2)
+        fields = [f for f in s2.fields if (f.alias if isinstance(f, ColumnAlias) else f.name) in used]
+        if len(fields) == len(columns):
+            return None
+
+    if not fields:
+        return None
+
+    return s1.replace(table=s2.replace(fields=fields))
+
+
+_SELECT_RULES = [
+    ('merge_selects', merge_selects),
+    ('push_limits', push_limits),
+    ('push_predicates', push_predicates),
+]
+
+_MAX_STEPS = 100
+
+def _optimize_select(s, rules):
+    for _ in range(_MAX_STEPS):
+        if not (isinstance(s, Select) and isinstance(s.table, Select)):
+            break
+
+        for name, rule in _SELECT_RULES:
+            if name in rules:
+                try:
+                    new = rule(s, s.table)
+                except _CannotRewrite:
+                    new = None
+                if new is not None:
+                    s = new
+                    break
+        else:
+            break
+
+    if 'prune_columns' in rules and isinstance(s, Select) and isinstance(s.table, Select):
+        try:
+            s = prune_columns(s, s.table) or s
+        except _CannotRewrite:
+            pass
+
+    return s
+
+
+def _optimize_tree(obj, rules, memo):
+    "Optimizes the tree bottom-up, so the Selects below have already been simplified"
+    if isinstance(obj, Sql):
+        if isinstance(obj, (RawSql, CompiledSQL)):
+            return obj
+        try:
+            return memo[id(obj)][1]
+        except KeyError:
+            pass
+
+        changes = {}
+        for k, v in obj:
+            new_v = _optimize_tree(v, rules, memo)
+            if new_v is not v:
+                changes[k] = new_v
+        new = obj.replace(**changes) if changes else obj
+
+        if isinstance(new, Select):
+            new = _optimize_select(new, rules)
+
+        memo[id(obj)] = obj, new    # Keeps obj alive, so its id isn't reused
+        return new
+
+    elif isinstance(obj, (list, tuple)):
+        new = [_optimize_tree(i, rules, memo) for i in obj]
+        return obj if all(a is b for a, b in zip(new, obj)) else type(obj)(new)
+    elif isinstance(obj, dict):
+        new = {k: _optimize_tree(v, rules, memo) for k, v in obj.items()}
+        return obj if all(new[k] is v for k, v in obj.items()) else new
+
+    return obj
+
+
+#
+# Subqueries
+#
+
+def _count_table_refs(obj):
+    "Returns {name: count} of the tables that obj references, or None if unknown"
+    counts = {}
+    for n in _walk_all(obj):
+        if isinstance(n, (RawSql, CompiledSQL)):
+            return None     # Its code might reference any table
+        if isinstance(n, TableName):
+            counts[n.name] = counts.get(n.name, 0) + 1
+    return counts
+
+def _walk_all(obj):
+    "Like _walk, but also enters tables"
+    if isinstance(obj, Sql):
+        yield obj
+        if isinstance(obj, (RawSql, CompiledSQL)):
+            return
+        for _k, v in obj:
+            yield from _walk_all(v)
+    elif isinstance(obj, (list, tuple)):
+        for i in obj:
+            yield from _walk_all(i)
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            yield from _walk_all(v)
+
+def _inline(obj, name, query):
+    if isinstance(obj, TableName):
+        return query if obj.name == name else obj
+    elif isinstance(obj, Sql):
+        if isinstance(obj, (RawSql, CompiledSQL)):
+            return obj
+        changes = {k: _inline(v, name, query) for k, v in obj}
+        return obj.replace(**changes)
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_inline(i, name, query) for i in obj)
+    elif isinstance(obj, dict):
+        return {k: _inline(v, name, query) for k, v in obj.items()}
+    return obj
+
+def _is_trivial_subquery(subq):
+    if not isinstance(subq.query, (Select, TableName)) or not subq.fields:
+        return False
+    # The subquery must not rename the columns of its query
+    names = [name for name, _t in flatten_type(subq.query.type)]
+    return [f.name for f in subq.fields] == names
+
+def flatten_subqueries(sql, subqueries):
+    """Inlines subqueries (i.e. WITH clauses) that wrap a simple query, and are used only once
+
+    e.g. WITH s(x) AS (SELECT x FROM t) SELECT * FROM s  ->  SELECT * FROM (SELECT x FROM t)
+    """
+    in_main = _count_table_refs(sql)
+    in_subqueries = _count_table_refs(list(subqueries.values()))
+    if in_main is None or in_subqueries is None:
+        return sql, subqueries
+
+    subqueries = dict(subqueries)
+    for name, subq in list(subqueries.items()):
+        if not isinstance(subq, Subquery) or not _is_trivial_subquery(subq):
+            continue
+        table_name = Id(name)
+        # Inlining is only worth it (and correct, for recursive queries) when used once, by the main query
+        if in_main.get(table_name) != 1 or in_subqueries.get(table_name):
+            continue
+
+        sql = _inline(sql, table_name, subq.query)
+        del subqueries[name]
+        for ref, count in _count_table_refs(subq.query).items():
+            in_main[ref] = in_main.get(ref, 0) + count
+            in_subqueries[ref] -= count
+
+    return sql, subqueries
+
+
+def _referenced_subqueries(obj, quoted_names):
+    "Returns the names of the subqueries that obj references"
+    refs = set()
+    for n in _walk_all(obj):
+        if isinstance(n, TableName):
+            if len(n.name.parts) == 1 and n.name.parts[0] in quoted_names:
+                refs.add(n.name.parts[0])
+        elif isinstance(n, (RawSql, CompiledSQL)):
+            # Raw code references subqueries by their quoted name
+            code = [n.text] if isinstance(n, RawSql) else n.code
+            for c in code:
+                if isinstance(c, str):
+                    refs |= {name for name, q in quoted_names.items() if q in c}
+    return refs
+
+def drop_unused_subqueries(sql, subqueries):
+    "Removes the subqueries (i.e. WITH clauses) that the query doesn't reference, directly or indirectly"
+    quoted_names = {name: quote_name(name) for name in subqueries}
+    used = set()
+    todo = _referenced_subqueries(sql, quoted_names)
+    while todo:
+        name = todo.pop()
+        if name not in used:
+            used.add(name)
+            todo |= _referenced_subqueries(subqueries[name], quoted_names)
+
+    return {name: q for name, q in subqueries.items() if name in used}
+
+
+def _rename_table(obj, old, new):
+    if isinstance(obj, TableName):
+        return obj.replace(name=Id(new)) if obj.name == Id(old) else obj
+    elif isinstance(obj, CompiledSQL):
+        old_q, new_q = quote_name(old), quote_name(new)
+        return obj.replace(code=[c.replace(old_q, new_q) if isinstance(c, str) else c for c in obj.code])
+    elif isinstance(obj, RawSql):
+        return obj.replace(text=obj.text.replace(quote_name(old), quote_name(new)))
+    elif isinstance(obj, Sql):
+        changes = {k: _rename_table(v, old, new) for k, v in obj}
+        return obj.replace(**changes)
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_rename_table(i, old, new) for i in obj)
+    elif isinstance(obj, dict):
+        return {k: _rename_table(v, old, new) for k, v in obj.items()}
+    return obj
+
+def _subquery_key(subq):
+    "Returns a key that is equal for subqueries with the same code, regardless of their name"
+    if isinstance(subq, Subquery):
+        return structural_key((Subquery, subq.fields, subq.query))
+    elif isinstance(subq, TableQueryValues):
+        return structural_key((TableQueryValues, subq.type, subq.rows))
+    raise TypeError(subq)
+
+def dedup_subqueries(sql, subqueries):
+    """Merges subqueries that are structurally equal, and so compile to the same code
+
+    e.g. the same list literal, used twice in the same query
+    """
+    subqueries = dict(subqueries)
+    while True:
+        seen = {}
+        for name, subq in subqueries.items():
+            try:
+                key = _subquery_key(subq)
+            except TypeError:
+                continue
+            if key in seen:
+                break
+            seen[key] = name
+        else:
+            return sql, subqueries
+
+        # Keep the first, and point the references of the duplicate to it
+        dup, keep = name, seen[key]
+        del subqueries[dup]
+        sql = _rename_table(sql, dup, keep)
+        subqueries = {n: _rename_table(q, dup, keep) for n, q in subqueries.items()}
+
+
+def optimize(sql, subqueries, rules):
+    "Returns an optimized (sql, subqueries), using the given rules (see enabled_rules())"
+    if not rules:
+        return sql, subqueries
+
+    if subqueries and 'dedup_subqueries' in rules:
+        sql, subqueries = dedup_subqueries(sql, subqueries)
+    if subqueries and 'drop_unused_subqueries' in rules:
+        subqueries = drop_unused_subqueries(sql, subqueries)
+    if subqueries and 'flatten_subqueries' in rules:
+        sql, subqueries = flatten_subqueries(sql, subqueries)
+
+    memo = {}
+    sql = _optimize_tree(sql, rules, memo)
+    if subqueries:
+        subqueries = {name: _optimize_tree(q, rules, memo) for name, q in subqueries.items()}
+    return sql, subqueries
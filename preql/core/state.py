@@ -3,6 +3,8 @@ from copy import copy
 from contextlib import contextmanager
 
 from preql.context import context
+from preql.utils import LRUCache
+from preql import settings
 
 
 from .exceptions import InsufficientAccessLevel, Signal
@@ -69,6 +71,17 @@ class Namespace:
     def __len__(self):
         return len(self._ns)
 
+    def is_global_name(self, name, shadowed=()):
+        """Returns whether setting the given name would replace an existing global value
+
+        Names in shadowed (e.g. the builtins) count as existing values.
+        """
+        if isinstance(name, Id):
+            if len(name.parts) > 1:
+                return True     # Module members are always global
+            name ,= name.parts
+        return len(self._ns) == 1 and (name in self._ns[0] or name in shadowed)
+
     def get_all_vars(self):
         d = {}
         for scope in reversed(self._ns):
@@ -103,8 +116,11 @@ class State:
 
         self.tick = [0]
 
-        self._cache = {}
+        # Compiled function bodies, keyed by function identity, db target and argument types
+        self.func_cache = LRUCache(settings.cache_max_size)
 
+    def invalidate_cache(self):
+        self.func_cache.clear()
 
     def connect(self, uri, auto_create=False):
         from preql.sql_interface import ConnectError, create_engine
@@ -119,6 +135,7 @@ class State:
             raise Signal.make(T.ValueError, None, *e.args) from e
 
         self._db_uri = uri
+        self.invalidate_cache()
 
 
     def unique_name(self, obj):
@@ -135,6 +152,7 @@ class ThreadState:
         self.access_level = AccessLevels.WRITE_DB
         self.stacktrace = []
         self.autocommit = autocommit
+        self.profiler = None    # See profiler.py
 
     @classmethod
     def from_components(cls, interp, db, display, ns=None, *, autocommit):
@@ -152,6 +170,10 @@ class ThreadState:
     @property
     def display(self):
         return self.state.display
+
+    @property
+    def func_cache(self):
+        return self.state.func_cache
     
 
     @classmethod
@@ -161,6 +183,7 @@ class ThreadState:
         s.access_level = inst.access_level
         s.stacktrace = copy(inst.stacktrace)
         s.autocommit = inst.autocommit
+        s.profiler = inst.profiler
         return s
 
 
@@ -178,6 +201,11 @@ class ThreadState:
         s.autocommit = autocommit
         return s
 
+    def set_profiler(self, profiler):
+        s = copy(self)
+        s.profiler = profiler
+        return s
+
     def require_access(self, level):
         if self.access_level < level:
             raise InsufficientAccessLevel(level)
@@ -216,6 +244,14 @@ class ThreadState:
 
 
     def set_var(self, name, value):
+        try:
+            builtins = self.ns.get_var('__builtins__').namespace
+        except NameNotFound:
+            builtins = {}   # Still loading the builtins
+        if self.ns.is_global_name(name, builtins):
+            # Cached functions may have been compiled using the previous value
+            self.state.invalidate_cache()
+
         try:
             return self.ns.set_var(name, value)
         except NameNotFound as e:
@@ -2,7 +2,19 @@
 import sys
 
 optimize = True
-cache = False
+cache = True
+cache_max_size = 1024
+sql_cache_max_size = 1024
+parse_cache = True          # Keep the parsed code of files on disk, for faster loading
+parse_cache_dir = None      # Defaults to ~/.cache/preql/ast
+module_cache = True         # Import each module only once per database (see reload()), and the builtins once per database type
+stream_batch_size = 1024    # Rows to fetch at a time, when iterating over a table
+insert_batch_size = 512     # Rows per INSERT statement, when adding rows in bulk
+mysql_local_infile = False  # Allow import_csv() to use LOAD DATA LOCAL INFILE (must also be enabled in the server)
+result_cache = False        # Cache the results of read-only queries in memory, until one of their tables is modified
+result_cache_ttl = 60       # Seconds before a cached result expires (e.g. to see changes made by other connections)
+result_cache_max_bytes = 64 * 1024 * 1024  # Approximate bound on the memory used by the result cache
+async_max_workers = 8       # Threads shared by all AsyncPreql instances, for running code off the event loop
 debug = False
 
 print_sql = False
@@ -30,6 +42,30 @@ class Display:
     LIST_PREVIEW_SIZE = 128
     MAX_AUTO_COUNT = 10000
 
+class Rest:
+    "Server of serve_rest()"
+    WORKERS = 8             # Threads that evaluate the requests
+    MAX_CONCURRENT = 64     # Requests that are evaluated or waiting. Beyond that, respond with 503
+    TIMEOUT = 30            # seconds, before responding with 504
+
+class Optimizer:
+    "Rules of the SQL optimizer (see preql/core/sql_optimizer.py). Applied only when optimize is True"
+    MERGE_SELECTS = True        # Merge nested selects into one, when their clauses are compatible
+    PUSH_PREDICATES = True      # Filter rows before grouping, when the condition is on the group keys
+    PUSH_LIMITS = True          # Combine nested limits and offsets
+    PRUNE_COLUMNS = True        # Don't select columns that the outer query doesn't use
+    FLATTEN_SUBQUERIES = True   # Inline subqueries (WITH clauses) that are used only once
+    DEDUP_SUBQUERIES = True     # Merge subqueries that are structurally equal
+    DROP_UNUSED_SUBQUERIES = True   # Remove subqueries that the query doesn't reference
+
+class Pool:
+    "Connection pool, for databases that support concurrent connections (Postgres, MySQL)"
+    ENABLED = True          # If False, all threads share a single connection
+    MIN_SIZE = 1
+    MAX_SIZE = 8
+    IDLE_TIMEOUT = 300      # seconds
+    ACQUIRE_TIMEOUT = 30    # seconds
+
 try:
     from .local_settings import *
 except ImportError:
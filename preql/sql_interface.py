@@ -1,17 +1,24 @@
 import operator
+import re
+import itertools
+import csv
+import io
 from pathlib import Path
 import subprocess
 import json
 
-import dsnparse
 
-from .utils import classify, dataclass
+from .utils import classify, dataclass, LRUCache, ResultCache
 from .loggers import sql_log
 from .context import context
+from . import settings
 
-from .core.sql import Sql, QueryBuilder, sqlite, postgres, mysql, duck, bigquery, quote_id, snowflake, redshift, oracle, presto
-from .core.sql_import_result import sql_result_to_python, type_from_sql
+from .core.sql import Sql, QueryBuilder, InsertConsts, make_value, structural_key, read_tables, written_tables, sqlite, postgres, mysql, duck, bigquery, quote_id, snowflake, redshift, oracle, presto
+from .core.sql_optimizer import optimize as optimize_sql, enabled_rules
+from .core import profiler
+from .core.sql_import_result import sql_result_to_python, type_from_sql, import_columns, import_native_table, import_rows
 from .core.pql_types import T, Type, Object, Id
+from .core.types_impl import flatten_type
 from .core.exceptions import DatabaseQueryError, Signal
 
 @dataclass
@@ -23,10 +30,76 @@ class ConnectError(Exception):
     pass
 
 
-def log_sql(sql):
+_MISSING = object()
+
+def _copy_result(res):
+    "Returns a copy of the lists and dicts of a query result, so changes to it don't affect the cached result"
+    if isinstance(res, list):
+        return [_copy_result(x) for x in res]
+    elif isinstance(res, dict):
+        return {k: _copy_result(v) for k, v in res.items()}
+    return res
+
+def log_sql(sql, qargs=None):
     for i, s in enumerate(sql.split('\n')):
         prefix = '/**/    ' if i else '/**/;;  '
         sql_log.debug(prefix+s)
+    if qargs:
+        sql_log.debug('/**/    -- args: %r' % (qargs,))
+
+
+class QueryPlan:
+    "The steps of a query plan, as rows with the columns in COLUMNS (see SqlInterface.explain)"
+
+    COLUMNS = ('id', 'parent', 'operation', 'detail', 'est_cost', 'est_rows', 'actual_rows', 'actual_time')
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, parent, operation, detail='', est_cost=None, est_rows=None, actual_rows=None, actual_time=None):
+        "Adds a step, and returns its id. actual_time is in milliseconds"
+        id_ = len(self.rows) + 1
+        self.rows.append(dict(id=id_, parent=parent, operation=operation, detail=detail,
+                              est_cost=_float_or_none(est_cost), est_rows=_float_or_none(est_rows),
+                              actual_rows=_float_or_none(actual_rows), actual_time=_float_or_none(actual_time)))
+        return id_
+
+    def add_text(self, text):
+        """Adds the steps of a plan in text form, nested by indentation
+
+        Metrics in the form of (cost=.. rows=..) and (actual time=.. rows=..) are extracted into columns.
+        """
+        stack = []  # (indent, id)
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            indent = len(line) - len(line.lstrip())
+            while stack and stack[-1][0] >= indent:
+                stack.pop()
+
+            cost = _RE_PLAN_COST.search(line)
+            actual = _RE_PLAN_ACTUAL.search(line)
+            operation = _RE_PLAN_METRICS.sub('', line).strip()
+            if operation.startswith('->'):
+                operation = operation[2:].strip()
+            id_ = self.add(stack[-1][1] if stack else None, operation,
+                           est_cost=cost and (cost.group(2) or cost.group(1)), est_rows=cost and cost.group(3),
+                           actual_time=actual and actual.group(2), actual_rows=actual and actual.group(3))
+            stack.append((indent, id_))
+
+_RE_PLAN_COST = re.compile(r'\(cost=([\d.e+]+)(?:\.\.([\d.e+]+))? rows=([\d.e+]+)')
+_RE_PLAN_ACTUAL = re.compile(r'\(actual time=([\d.e+]+)\.\.([\d.e+]+) rows=([\d.e+]+)')
+_RE_PLAN_METRICS = re.compile(r'\s*\((?:cost|actual)[^)]*\)')
+
+def _float_or_none(x):
+    try:
+        return None if x is None else float(x)
+    except ValueError:
+        return None
+
+def _plan_detail(items):
+    "Formats the attributes of a plan step as 'key: value, ...'"
+    return ', '.join('%s: %s' % (k, ', '.join(map(str, v)) if isinstance(v, list) else v) for k, v in items)
 
 
 class SqlInterface:
@@ -37,30 +110,177 @@ class SqlInterface:
     id_type_decl = 'INTEGER'
     max_rows_per_query = 1024
     offset_before_limit = False
+    param_placeholder = None    # If None, bound parameters are inlined as literals
+    supports_returning = False  # INSERT .. RETURNING
 
 
     def __init__(self, print_sql=False):
         self._print_sql = print_sql
+        # Finalized SQL code (and its arguments), keyed by the structure of the query
+        self._sql_cache = LRUCache(settings.sql_cache_max_size)
+        # Results of read-only queries, keyed by their final SQL code (see settings.result_cache)
+        self._result_cache = ResultCache(settings.result_cache_max_bytes, settings.result_cache_ttl)
+
+    def query(self, sql, subqueries=None, qargs=(), quiet=False, cache=False):
+        """Execute the given SQL tree, and return its result.
 
-    def query(self, sql, subqueries=None, qargs=(), quiet=False):
+        If cache is true, the query must be read-only, and its result may be served from
+        the result cache. Otherwise, the cached results of the tables it modifies are evicted.
+        """
         assert context.state
         assert isinstance(sql, Sql), sql
-        sql_code = self.compile_sql(sql, subqueries, qargs)
+        sql_code, qargs = self._compile_query(sql, subqueries, qargs)
 
         if self._print_sql and not quiet:
-            log_sql(sql_code)
+            log_sql(sql_code, qargs)
+
+        if cache and settings.result_cache:
+            return self._cached_query(sql, subqueries, sql_code, qargs)
+
+        try:
+            return self._execute_sql(sql.type, sql_code, qargs)
+        finally:
+            self.invalidate_results(written_tables(sql))
+
+    def _cached_query(self, sql, subqueries, sql_code, qargs):
+        key = sql.type, sql_code, qargs
+        try:
+            res = self._result_cache.get(key, _MISSING)
+        except TypeError:
+            return self._execute_sql(sql.type, sql_code, qargs)     # Unhashable arguments
+
+        if res is not _MISSING:
+            if self._print_sql:
+                sql_log.debug('/**/    -- (cached result)')
+            return _copy_result(res)
+
+        res = self._execute_sql(sql.type, sql_code, qargs)
+        # Queries that don't read any table (e.g. the last inserted id) may return a different result each time
+        tables = read_tables(sql, subqueries)
+        if tables:
+            self._result_cache.set(key, res, tables)
+            return _copy_result(res)
+        return res
+
+    def invalidate_results(self, tables):
+        """Evict the cached results that depend on any of the given tables.
+
+        If tables is None (i.e. unknown), evict all of them.
+        """
+        if not self._result_cache:
+            return
+        if tables is None:
+            self._result_cache.clear()
+        else:
+            self._result_cache.invalidate(tables)
+
+    def result_cache_stats(self):
+        "Returns the statistics of the query result cache"
+        return self._result_cache.stats()
+
+    def query_stream(self, sql, subqueries=None, batch_size=None, quiet=False):
+        """Like query(), but returns an iterator over the resulting rows, which fetches them in batches.
+
+        This base implementation fetches all the rows at once.
+        """
+        assert sql.type <= T.table, sql.type
+        return iter(self.query(sql, subqueries, quiet=quiet))
+
+    def query_columns(self, sql, subqueries=None, fmt='pandas', quiet=False):
+        """Like query(), but returns the resulting table in a columnar format.
+
+        fmt is one of 'pandas', 'numpy', 'arrow'.
+        This base implementation builds the columns from the resulting rows.
+        """
+        return import_rows(sql.type, self.query(sql, subqueries, quiet=quiet), fmt)
 
-        return self._execute_sql(sql.type, sql_code)
+    def explain(self, sql, subqueries=None, analyze=False, quiet=False):
+        """Returns the plan that the database would use to run the given SQL tree, as a QueryPlan
 
-    def compile_sql(self, sql, subqueries=None, qargs=()):
-        qb = QueryBuilder()
+        If analyze is true, the query is executed, and the plan includes the actual rows and time.
+        """
+        raise Signal.make(T.NotImplementedError, None, f"explain() is not implemented for {self.target}")
 
+    def insert_rows(self, table_name, columns, rows, quiet=False):
+        "Insert the given rows (lists of Python values, in the order of columns) into the table"
+        if rows:
+            self.query(InsertConsts(table_name, columns, [[make_value(v) for v in row] for row in rows]), quiet=quiet)
+
+    def load_csv(self, table_name, columns, filename, header, null_if_empty=(), quiet=False):
+        """Load a CSV file into the table, using the database's own bulk loader.
+
+        An empty field in one of the columns of null_if_empty is loaded as null.
+        Returns False if not supported, in which case the caller should use insert_rows() instead.
+        """
+        return False
+
+    def compile_sql(self, sql, subqueries=None, qargs=None):
+        """Compile the given SQL tree into a string.
+
+        If qargs is a list, the values of bound parameters are appended to it,
+        and placeholders are written in their place. Otherwise, they are written as literals.
+        """
+        qb = QueryBuilder(parameters=qargs)
+
+        sql, subqueries = optimize_sql(sql, subqueries, enabled_rules())
         return sql.finalize_with_subqueries(qb, subqueries)
 
+    def _compile_query(self, sql, subqueries, qargs):
+        with profiler.phase('finalize'):
+            return self._finalize_query(sql, subqueries, qargs)
+
+    def _finalize_query(self, sql, subqueries, qargs):
+        # When the values of bound parameters are passed separately, they aren't part of the key.
+        # So queries that differ only in their values (e.g. calls to the same function) share an entry,
+        # and the values are collected from the tree on each call.
+        params = None if self.param_placeholder is None else []
+        values = []
+        first = {}  # {value: index of its first occurrence}
+        try:
+            key = structural_key((sql, subqueries, enabled_rules()), params)
+            if params:
+                values = [p.value for p in params]
+                # The optimizer merges equal subqueries, so the code also depends on which values are equal
+                key = key, tuple(first.setdefault((type(v), v), i) for i, v in enumerate(values))
+        except TypeError:
+            key = None  # Can't cache
+        else:
+            res = self._sql_cache.get(key)
+            if res is not None:
+                sql_code, positions = res
+                if positions is None:
+                    return sql_code, None
+                return sql_code, tuple(qargs) + tuple(values[i] for i in positions)
+
+        if params is None:
+            assert not qargs
+            sql_code = self.compile_sql(sql, subqueries)
+            res = sql_code, None
+            positions = None
+        else:
+            used = []
+            sql_code = self.compile_sql(sql, subqueries, used)
+            res = sql_code, tuple(qargs) + tuple(used)
+            if key is not None:
+                # Where each argument comes from. Any parameter with an equal value will do.
+                try:
+                    positions = tuple(first[type(v), v] for v in used)
+                except KeyError:
+                    key = None  # Not a parameter of the tree, so it may not be the same next time
+
+        if key is not None:
+            self._sql_cache[key] = sql_code, positions
+        return res
+
+    def sql_cache_stats(self):
+        "Returns the statistics of the compiled SQL cache"
+        return self._sql_cache.stats()
+
     def commit(self):
         self._conn.commit()
 
     def rollback(self):
+        self.invalidate_results(None)   # The cache may contain uncommitted results
         self._conn.rollback()
 
     def close(self):
@@ -90,21 +310,27 @@ class SqlInterface:
 # from multiprocessing import Queue
 import queue
 import threading
-from time import sleep
+from concurrent.futures import Future
+from time import monotonic
 
 class TaskQueue:
+    "Runs tasks one at a time, in a dedicated thread"
+
+    _STOP = object()
+
     def __init__(self):
         self._queue = queue.Queue()
-        self._task_results = {}
         self._closed = False
+        self._lock = threading.Lock()   # No task may be added after _STOP
         self._start_worker()
 
     def _add_task(self, task, *args, **kwargs):
-        args = args or ()
-        kwargs = kwargs or {}
-        task_id = object()
-        self._queue.put((task_id, task, args, kwargs))
-        return task_id
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise Signal.make(T.DbError, None, "Connection is closed")
+            self._queue.put((future, task, args, kwargs))
+        return future
 
     def _start_worker(self):
         self.worker = t = threading.Thread(target=self._worker)
@@ -112,33 +338,32 @@ class TaskQueue:
         t.start()
 
     def _worker(self):
-        while not self._closed:
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            future, task, args, kwargs = item
             try:
-                task_id, item, args, kwargs = self._queue.get(timeout=0.1)
-            except queue.Empty:
-                continue
-            try:
-                res = item(*args, **kwargs)  
-            except Exception as e:
-                res = e
-            self._task_results[task_id] = res
-            self._queue.task_done()
-
-
-    def _get_result(self, task_id):
-        while task_id not in self._task_results:
-            sleep(0.001)
-        res = self._task_results.pop(task_id)
-        if isinstance(res, Exception):
-            raise res
-        return res
+                res = task(*args, **kwargs)
+            except BaseException as e:
+                # The exception keeps its original traceback
+                future.set_exception(e)
+            else:
+                future.set_result(res)
 
     def run_task(self, task, *args, **kwargs):
-        task_id = self._add_task(task, *args, **kwargs)
-        return self._get_result(task_id)
+        future = self._add_task(task, *args, **kwargs)
+        return future.result()
 
     def close(self):
-        self._closed = True
+        "Stops the worker, after it finishes the tasks that were already added"
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(self._STOP)
+        if threading.current_thread() is not self.worker:
+            self.worker.join()
 
 
 
@@ -150,9 +375,12 @@ class ThreadedConnection(BaseConnection):
         self._queue = TaskQueue()
         self._conn = self._queue.run_task(create_connection)
 
-    def _backend_execute_sql(self, sql_code):
-        c = self._conn.cursor()
-        c.execute(sql_code)
+    def _backend_execute_sql(self, sql_code, qargs=None, create_cursor=None):
+        c = create_cursor(self._conn) if create_cursor else self._conn.cursor()
+        if qargs is None:
+            c.execute(sql_code)
+        else:
+            c.execute(sql_code, qargs)
         return c
 
     def _import_result(self, sql_type, c):
@@ -160,26 +388,121 @@ class ThreadedConnection(BaseConnection):
             return None
 
         try:
-            res = c.fetchall()
+            with profiler.phase('fetch'):
+                res = c.fetchall()
         except Exception as e:
             msg = "Exception when trying to fetch SQL result. Got error: %s"
             raise DatabaseQueryError(msg%(e))
 
-        return sql_result_to_python(Const(sql_type, res))
+        with profiler.phase('import'):
+            return sql_result_to_python(Const(sql_type, res))
 
-    def _execute_sql(self, state, sql_type, sql_code):
+    def _execute_sql(self, state, sql_type, sql_code, qargs=None):
         assert state
         with context(state=state):
             try:
-                c = self._backend_execute_sql(sql_code)
+                with profiler.phase('execute'):
+                    c = self._backend_execute_sql(sql_code, qargs)
             except Exception as e:
                 msg = "Exception when trying to execute SQL code:\n    %s\n\nGot error: %s"
                 raise DatabaseQueryError(msg%(sql_code, e))
 
             return self._import_result(sql_type, c)
 
-    def execute_sql(self, sql_type, sql_code):
-        return self._queue.run_task(self._execute_sql, context.state, sql_type, sql_code)
+    def execute_sql(self, sql_type, sql_code, qargs=None):
+        return self._queue.run_task(self._execute_sql, context.state, sql_type, sql_code, qargs)
+
+    def _execute_stream(self, state, sql_code, qargs, create_cursor):
+        with context(state=state):
+            try:
+                return self._backend_execute_sql(sql_code, qargs, create_cursor)
+            except Exception as e:
+                msg = "Exception when trying to execute SQL code:\n    %s\n\nGot error: %s"
+                raise DatabaseQueryError(msg%(sql_code, e))
+
+    def _fetch_batch(self, state, sql_type, c, batch_size):
+        with context(state=state):
+            try:
+                with profiler.phase('fetch'):
+                    rows = c.fetchmany(batch_size)
+            except Exception as e:
+                msg = "Exception when trying to fetch SQL result. Got error: %s"
+                raise DatabaseQueryError(msg%(e))
+
+            with profiler.phase('import'):
+                return sql_result_to_python(Const(sql_type, rows))
+
+    def _iter_batches(self, state, sql_type, c, batch_size):
+        try:
+            while True:
+                rows = self._queue.run_task(self._fetch_batch, state, sql_type, c, batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            try:
+                self._queue.run_task(c.close)
+            except Exception:
+                pass    # Connection already closed
+
+    def _fetch_columns(self, state, sql_type, sql_code, qargs, fmt, batch_size, fetch_native):
+        c = self._execute_stream(state, sql_code, qargs, None)
+        with context(state=state):
+            try:
+                native = fetch_native(c, fmt) if fetch_native else None
+                if native is not None:
+                    return import_native_table(sql_type, native, fmt)
+
+                columns = None
+                while True:
+                    rows = c.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    if columns is None:
+                        columns = [list(col) for col in zip(*rows)]
+                    else:
+                        for col, values in zip(columns, zip(*rows)):
+                            col += values
+            except Exception as e:
+                msg = "Exception when trying to fetch SQL result. Got error: %s"
+                raise DatabaseQueryError(msg%(e))
+            finally:
+                c.close()
+
+            if columns is None:
+                columns = [[] for _ in flatten_type(sql_type)]
+            return import_columns(sql_type, columns, fmt)
+
+    def execute_sql_columns(self, sql_type, sql_code, qargs=None, fmt='pandas', batch_size=1024, fetch_native=None):
+        "Execute the query, and return the result in a columnar format (see SqlInterface.query_columns)"
+        return self._queue.run_task(self._fetch_columns, context.state, sql_type, sql_code, qargs, fmt, batch_size, fetch_native)
+
+    def _execute_with_cursor(self, state, sql_code, func):
+        with context(state=state):
+            c = self._conn.cursor()
+            try:
+                func(c)
+            except Exception as e:
+                msg = "Exception when trying to execute SQL code:\n    %s\n\nGot error: %s"
+                raise DatabaseQueryError(msg%(sql_code, e))
+            finally:
+                c.close()
+
+    def execute_with_cursor(self, sql_code, func):
+        """Call func with a new cursor, for driver-specific operations (like executemany).
+
+        sql_code is only used for error messages.
+        """
+        self._queue.run_task(self._execute_with_cursor, context.state, sql_code, func)
+
+    def execute_sql_iter(self, sql_type, sql_code, qargs=None, batch_size=1024, create_cursor=None):
+        """Execute the query, and return an iterator over its rows, which fetches them in batches.
+
+        Not thread-safe. The iterator must be consumed by the same thread that created it.
+        """
+        state = context.state
+        c = self._queue.run_task(self._execute_stream, state, sql_code, qargs, create_cursor)
+        return self._iter_batches(state, sql_type, c, batch_size)
 
 
     def commit(self):
@@ -192,27 +515,292 @@ class ThreadedConnection(BaseConnection):
         self._queue.run_task(self._conn.close)
         self._queue.close()
 
+    def _ping(self):
+        c = self._conn.cursor()
+        c.execute('select 1')
+        row ,= c.fetchall()
+        n ,= row
+        assert n == 1
 
+    def ping(self):
+        self._queue.run_task(self._ping)
+
+
+_RE_CREATE_TEMP = re.compile(r'\s*CREATE\s+TEMP(ORARY)?\s+TABLE', re.IGNORECASE)
+
+class ConnectionPool(BaseConnection):
+    """A pool of threaded connections, that lets queries from different threads run concurrently.
+
+    A thread is pinned to a connection from its first query until the end of its transaction
+    (i.e. commit or rollback), so that the transaction (and session functions, like lastval())
+    always uses the same connection. Then the connection returns to the pool, unless it holds
+    state of the session: temporary tables keep the thread pinned for as long as it lives,
+    and open cursors (of query_stream) until the first commit or rollback after they are closed.
+    The connections of threads that exit in the middle of a transaction are rolled back, and reused,
+    unless they hold temporary tables, in which case they are closed.
+    """
+
+    def __init__(self, create_connection, min_size, max_size, idle_timeout, acquire_timeout):
+        assert 0 <= min_size <= max_size and max_size > 0
+        self._create_connection = create_connection
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+
+        self._cond = threading.Condition()
+        self._idle = []     # [(connection, last_used)]
+        self._pinned = {}   # {thread: connection}
+        self._temp_tables = set()   # Connections that created temporary tables
+        self._open_cursors = {}     # {connection: count}
+        self._size = 0
+        for _ in range(min_size):
+            self._idle.append((ThreadedConnection(create_connection), monotonic()))
+            self._size += 1
+
+    def _acquire(self):
+        thread = threading.current_thread()
+        conn = self._pinned.get(thread)
+        if conn is not None:
+            return conn
+
+        deadline = monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                self._release_dead_threads()
+                self._close_idle()
+                if self._idle:
+                    conn, _last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise Signal.make(T.DbError, None, f"Timed out waiting for a database connection (pool size is {self.max_size})")
+                # Threads don't notify when they exit, so check again periodically
+                self._cond.wait(min(remaining, 0.1))
+
+        if conn is not None and not self._is_healthy(conn):
+            self._close_conn(conn)
+            conn = None
+
+        if conn is None:
+            try:
+                conn = ThreadedConnection(self._create_connection)
+            except BaseException:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        with self._cond:
+            self._pinned[thread] = conn
+        return conn
+
+    def _release(self):
+        "Returns the connection of the current thread to the pool, unless it holds state of the session"
+        with self._cond:
+            thread = threading.current_thread()
+            conn = self._pinned.get(thread)
+            if conn is not None and conn not in self._temp_tables and not self._open_cursors.get(conn):
+                del self._pinned[thread]
+                self._idle.append((conn, monotonic()))
+                self._cond.notify()
+
+    def _release_dead_threads(self):
+        for thread, conn in list(self._pinned.items()):
+            if not thread.is_alive():
+                del self._pinned[thread]
+                self._open_cursors.pop(conn, None)
+                if conn in self._temp_tables:
+                    # Its temporary tables belong to the dead thread
+                    self._temp_tables.remove(conn)
+                    self._close_conn(conn)
+                    self._size -= 1
+                    continue
+                try:
+                    conn.rollback()     # Discard whatever the thread left uncommitted
+                except Exception:
+                    self._close_conn(conn)
+                    self._size -= 1
+                else:
+                    self._idle.append((conn, monotonic()))
+
+    def _close_idle(self):
+        now = monotonic()
+        for item in list(self._idle):
+            conn, last_used = item
+            if self._size > self.min_size and now - last_used > self.idle_timeout:
+                self._idle.remove(item)
+                self._close_conn(conn)
+                self._size -= 1
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.ping()
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def _close_conn(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass    # Probably already broken
+
+    def execute_sql(self, sql_type, sql_code, qargs=None):
+        conn = self._acquire()
+        res = conn.execute_sql(sql_type, sql_code, qargs)
+        if _RE_CREATE_TEMP.match(sql_code):
+            with self._cond:
+                self._temp_tables.add(conn)
+        return res
+
+    def execute_sql_iter(self, sql_type, sql_code, qargs=None, batch_size=1024, create_cursor=None):
+        conn = self._acquire()
+        rows = conn.execute_sql_iter(sql_type, sql_code, qargs, batch_size, create_cursor)
+        with self._cond:
+            self._open_cursors[conn] = self._open_cursors.get(conn, 0) + 1
+        return self._iter_cursor(conn, rows)
+
+    def _iter_cursor(self, conn, rows):
+        try:
+            yield from rows
+        finally:
+            with self._cond:
+                if conn in self._open_cursors:
+                    self._open_cursors[conn] -= 1
+                    if not self._open_cursors[conn]:
+                        del self._open_cursors[conn]
+
+    def execute_sql_columns(self, sql_type, sql_code, qargs=None, fmt='pandas', batch_size=1024, fetch_native=None):
+        return self._acquire().execute_sql_columns(sql_type, sql_code, qargs, fmt, batch_size, fetch_native)
+
+    def execute_with_cursor(self, sql_code, func):
+        self._acquire().execute_with_cursor(sql_code, func)
+
+    def commit(self):
+        conn = self._pinned.get(threading.current_thread())
+        if conn is not None:    # Otherwise, this thread has no open transaction
+            conn.commit()
+            self._release()
+
+    def rollback(self):
+        conn = self._pinned.get(threading.current_thread())
+        if conn is not None:
+            try:
+                conn.rollback()
+            finally:
+                self._release()     # A broken connection is replaced on the next acquire
+
+    def ping(self):
+        self._acquire().ping()
+
+    def close(self):
+        with self._cond:
+            conns = list(self._pinned.values()) + [conn for conn, _ in self._idle]
+            self._pinned.clear()
+            self._idle.clear()
+            self._temp_tables.clear()
+            self._open_cursors.clear()
+            self._size = 0
+        for conn in conns:
+            conn.close()
 
 
 class SqlInterfaceCursor(SqlInterface):
     "An interface that uses the standard SQL cursor interface"
 
+    use_pool = False    # Requires a database that supports multiple connections
+
     def __init__(self, *a, **kw):
         super().__init__(*a, **kw)
 
-        self._conn = ThreadedConnection(self._create_connection)
+        if self.use_pool and settings.Pool.ENABLED:
+            p = settings.Pool
+            self._conn = ConnectionPool(self._create_connection, p.MIN_SIZE, p.MAX_SIZE, p.IDLE_TIMEOUT, p.ACQUIRE_TIMEOUT)
+        else:
+            self._conn = ThreadedConnection(self._create_connection)
+
+
+    def _execute_sql(self, sql_type, sql_code, qargs=None):
+        return self._conn.execute_sql(sql_type, sql_code, qargs)
+
+    def query_stream(self, sql, subqueries=None, batch_size=None, quiet=False):
+        assert context.state
+        assert sql.type <= T.table, sql.type
+        sql_code, qargs = self._compile_query(sql, subqueries, ())
+
+        if self._print_sql and not quiet:
+            log_sql(sql_code, qargs)
+
+        batch_size = batch_size or settings.stream_batch_size
+        return self._conn.execute_sql_iter(sql.type, sql_code, qargs, batch_size, self._create_stream_cursor)
+
+    def _create_stream_cursor(self, conn):
+        return conn.cursor()
+
+    def insert_rows(self, table_name, columns, rows, quiet=False):
+        if self.param_placeholder is None:
+            return super().insert_rows(table_name, columns, rows, quiet)
+        if not rows:
+            return
+
+        placeholders = ', '.join([self.param_placeholder] * len(columns))
+        sql_code = f'INSERT INTO {quote_id(table_name)}({", ".join(map(self.quote_name, columns))}) VALUES ({placeholders})'
+        if self._print_sql and not quiet:
+            log_sql(sql_code + f'  -- x{len(rows)}')
+
+        self._conn.execute_with_cursor(sql_code, lambda c: c.executemany(sql_code, rows))
+
+    def query_columns(self, sql, subqueries=None, fmt='pandas', quiet=False):
+        assert context.state
+        assert sql.type <= T.table, sql.type
+        sql_code, qargs = self._compile_query(sql, subqueries, ())
+
+        if self._print_sql and not quiet:
+            log_sql(sql_code, qargs)
 
+        return self._conn.execute_sql_columns(sql.type, sql_code, qargs, fmt, settings.stream_batch_size, self._fetch_native)
 
-    def _execute_sql(self, sql_type, sql_code):
-        return self._conn.execute_sql(sql_type, sql_code)
+    def _fetch_native(self, c, fmt):
+        "Fetch the result of the cursor as a dataframe or an arrow table, if the driver supports it. Otherwise, return None"
+        return None
+
+    def explain(self, sql, subqueries=None, analyze=False, quiet=False):
+        assert context.state
+        sql_code, qargs = self._compile_query(sql, subqueries, ())
+        explain_code = self._explain_code(sql_code, analyze)
+
+        if self._print_sql and not quiet:
+            log_sql(explain_code, qargs)
+
+        rows = []
+        def fetch(c):
+            if qargs is None:
+                c.execute(explain_code)
+            else:
+                c.execute(explain_code, qargs)
+            rows.extend(c.fetchall())
+        self._conn.execute_with_cursor(explain_code, fetch)
+
+        plan = QueryPlan()
+        self._parse_plan(plan, rows, analyze)
+        return plan
+
+    def _explain_code(self, sql_code, analyze):
+        return ('EXPLAIN ANALYZE ' if analyze else 'EXPLAIN ') + sql_code
+
+    def _parse_plan(self, plan, rows, analyze):
+        "Adds the steps of the plan, given the rows that EXPLAIN returned"
+        plan.add_text('\n'.join(str(row[-1]) for row in rows))
 
     def ping(self):
-        c = self._conn.cursor()
-        c.execute('select 1')
-        row ,= c.fetchall()
-        n ,= row
-        assert n == 1
+        self._conn.ping()
 
 
 class OracleInterface(SqlInterfaceCursor):
@@ -273,6 +861,7 @@ class MysqlInterface(SqlInterfaceCursor):
 
     id_type_decl = "INTEGER NOT NULL AUTO_INCREMENT"
     requires_subquery_name = True
+    use_pool = True
 
     def __init__(self, host, port, database, user, password, print_sql=False):
         self._print_sql = print_sql
@@ -286,7 +875,7 @@ class MysqlInterface(SqlInterfaceCursor):
         from mysql.connector import errorcode
 
         try:
-            return mysql.connector.connect(charset='utf8', use_unicode=True, **self._args)
+            return mysql.connector.connect(charset='utf8', use_unicode=True, allow_local_infile=settings.mysql_local_infile, **self._args)
         except mysql.connector.Error as e:
             if e.errno == errorcode.ER_ACCESS_DENIED_ERROR:
                 raise ConnectError("Bad user name or password") from e
@@ -333,6 +922,54 @@ class MysqlInterface(SqlInterfaceCursor):
     def quote_name(self, name):
         return f'`{name}`'
 
+    def load_csv(self, table_name, columns, filename, header, null_if_empty=(), quiet=False):
+        if not settings.mysql_local_infile:
+            return False
+
+        with open(filename, 'rb') as f:
+            line_end = '\\r\\n' if f.readline().endswith(b'\r\n') else '\\n'
+        quoted_filename = "'%s'" % filename.replace('\\', '\\\\').replace("'", "\\'")
+
+        # LOAD DATA reads an empty field as 0 (or an error) for numbers, so we read it into a variable first
+        targets = [f'@_{i}' if c in null_if_empty else self.quote_name(c) for i, c in enumerate(columns)]
+        assignments = [f"{self.quote_name(c)} = NULLIF(@_{i}, '')" for i, c in enumerate(columns) if c in null_if_empty]
+        sql_code = (f"LOAD DATA LOCAL INFILE {quoted_filename} INTO TABLE {quote_id(table_name)} "
+                    f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '{line_end}' "
+                    f"IGNORE {1 if header else 0} LINES ({', '.join(targets)})")
+        if assignments:
+            sql_code += " SET " + ', '.join(assignments)
+        if self._print_sql and not quiet:
+            log_sql(sql_code)
+
+        self._conn.execute_sql(T.nulltype, sql_code)
+        return True
+
+    def _explain_code(self, sql_code, analyze):
+        # EXPLAIN ANALYZE only supports the tree format
+        return ('EXPLAIN ANALYZE ' if analyze else 'EXPLAIN FORMAT=JSON ') + sql_code
+
+    def _parse_plan(self, plan, rows, analyze):
+        (res,), = rows
+        if analyze:
+            plan.add_text(res)
+        else:
+            self._add_plan_node(plan, json.loads(res), None)
+
+    def _add_plan_node(self, plan, node, parent):
+        for key, value in node.items():
+            if isinstance(value, list):
+                for item in value:
+                    if isinstance(item, dict):
+                        self._add_plan_node(plan, item, parent)
+            elif isinstance(value, dict) and key != 'cost_info':
+                cost = value.get('cost_info', {})
+                if key == 'table':
+                    id_ = plan.add(parent, value.get('access_type', key), value.get('table_name', ''),
+                                   est_cost=cost.get('prefix_cost'), est_rows=value.get('rows_produced_per_join'))
+                else:
+                    id_ = plan.add(parent, key, est_cost=cost.get('query_cost') or cost.get('sort_cost'))
+                self._add_plan_node(plan, value, id_)
+
 
 class PrestoInterface(SqlInterfaceCursor):
     target = presto
@@ -381,6 +1018,9 @@ class PostgresInterface(SqlInterfaceCursor):
 
     id_type_decl = "SERIAL"
     requires_subquery_name = True
+    param_placeholder = '%s'
+    supports_returning = True
+    use_pool = True
 
     def __init__(self, host, port, database, user, password, print_sql=False):
         self.args = dict(host=host, port=port, database=database, user=user, password=password)
@@ -395,6 +1035,27 @@ class PostgresInterface(SqlInterfaceCursor):
         except psycopg2.OperationalError as e:
             raise ConnectError(*e.args) from e
 
+    _stream_counter = itertools.count()
+
+    def _create_stream_cursor(self, conn):
+        # A named cursor is kept on the server, and only sends the rows we fetch
+        return conn.cursor(name='preql_stream_%d' % next(self._stream_counter))
+
+    def insert_rows(self, table_name, columns, rows, quiet=False):
+        if not rows:
+            return
+
+        # COPY is much faster than INSERT. Unquoted empty values are read as NULL.
+        buf = io.StringIO()
+        csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+        buf.seek(0)
+
+        sql_code = f'COPY {quote_id(table_name)}({", ".join(map(self.quote_name, columns))}) FROM STDIN WITH (FORMAT csv)'
+        if self._print_sql and not quiet:
+            log_sql(sql_code + f'  -- x{len(rows)}')
+
+        self._conn.execute_with_cursor(sql_code, lambda c: c.copy_expert(sql_code, buf))
+
 
 
 
@@ -471,12 +1132,36 @@ class PostgresInterface(SqlInterfaceCursor):
             # name = '%s.%s' % (schema, table_name)
             yield schema, table_name, T.table(cols, name=Id(schema, table_name))
 
+    _PLAN_DETAILS = ('Relation Name', 'Alias', 'Index Name', 'Join Type', 'Strategy',
+                     'Sort Key', 'Group Key', 'Index Cond', 'Hash Cond', 'Filter')
+
+    def _explain_code(self, sql_code, analyze):
+        return ('EXPLAIN (FORMAT JSON, ANALYZE) ' if analyze else 'EXPLAIN (FORMAT JSON) ') + sql_code
+
+    def _parse_plan(self, plan, rows, analyze):
+        (res,), = rows
+        if isinstance(res, str):
+            res = json.loads(res)
+        for item in res:
+            self._add_plan_node(plan, item['Plan'], None)
+
+    def _add_plan_node(self, plan, node, parent):
+        detail = _plan_detail((k, node[k]) for k in self._PLAN_DETAILS if k in node)
+        id_ = plan.add(parent, node['Node Type'], detail, est_cost=node.get('Total Cost'), est_rows=node.get('Plan Rows'),
+                       actual_rows=node.get('Actual Rows'), actual_time=node.get('Actual Total Time'))
+        for child in node.get('Plans', []):
+            self._add_plan_node(plan, child, id_)
+
 
 class RedshiftInterface(PostgresInterface):
     target = redshift
 
     id_type_decl = "INT IDENTITY(1,1)"
 
+    # Redshift's EXPLAIN only has a text format, without ANALYZE
+    _explain_code = SqlInterfaceCursor._explain_code
+    _parse_plan = SqlInterfaceCursor._parse_plan
+
 
 class SnowflakeInterface(SqlInterface):
     target = snowflake
@@ -500,7 +1185,7 @@ class SnowflakeInterface(SqlInterface):
         )
 
         self._schema = schema
-        self._print_sql = print_sql
+        super().__init__(print_sql)
 
     def qualified_name(self, name):
         "Ensure the name has a dataset"
@@ -578,18 +1263,21 @@ class SnowflakeInterface(SqlInterface):
             return None
 
         try:
-            res = c.fetchall()
+            with profiler.phase('fetch'):
+                res = c.fetchall()
         except Exception as e:
             msg = "Exception when trying to fetch SQL result. Got error: %s"
             raise DatabaseQueryError(msg%(e))
 
-        return sql_result_to_python(Const(sql_type, res))
+        with profiler.phase('import'):
+            return sql_result_to_python(Const(sql_type, res))
 
-    def _execute_sql(self, sql_type, sql_code):
+    def _execute_sql(self, sql_type, sql_code, qargs=None):
         import snowflake.connector
         cs = self._client.cursor()
         try:
-            res = cs.execute(sql_code)
+            with profiler.phase('execute'):
+                res = cs.execute(sql_code, qargs)
             return self._import_result(sql_type, res)
         except snowflake.connector.errors.DatabaseError as e:
             msg = "Exception when trying to execute SQL code:\n    %s\n\nGot error: %s"
@@ -597,6 +1285,23 @@ class SnowflakeInterface(SqlInterface):
         finally:
             cs.close()
 
+    def query_columns(self, sql, subqueries=None, fmt='pandas', quiet=False):
+        import snowflake.connector
+        sql_code, qargs = self._compile_query(sql, subqueries, ())
+        if self._print_sql and not quiet:
+            log_sql(sql_code, qargs)
+
+        cs = self._client.cursor()
+        try:
+            cs.execute(sql_code, qargs)
+            res = cs.fetch_arrow_all() if fmt == 'arrow' else cs.fetch_pandas_all()
+        except snowflake.connector.errors.DatabaseError as e:
+            msg = "Exception when trying to execute SQL code:\n    %s\n\nGot error: %s"
+            raise DatabaseQueryError(msg%(sql_code, e))
+        finally:
+            cs.close()
+        return import_native_table(sql.type, res, fmt)
+
     def commit(self):
         pass
     def rollback(self):
@@ -620,7 +1325,7 @@ class BigQueryInterface(SqlInterface):
         self.dataset = dataset
         self._active_dataset = dataset
 
-        self._print_sql = print_sql
+        super().__init__(print_sql)
 
         self._dataset_ensured = False
 
@@ -651,17 +1356,33 @@ class BigQueryInterface(SqlInterface):
         datasets = self._client.list_datasets()
         return [x.reference.dataset_id for x in datasets]
 
-    def _execute_sql(self, sql_type, sql_code):
+    def _execute_sql(self, sql_type, sql_code, qargs=None):
         assert context.state
+        assert not qargs
         try:
-            res = list(self._client.query(sql_code))
+            with profiler.phase('execute'):
+                res = list(self._client.query(sql_code))
         except Exception as e:
             msg = "Exception when trying to execute SQL code:\n    %s\n\nGot error: %s"
             raise DatabaseQueryError(msg%(sql_code, e))
 
         if sql_type is not T.nulltype:
-            res = [list(i.values()) for i in res]
-            return sql_result_to_python(Const(sql_type, res))
+            with profiler.phase('import'):
+                res = [list(i.values()) for i in res]
+                return sql_result_to_python(Const(sql_type, res))
+
+    def query_columns(self, sql, subqueries=None, fmt='pandas', quiet=False):
+        sql_code, _qargs = self._compile_query(sql, subqueries, ())
+        if self._print_sql and not quiet:
+            log_sql(sql_code)
+
+        try:
+            job = self._client.query(sql_code)
+            res = job.to_arrow() if fmt == 'arrow' else job.to_dataframe()
+        except Exception as e:
+            msg = "Exception when trying to execute SQL code:\n    %s\n\nGot error: %s"
+            raise DatabaseQueryError(msg%(sql_code, e))
+        return import_native_table(sql.type, res, fmt)
 
 
 
@@ -831,6 +1552,8 @@ class _SqliteStddev:
 class SqliteInterface(SqlInterfaceCursor, AbsSqliteInterface):
     target = sqlite
 
+    param_placeholder = '?'
+
     def __init__(self, filename=None, print_sql=False):
         self._filename = filename
         super().__init__(print_sql)
@@ -840,7 +1563,8 @@ class SqliteInterface(SqlInterfaceCursor, AbsSqliteInterface):
         import sqlite3
         # sqlite3.enable_callback_tracebacks(True)
         try:
-            conn = sqlite3.connect(self._filename or ':memory:')
+            # Sqlite keeps prepared statements for recently used SQL code
+            conn = sqlite3.connect(self._filename or ':memory:', cached_statements=settings.sql_cache_max_size)
         except sqlite3.OperationalError as e:
             raise ConnectError(*e.args) from e
 
@@ -856,12 +1580,29 @@ class SqliteInterface(SqlInterfaceCursor, AbsSqliteInterface):
     def quote_name(self, name):
         return f'[{name}]'
 
+    @property
+    def supports_returning(self):
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 35)
+
+    def _explain_code(self, sql_code, analyze):
+        if analyze:
+            raise Signal.make(T.NotImplementedError, None, "Sqlite doesn't support EXPLAIN ANALYZE")
+        return 'EXPLAIN QUERY PLAN ' + sql_code
+
+    def _parse_plan(self, plan, rows, analyze):
+        ids = {}
+        for id_, parent, _notused, detail in rows:
+            operation, _, rest = detail.partition(' ')
+            ids[id_] = plan.add(ids.get(parent), operation, rest)
+
 
 class DuckInterface(SqliteInterface):
     target = duck
 
     supports_foreign_key = False
     requires_subquery_name = True
+    supports_returning = True
 
     def _create_connection(self):
         import duckdb
@@ -873,6 +1614,46 @@ class DuckInterface(SqliteInterface):
     def rollback(self):
         pass    # XXX
 
+    def _fetch_native(self, c, fmt):
+        if fmt == 'arrow':
+            return c.fetch_arrow_table()
+        return c.fetchdf()
+
+    def _explain_code(self, sql_code, analyze):
+        return ('EXPLAIN (ANALYZE, FORMAT JSON) ' if analyze else 'EXPLAIN (FORMAT JSON) ') + sql_code
+
+    def _parse_plan(self, plan, rows, analyze):
+        (_key, res), = rows
+        self._add_plan_node(plan, json.loads(res), None)
+
+    def _add_plan_node(self, plan, node, parent):
+        if isinstance(node, list):
+            for n in node:
+                self._add_plan_node(plan, n, parent)
+            return
+
+        name = node.get('operator_name') or node.get('name')
+        if name and name != 'EXPLAIN_ANALYZE':
+            info = dict(node.get('extra_info') or {})
+            est_rows = info.pop('Estimated Cardinality', None)
+            timing = node.get('operator_timing')
+            parent = plan.add(parent, name.strip(), _plan_detail(info.items()), est_rows=est_rows,
+                              actual_rows=node.get('operator_cardinality'),
+                              actual_time=None if timing is None else timing * 1000)
+
+        for child in node.get('children', []):
+            self._add_plan_node(plan, child, parent)
+
+    def load_csv(self, table_name, columns, filename, header, null_if_empty=(), quiet=False):
+        header = 'true' if header else 'false'
+        sql_code = (f'INSERT INTO {quote_id(table_name)}({", ".join(map(self.quote_name, columns))}) '
+                    f'SELECT * FROM read_csv_auto(?, header={header})')
+        if self._print_sql and not quiet:
+            log_sql(sql_code, [filename])
+
+        self._conn.execute_sql(T.nulltype, sql_code, [filename])
+        return True
+
 
 class GitInterface(AbsSqliteInterface):
     "Uses https://github.com/augmentable-dev/askgit"
@@ -893,8 +1674,9 @@ class GitInterface(AbsSqliteInterface):
         type=T.string,
     ))
 
-    def _execute_sql(self, sql_type, sql_code):
+    def _execute_sql(self, sql_type, sql_code, qargs=None):
         assert context.state
+        assert not qargs
         try:
             res = subprocess.check_output(['askgit', '--format', 'json', sql_code])
         except FileNotFoundError:
@@ -971,6 +1753,7 @@ def create_engine(db_uri, print_sql, auto_create):
                 raise ConnectError("File %r doesn't exist. To create it, set auto_create to True" % path)
         return SqliteInterface(path, print_sql=print_sql)
 
+    import dsnparse
     dsn = dsnparse.parse(db_uri)
     if len(dsn.schemes) > 1:
         raise NotImplementedError("Preql doesn't support multiple schemes")
@@ -1,6 +1,8 @@
+import sys
 import time
 import re
-from collections import deque
+import threading
+from collections import deque, OrderedDict, defaultdict
 from contextlib import contextmanager
 from pathlib import Path
 
@@ -9,13 +11,52 @@ from functools import wraps
 from operator import getitem
 
 import runtype
-from rich.text import Text
+from runtype.dispatch import MultiDispatch
+from runtype.validation import PythonTyping
 
 from . import settings
 
 mut_dataclass = runtype.dataclass(check_types=settings.typecheck, frozen=False)
 dataclass = runtype.dataclass(check_types=settings.typecheck)
-dsp = runtype.Dispatch()
+
+
+class Dispatch(MultiDispatch):
+    """A multiple-dispatch group, that memoizes the resolution of each function
+
+    Each function keeps a table from the dispatch keys of its arguments to the resolved
+    implementation, so a repeated call costs a single dict lookup.
+    By default, the dispatch key of an argument is its type.
+    """
+
+    def __init__(self, typesystem=PythonTyping(), get_key=None):
+        super().__init__(typesystem)
+        self.get_key = get_key or typesystem.get_type
+
+    def __call__(self, f):
+        root = self.roots[f.__name__]
+        root.name = f.__name__
+        root.typesystem = self.typesystem
+        root.test_subtypes = self.test_subtypes
+
+        root.define_function(f)
+        root._cache.clear()     # A new signature may change earlier resolutions
+
+        resolved = root._cache
+        find_function = root.find_function
+        get_key = self.get_key
+
+        @wraps(f)
+        def dispatched_f(*args, **kw):
+            key = tuple(map(get_key, args))
+            try:
+                f = resolved[key]
+            except KeyError:
+                f = resolved[key] = find_function(args)
+            return f(*args, **kw)
+
+        return dispatched_f
+
+dsp = Dispatch()
 
 class SafeDict(dict):
     def __setitem__(self, key, value):
@@ -34,6 +75,152 @@ class SafeDict(dict):
 def merge_dicts(dicts):
     return SafeDict().update(*dicts)
 
+
+class LRUCache:
+    "A thread-safe mapping with a size bound, which evicts the least recently used items first"
+
+    def __init__(self, max_size):
+        assert max_size > 0, max_size
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        return {'size': len(self._items), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def approx_sizeof(obj):
+    "Returns the approximate memory size of a value, including the values it contains"
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_sizeof(k) + approx_sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_sizeof(i) for i in obj)
+    return size
+
+
+class ResultCache:
+    """A thread-safe cache of query results, bounded by the time-to-live of each item, and by their total size in bytes
+
+    Each item records the tables it depends on, so it can be evicted when they change.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items = OrderedDict()     # {key: (value, size, expiry time, tables)}
+        self._keys_by_table = defaultdict(set)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _remove(self, key):
+        _value, size, _expires, tables = self._items.pop(key)
+        self.bytes -= size
+        for t in tables:
+            keys = self._keys_by_table[t]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_table[t]
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, _size, expires, _tables = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if time.monotonic() > expires:
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tables):
+        size = approx_sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = value, size, time.monotonic() + self.ttl, frozenset(tables)
+            self.bytes += size
+            for t in tables:
+                self._keys_by_table[t].add(key)
+
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._items)))
+                self.evictions += 1
+
+    def invalidate(self, tables):
+        "Evicts the items that depend on any of the given tables"
+        with self._lock:
+            for t in tables:
+                for key in list(self._keys_by_table.get(t, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._items)
+            self._items.clear()
+            self._keys_by_table.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        return {'size': len(self._items), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'invalidations': self.invalidations}
+
+
 def concat(*iters):
     return [elem for it in iters for elem in it]
 def concat_for(iters):
@@ -205,6 +392,7 @@ class TextReference:
 
         start = self.ref.start
         if rich:
+            from rich.text import Text
             return [
                 f"  [red]~~~[/red] file '{source.name}' line {start.line}, column {start.column}",
                 Text(text_before + text_after),
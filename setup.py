@@ -9,6 +9,7 @@ setup(
     packages = ['preql'],
 
     requires = [],
+    python_requires = '>=3.7',
     install_requires = ['lark-parser>=1.1.2', 'runtype>=0.1.4', 'dsnparse', 'prompt-toolkit', 'pygments', 'rich'],
     extra_requires = ['psycopg2'],
 
@@ -1,4 +1,6 @@
+import tempfile
 from unittest import TestCase, skip
+from unittest.mock import patch
 from preql.core import sql
 from preql import Preql, settings
 
@@ -22,6 +24,13 @@ class PreqlTests(TestCase):
     def setUp(self):
         self.preql = None
 
+        # Don't write parsed files to the user's cache
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        parse_cache_dir = patch.object(settings, 'parse_cache_dir', cache_dir.name)
+        parse_cache_dir.start()
+        self.addCleanup(parse_cache_dir.stop)
+
     def tearDown(self):
         if self.preql:
             self.preql._interp.state.db.rollback()
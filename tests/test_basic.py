@@ -1,14 +1,26 @@
 from multiprocessing.pool import ThreadPool
-
+import traceback
+import re
+import os
+import tempfile
+import threading
+import sqlite3
+from unittest.mock import patch
+from functools import partial
+
+from preql import settings
 from preql.core.sql import mysql, bigquery, sqlite
 from unittest import skip, SkipTest
 
 from parameterized import parameterized_class
+from runtype import DispatchError
 
 from preql.core.pql_objects import UserFunction
 from preql.core.exceptions import Signal
-from preql.core.pql_types import T, Id
-from preql.sql_interface import _drop_tables
+from preql.utils import Dispatch
+from preql.core.pql_types import T, Id, TS_Preql_subclass
+from preql.context import context
+from preql.sql_interface import _drop_tables, TaskQueue, ConnectionPool, SqlInterface
 
 from .common import PreqlTests, SQLITE_URI, POSTGRES_URI, MYSQL_URI, DUCK_URI, BIGQUERY_URI
 
@@ -451,6 +463,19 @@ class BasicTests(PreqlTests):
         assert list(preql.q2) == [{'item': 3}]
         # assert list(preql.q3) == [{'a': {'item': 3}}]    # TODO
 
+    def test_temptable_after_commit(self):
+        # Temporary tables belong to a connection, so a pooled connection must stay with its thread
+        preql = self.Preql()
+        preql('t = temptable([1, 2, 3])')
+        preql.commit()
+        assert preql('count(t)') == 3
+        preql('new t(4)')
+        preql.commit()
+        assert preql('sum(t{item})') == 10
+        for i, row in enumerate(preql('t{item} order {item}').iter_rows(batch_size=1)):
+            preql.commit()
+            assert row == {'item': i + 1}
+
     @uses_tables('Point')
     def test_update(self):
         preql = self.Preql()
@@ -644,6 +669,139 @@ class BasicTests(PreqlTests):
         assert preql('adult()[..10] + adult()[..1]') == list(range(18, 28)) + [18]
         self.assertEqual( preql('list( (adult()[..10] + adult()[..1]) {item + 1} )') , list(range(19, 29)) + [19] )
 
+    def test_func_cache(self):
+        preql = self.Preql()
+        preql('''
+            n = 10
+            func f(x) = x + n
+        ''')
+        cache = preql._interp.state.func_cache
+
+        assert preql.f(1) == 11
+        assert preql.f(2) == 12
+        assert cache.stats()['hits'] >= 1
+
+        # Rebinding a global must invalidate code compiled with the old value
+        preql('n = 20')
+        assert preql.f(1) == 21
+
+        preql('func f(x) = x + 1')
+        assert preql.f(1) == 2
+
+        # A new global that shadows a builtin too
+        preql('func g(x: float) = round(x)')
+        assert preql.g(1.2) == 1
+        preql('func round(x) = 100')
+        assert preql.g(1.2) == 100
+
+    def test_bind_parameters(self):
+        preql = self.Preql()
+        preql('''
+            func f(s) = s + "!"
+            func g(n) = n * 2
+        ''')
+
+        assert preql.f("it's 100%") == "it's 100%!"
+        assert preql.f("") == "!"
+        assert preql.g(3) == 6
+        assert preql.g(2.5) == 5.0
+
+        db = preql._interp.state.db
+        if db.param_placeholder is None or not self.optimized:
+            return  # Values are inlined as literals
+
+        # The values are passed as arguments, so the SQL code is the same for every call
+        queries = []
+        execute_sql = db._execute_sql
+        def record(sql_type, sql_code, qargs):
+            queries.append((sql_code, qargs))
+            return execute_sql(sql_type, sql_code, qargs)
+
+        with patch.object(db, '_execute_sql', record):
+            assert preql.f("first") == "first!"
+            assert preql.f("second") == "second!"
+
+        (code1, qargs1), (code2, qargs2) = queries
+        assert code1 == code2
+        assert 'first' not in code1
+        assert qargs1 == ('first',)
+        assert qargs2 == ('second',)
+
+    @uses_tables('A')
+    def test_iter_rows(self):
+        preql = self.Preql()
+        preql('''
+            table A {x: int}
+            for (i in [1..8]) {
+                new A(i)
+            }
+        ''')
+
+        res = preql('A{x} order {x}')
+        assert list(res.iter_rows(batch_size=3)) == [{'x': i} for i in range(1, 8)]
+        assert [r['x'] for r in res] == list(range(1, 8))
+        assert list(preql('[1,2,3]').iter_rows(2)) == [1, 2, 3]
+
+        rows = res.iter_rows(batch_size=2)
+        assert next(rows) == {'x': 1}
+        rows.close()
+        assert len(res) == 7
+
+    @uses_tables('A', 'B')
+    def test_new_rows(self):
+        preql = self.Preql()
+        preql('''
+            table A {x: int, y: string = "d"}
+            table B {a: int, b: string}
+            new B(1, "p")
+            new B(2, "q")
+            new B(3, "r")
+        ''')
+
+        preql('ids = new[] A(B{a} order {a})\n1')
+        preql('ids2 = new[] A(B{a: a*10, b} order {a})\n1')
+        assert len(preql.ids) == len(preql.ids2) == 3
+
+        if preql._interp.state.db.target is bigquery:
+            return
+
+        res = preql('A{id, x, y} order {id}').to_json()
+        assert [(r['x'], r['y']) for r in res] == [(1, 'd'), (2, 'd'), (3, 'd'), (10, 'p'), (20, 'q'), (30, 'r')]
+        assert list(preql.ids) + list(preql.ids2) == [r['id'] for r in res]
+
+        # Multiple batches, without RETURNING
+        db = preql._interp.state.db
+        with patch.object(settings, 'insert_batch_size', 2), patch.object(type(db), 'supports_returning', False):
+            preql('ids3 = new[] A([41,42,43,44,45] {item})\n1')
+        assert list(preql.ids3) == [r['id'] for r in preql('A[x>40]{id} order {id}').to_json()]
+
+    @uses_tables('A')
+    def test_sql_cache(self):
+        preql = self.Preql()
+        preql('''
+            table A {x: int}
+            new A(1)
+            new A(2)
+        ''')
+        db = preql._interp.state.db
+
+        assert preql('count(A[x > 1])') == 1
+        hits = db.sql_cache_stats()['hits']
+        assert preql('count(A[x > 1])') == 1
+        assert db.sql_cache_stats()['hits'] > hits
+
+        assert preql('count(A[x > 0])') == 2
+
+        # Calls that differ only in the values of their arguments share an entry
+        preql('func f(a, b) = count(A[x >= a and x <= b])')
+        assert preql.f(1, 2) == 2
+        hits = db.sql_cache_stats()['hits']
+        assert preql.f(2, 2) == 1
+        assert preql.f(2, 3) == 1
+        assert preql.f(0, 1) == 1
+        if db.param_placeholder is not None and self.optimized:
+            assert db.sql_cache_stats()['hits'] >= hits + 2
+
 
     def test_bare_table(self):
         preql = self.Preql()
@@ -1013,6 +1171,60 @@ class BasicTests(PreqlTests):
         assert len(res) == 0
         assert preql('count(A)') == 0
 
+    @uses_tables('A')
+    def test_import_csv(self):
+        preql = self.Preql()
+        preql('''
+            table A {
+                x: int
+                y: float
+                s: string
+                b: bool
+                n: int?
+            }
+        ''')
+
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'a.csv')
+            with open(filename, 'w', encoding='utf8', newline='') as f:
+                f.write('x,y,s,b,n\n1,1.5,hello,true,10\n2,-2,"a, ""b""",false,\n\n3,0.25,שלום,1,30\n')
+
+            preql.import_csv(preql.A, filename, True)
+            res = preql('A{x, y, s, b, n} order {x}').to_json()
+            assert res == [
+                {'x': 1, 'y': 1.5, 's': 'hello', 'b': True, 'n': 10},
+                {'x': 2, 'y': -2.0, 's': 'a, "b"', 'b': False, 'n': None},
+                {'x': 3, 'y': 0.25, 's': 'שלום', 'b': True, 'n': 30},
+            ], res
+
+            with open(filename, 'w', encoding='utf8') as f:
+                f.write('4,1,x,false,1\n5,1,x,maybe,1\n')
+            self.assertRaises(Signal, preql.import_csv, preql.A, filename)
+
+    @uses_tables('A')
+    def test_update_delete_expr(self):
+        preql = self.Preql()
+        preql('''
+            table A {
+                x: int
+            }
+            for (i in [1..9]) {
+                new A(i)
+            }
+        ''')
+
+        # Table expressions that aren't a simple selection
+        preql('A order {x} [..3] update {x: x + 100}')
+        preql('A[x > 5] order {x} [..2] delete [true]')
+        assert [r['x'] for r in preql('A{x} order {x}').to_json()] == [4, 5, 8, 101, 102, 103]
+
+        # Fallback to lists of ids
+        db = preql._interp.state.db
+        with patch('preql.core.evaluate._modify_by_query', lambda table: False), patch.object(type(db), 'max_rows_per_query', 2):
+            preql('A order {x} [..4] update {x: x * 2}')
+            preql('A[x > 100] order {x} [..2] delete [true]')
+        assert [r['x'] for r in preql('A{x} order {x}').to_json()] == [8, 10, 16, 202]
+
 
     @uses_tables('A')
     def test_text(self):
@@ -1619,6 +1831,495 @@ class TestFlow(PreqlTests):
         assert row.x in a{x}
         ''')
 
+    def test_task_queue(self):
+        q = TaskQueue()
+        assert q.run_task(sum, [1, 2, 3]) == 6
+
+        def fail():
+            raise ValueError("bad")
+        try:
+            q.run_task(fail)
+        except ValueError as e:
+            # Raised in the worker thread, with its original traceback
+            assert traceback.extract_tb(e.__traceback__)[-1].name == 'fail'
+        else:
+            assert False
+
+        q.close()
+        self.assertRaises(Signal, q.run_task, sum, [])
+
+        # Tasks added while closing are either run, or refused
+        for _ in range(10):
+            q = TaskQueue()
+            futures = []
+            def add_tasks():
+                for i in range(100):
+                    try:
+                        futures.append(q._add_task(int, i))
+                    except Signal:
+                        return
+
+            threads = [threading.Thread(target=add_tasks) for _ in range(4)]
+            for t in threads:
+                t.start()
+            q.close()
+            for t in threads:
+                t.join()
+            for f in futures:
+                f.result(timeout=5)
+
+    def test_connection_pool(self):
+        pool = ConnectionPool(lambda: sqlite3.connect(':memory:'), 1, 2, 60, 0.2)
+        main_conn = pool._acquire()
+        assert pool._acquire() is main_conn     # Pinned to this thread
+
+        def acquire():
+            pool.ping()
+            conns.append(pool._acquire())
+
+        conns = []
+        t = threading.Thread(target=acquire)
+        t.start()
+        t.join()
+        assert conns[0] is not main_conn
+
+        # The connection of a finished thread is reused
+        t = threading.Thread(target=acquire)
+        t.start()
+        t.join()
+        assert conns[1] is conns[0]
+
+        # While both connections are in use, other threads time out
+        barrier = threading.Barrier(2)
+        def hold():
+            pool._acquire()
+            barrier.wait()
+            barrier.wait()
+
+        def acquire_fails():
+            try:
+                pool._acquire()
+            except Signal:
+                timeouts.append(True)
+
+        timeouts = []
+        t = threading.Thread(target=hold)
+        t.start()
+        barrier.wait()
+        t2 = threading.Thread(target=acquire_fails)
+        t2.start()
+        t2.join()
+        barrier.wait()
+        t.join()
+        assert timeouts
+
+        pool.close()
+
+        # Connections return to the pool at the end of each transaction,
+        # so live threads can share it, even when there are more of them than connections
+        pool = ConnectionPool(lambda: sqlite3.connect(':memory:'), 1, 2, 60, 0.2)
+        done = threading.Barrier(5)
+        errors = []
+        def transaction():
+            try:
+                pool.ping()
+                pool.commit()
+                pool.ping()
+                pool.rollback()
+            except Exception as e:
+                errors.append(e)
+            done.wait()     # Stay alive until all are done
+
+        threads = [threading.Thread(target=transaction) for _ in range(4)]
+        for t in threads:
+            t.start()
+        done.wait()
+        for t in threads:
+            t.join()
+        assert not errors
+        assert pool._size <= 2 and not pool._pinned
+
+        pool.close()
+
+        # Temporary tables keep the thread pinned, and so do open cursors, until they are closed
+        pool = ConnectionPool(lambda: sqlite3.connect(':memory:'), 1, 2, 60, 0.2)
+        with context(state=self.Preql()._interp.state):
+            pool.execute_sql(T.int, 'SELECT 1')
+            pool.commit()
+            assert not pool._pinned
+
+            pool.execute_sql(T.nulltype, 'CREATE TEMPORARY TABLE t (x INTEGER)')
+            conn = pool._acquire()
+            pool.commit()
+            assert pool._acquire() is conn
+            pool.execute_sql(T.nulltype, 'INSERT INTO t VALUES (1)')
+            pool.commit()
+            assert pool.execute_sql(T.int, 'SELECT count(*) FROM t') == 1
+            pool.close()
+
+            pool = ConnectionPool(lambda: sqlite3.connect(':memory:'), 1, 2, 60, 0.2)
+            rows = pool.execute_sql_iter(T.list[T.int], 'SELECT 1 UNION ALL SELECT 2', batch_size=1)
+            assert next(rows) == 1
+            pool.commit()
+            assert pool._pinned
+            assert list(rows) == [2]
+            pool.commit()
+            assert not pool._pinned
+            pool.close()
+
+    def test_closed_connection(self):
+        p = self.Preql()
+        p.close()
+        self.preql = None   # Nothing to clean up
+        self.assertRaises(Signal, p, 'count([1,2,3])')
+
+    def test_parse_cache(self):
+        from preql.core import parse_cache
+
+        parsed = []
+        def parse_stmts(code, source_file):
+            if str(source_file) == filename:
+                parsed.append(source_file)
+            return orig_parse_stmts(code, source_file)
+        orig_parse_stmts = parse_cache.parse_stmts
+
+        with tempfile.TemporaryDirectory() as d, patch.object(settings, 'parse_cache_dir', os.path.join(d, 'cache')), \
+                patch.object(parse_cache, 'parse_stmts', parse_stmts):
+            filename = os.path.join(d, 'a.pql')
+            with open(filename, 'w') as f:
+                f.write('func f(x: int) = x + 1\na = "a"\n')
+
+            p = self.Preql()
+            p.load(filename)
+            assert p.f(1) == 2 and p.a == 'a'
+            assert len(parsed) == 1
+            p.close()
+
+            # Loaded from cache
+            p = self.Preql()
+            p.load(filename)
+            assert p.f(2) == 3 and p.a == 'a'
+            assert len(parsed) == 1
+
+            # Content changed
+            with open(filename, 'w') as f:
+                f.write('func f(x: int) = x + 2\na = "b"\n')
+            p.load(filename)
+            assert p.f(1) == 3 and p.a == 'b'
+            assert len(parsed) == 2
+
+            # Doesn't cache syntax errors
+            with open(filename, 'w') as f:
+                f.write('a = (\n')
+            self.assertRaises(Signal, p.load, filename)
+            self.assertRaises(Signal, p.load, filename)
+            assert len(parsed) == 4
+
+    def test_module_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            cwd = os.getcwd()
+            os.chdir(d)
+            try:
+                with open('counter_mod.pql', 'w') as f:
+                    f.write('table Log {x: int}\nnew Log(1)\nfunc f() = 1\n')
+
+                p = self.Preql()
+                p('import counter_mod')
+                p('import counter_mod')
+                assert p('count(counter_mod.Log)') == 1
+                assert p('counter_mod.f()') == 1
+
+                # A different database evaluates the module again
+                p2 = self.Preql()
+                p2('import counter_mod')
+                assert p2('count(counter_mod.Log)') == 1
+
+                # The file changed
+                with open('counter_mod.pql', 'w') as f:
+                    f.write('table Log {x: int}\nnew Log(2)\nfunc f() = 2\n')
+                os.utime('counter_mod.pql', ns=(0, 0))
+                p('import counter_mod')
+                assert p('count(counter_mod.Log)') == 2
+                assert p('counter_mod.f()') == 2
+
+                p('m = counter_mod')
+                p('reload(counter_mod)')
+                assert p('count(counter_mod.Log)') == 3
+                assert p('m.f()') == 2
+            finally:
+                os.chdir(cwd)
+
+    def test_shared_builtins(self):
+        p1 = self.Preql()
+        p2 = self.Preql()
+        b1 = p1._interp.state.get_var('__builtins__').namespace
+        b2 = p2._interp.state.get_var('__builtins__').namespace
+        assert b1 is not b2
+        assert b1['enum'] is b2['enum']
+
+        p1('func round(x) = "no"')
+        assert p1('round(1.2)') == "no"
+        assert p2('round(1.2)') == 1
+
+    def test_async(self):
+        import asyncio
+        from preql import AsyncPreql
+
+        async def main():
+            p = await AsyncPreql.connect(self.uri)
+            await p('table a { x: int }')
+            await p.commit()
+
+            async with p.transaction():
+                for i in [1, 2, 3]:
+                    await p('new a(i)', i=i)
+            try:
+                async with p.transaction():
+                    await p('new a(4)')
+                    raise ValueError()
+            except ValueError:
+                pass
+
+            t = await p('a order {x}')
+            assert await t.count() == 3
+            assert await t.to_json() == [{'id': 1, 'x': 1}, {'id': 2, 'x': 2}, {'id': 3, 'x': 3}]
+            assert [r['x'] async for r in t.iter_rows(batch_size=2)] == [1, 2, 3]
+            assert (await t.get(1))['x'] == 2
+            assert await p.call('count', await p('a')) == 3
+            assert await p('sum(a{x})') == 6
+
+            # Several instances can run queries at the same time
+            others = [await AsyncPreql.connect() for i in range(4)]
+            res = await asyncio.gather(*[q('sum([1, 2, n])', n=i) for i, q in enumerate(others)])
+            assert res == [3, 4, 5, 6]
+
+            # Each instance runs all its calls (and so its transactions) on the same thread
+            threads = await asyncio.gather(*[q._runner.run(threading.get_ident) for q in others * 3])
+            assert len(set(threads)) == len(others)
+            assert threads[:len(others)] * 3 == threads
+
+            # The threads are shared, so there are never more of them than async_max_workers
+            many = [await AsyncPreql.connect() for i in range(settings.async_max_workers + 2)]
+            threads = await asyncio.gather(*[q._runner.run(threading.get_ident) for q in many + others + [p]])
+            assert len(set(threads)) == settings.async_max_workers
+
+            for q in many + others + [p]:
+                await q.close()
+
+        asyncio.run(main())
+
+    def test_rest_workers(self):
+        import asyncio, time
+        from preql.context import context
+        from preql.core.pql_functions import _RestWorkers
+        from preql.core.interp_common import call_builtin_func, cast_to_python
+
+        p = self.Preql()
+        p('table a { x: int }\nnew a(1)\nnew a(2)')
+        state = p._interp.state
+        workers = _RestWorkers(state, 2)
+
+        def count(name):
+            return cast_to_python(call_builtin_func('count', [context.state.get_var(name)]))
+
+        def get_state():
+            time.sleep(0.1)
+            return context.state
+
+        async def main():
+            assert await workers.run(count, 'a') == (200, 2)
+            status, res = await workers.run(count, 'b')
+            assert status == 500 and res['type'] == 'NameError'
+
+            # Requests run concurrently, each thread with its own state
+            res = await asyncio.gather(*[workers.run(get_state) for i in range(2)])
+            states = [s for _, s in res]
+            assert states[0] is not states[1] and state not in states
+            assert states[0].db is state.db
+
+            with patch.object(settings.Rest, 'TIMEOUT', 0.01):
+                assert (await workers.run(time.sleep, 0.2))[0] == 504
+            # The timed-out job still occupies its worker, until it finishes
+            assert workers._pending == 1
+            await asyncio.sleep(0.3)
+            assert workers._pending == 0
+            with patch.object(settings.Rest, 'MAX_CONCURRENT', 1):
+                res = await asyncio.gather(workers.run(time.sleep, 0.1), workers.run(time.sleep, 0.1))
+                assert [status for status, _ in res] == [200, 503]
+
+        asyncio.run(main())
+        workers.close()
+
+    def test_table_preview(self):
+        from preql.core import display
+
+        p = self.Preql()
+        p('table a { x: int }\nnew a(1)\nnew a(2)')
+        p('table b { x: int }')
+        for i in range(20):
+            p('new b(i)', i=i)
+
+        db = p._interp.state.db
+        queries = []
+        execute_sql = db._execute_sql
+        def count_query(*args):
+            queries.append(args[1])
+            return execute_sql(*args)
+        db._execute_sql = count_query
+
+        # Fully shown, so no need to count
+        assert 'table a =2' in repr(p('a'))
+        assert len(queries) == 1
+
+        text = repr(p('b'))
+        assert 'table b =20' in text and '...' in text
+        assert len(queries) == 3
+
+        # Paging reuses the count
+        with p._interp.setup_context():
+            text = display.print_to_string(display.table_more(), 'text')
+        assert 'table b[16..] =20' in text and '...' not in text
+        assert len(queries) == 4
+
+    @patch.object(settings, 'result_cache', True)
+    def test_result_cache(self):
+        p = self.Preql()
+        db = p._interp.state.db
+        p('table a { x: int }\ntable b { y: int }\nnew a(1)\nnew b(1)')
+        p.commit()
+
+        def stats():
+            return db.result_cache_stats()['hits'], len(db._result_cache)
+
+        assert p('count(a)') == 1
+        assert p('count(a)') == 1
+        assert p('count(b)') == 1
+        assert stats() == (1, 2)
+
+        # Changing a result doesn't change the cached result
+        rows = p('a{x}').to_json()
+        rows[0]['x'] = 10
+        rows.append({'x': 11})
+        assert p('a{x}').to_json() == [{'x': 1}]
+        assert stats() == (2, 3)
+
+        # Writes evict the results that depend on the modified table
+        p('new a(2)')
+        assert stats() == (2, 1)
+        assert p('count(a)') == 2
+        assert p('count(b)') == 1
+        assert stats() == (3, 2)
+
+        p('a[x==2] update {x: 3}')
+        assert p('sum(a{x})') == 4
+        p('a delete [x==3]')
+        assert p('sum(a{x})') == 1
+        assert p('count(b)') == 1
+
+        # Queries that don't read any table aren't cached
+        hits, size = stats()
+        p('sum([1, 2])')
+        p('sum([1, 2])')
+        assert stats() == (hits, size)
+
+        p('new b(2)')
+        p.rollback()
+        assert len(db._result_cache) == 0
+
+        db._result_cache.ttl = 0
+        hits, _ = stats()
+        assert p('count(b)') == 1
+        assert p('count(b)') == 1
+        assert stats()[0] == hits
+
+    def test_profile(self):
+        p = self.Preql()
+        p('''
+            func f(x) = x + 1
+            func main() {
+                table a { x: int }
+                new a(1)
+                print f(count(a))
+            }
+            res = profile(main)
+        ''')
+        res = p.res.to_json()
+
+        names = [(r['kind'], r['name']) for r in res]
+        assert ('statement', 'table a { x: int }') in names
+        assert ('statement', 'print f(count(a))') in names
+        assert ('call', 'f') in names and ('call', 'main') in names
+        for r in res:
+            assert r['location'].startswith('<inline>:')
+            assert r['count'] >= 1
+            assert r['total'] >= r['other'] >= 0
+
+        # Not a keyword
+        assert p('profile = 3\nprofile') == 3
+        p('func profile(x) = x + 1')
+        assert p('profile(1)') == 2
+
+        # Python API
+        with p.profile() as prof:
+            assert p('f(1)') == 2
+        entries = {(e.kind, e.name): e for e in prof.entries}
+        call = entries['call', 'f']
+        assert call.count == 1 and call.text_ref is not None
+        assert entries['script', '<inline>'].times['parse'] > 0
+        assert 'f(1)' in prof.report()
+
+        # Stopped at the end of the block
+        p('f(2)')
+        assert entries['call', 'f'].count == 1
+
+        # Inline statements, and functions that share a name, each get their own entry
+        with p.profile() as prof:
+            p('1 + 1')
+            p('2 + 2')
+            p('1 + 1')
+        counts = {(e.kind, e.name): e.count for e in prof.entries}
+        assert counts['statement', '1 + 1'] == 2 and counts['statement', '2 + 2'] == 1
+        with p.profile() as prof:
+            p('f(1)')
+            p('func f(x) = x + 3')
+            p('f(1)')
+        assert [e.count for e in prof.entries if (e.kind, e.name) == ('call', 'f')] == [1, 1]
+
+    def test_explain(self):
+        from preql.sql_interface import QueryPlan, PostgresInterface, MysqlInterface
+
+        p = self.Preql()
+        p('table a { x: int }\nnew a(1)\nnew a(2)')
+        # The wording of the plan depends on the database (and its version)
+        plan = p('explain(a[x > 1] order {x})').to_json()
+        assert plan and all(r['operation'] for r in plan)
+        assert any(re.search(r'\ba\b', r['detail']) for r in plan), plan
+        assert p('count(explain(count(a)))') > 0
+        self.assertRaises(Signal, p, 'explain(a, true)')
+
+        # Plans of other databases
+        pg = PostgresInterface.__new__(PostgresInterface)
+        plan = QueryPlan()
+        pg._parse_plan(plan, [([{'Plan': {
+            'Node Type': 'Sort', 'Total Cost': 10.5, 'Plan Rows': 3, 'Actual Rows': 2, 'Actual Total Time': 0.1, 'Sort Key': ['x'],
+            'Plans': [{'Node Type': 'Seq Scan', 'Relation Name': 'a', 'Total Cost': 5, 'Plan Rows': 3, 'Filter': '(x > 1)'}]
+        }}],)], True)
+        assert plan.rows[0] == dict(id=1, parent=None, operation='Sort', detail='Sort Key: x',
+                                    est_cost=10.5, est_rows=3, actual_rows=2, actual_time=0.1)
+        assert plan.rows[1]['parent'] == 1 and plan.rows[1]['detail'] == 'Relation Name: a, Filter: (x > 1)'
+
+        my = MysqlInterface.__new__(MysqlInterface)
+        plan = QueryPlan()
+        my._parse_plan(plan, [('''-> Sort: a.x  (cost=1.5 rows=3) (actual time=0.05..0.06 rows=2 loops=1)
+    -> Filter: (a.x > 1)  (cost=0.55 rows=1) (actual time=0.02..0.03 rows=2 loops=1)
+        -> Table scan on a  (cost=0.55 rows=3)
+''',)], True)
+        assert [(r['id'], r['parent'], r['operation']) for r in plan.rows] == [
+            (1, None, 'Sort: a.x'), (2, 1, 'Filter: (a.x > 1)'), (3, 2, 'Table scan on a')]
+        assert plan.rows[0]['est_cost'] == 1.5 and plan.rows[0]['actual_rows'] == 2 and plan.rows[0]['actual_time'] == 0.06
+        assert plan.rows[2]['actual_rows'] is None
+
+
 class TestTypes(PreqlTests):
     def test_types(self):
         assert T.int == T.int
@@ -1644,6 +2345,33 @@ class TestTypes(PreqlTests):
         assert not (u <= T.int)
         assert u <= u
 
+    def test_dispatch(self):
+        t1 = T.table(dict(x=T.int, y=T.string))
+        t2 = T.table(dict(x=T.int, y=T.string))
+        assert t1 is not t2 and t1.dispatch_key() == t2.dispatch_key()
+        assert t1.dispatch_key() != T.table(dict(x=T.int)).dispatch_key()
+
+        dp = Dispatch(TS_Preql_subclass(), TS_Preql_subclass().dispatch_key)
+
+        @dp
+        def f(t: T.number):
+            return 'number'
+        @dp
+        def f(t: T.union[T.table, T.struct]):
+            return 'collection'
+
+        assert f(T.int) == 'number'
+        assert f(t1) == f(t2) == 'collection'
+        self.assertRaises(DispatchError, f, T.string)
+
+        # A new signature replaces the memoized resolutions
+        @dp
+        def f(t: T.int):
+            return 'int'
+        assert f(T.int) == 'int'
+        assert f(T.float) == 'number'
+
+
 class TestFunctions(PreqlTests):
     def test_fmt(self):
          p = self.Preql()
@@ -1686,4 +2414,68 @@ class TestPandas(PreqlTests):
         f = DataFrame([[1,2,"a"], [4,5,"b"], [7,8,"c"]], columns=['x', 'y', 'z'])
         p = self.Preql()
         p.import_pandas(x=f)
-        assert (p('x{... !id}').to_pandas() == f).all().all()
\ No newline at end of file
+        assert (p('x{... !id}').to_pandas() == f).all().all()
+
+    def test_columnar(self):
+        import numpy as np
+        p = self.Preql()
+        p("""
+            table a { x: int, y: float, s: string, n: int? }
+            new a(1, 1.5, "a", 4)
+            new a(2, 2.5, "b", null)
+            new a(3, 3.5, "c", 6)
+        """)
+
+        df = p('a{x, y, s, n} order {x}').to_pandas()
+        assert list(df.columns) == ['x', 'y', 's', 'n']
+        assert list(df['x']) == [1, 2, 3]
+        assert df['x'].dtype == np.int64
+        assert df['y'].dtype == np.float64
+        assert list(df['s']) == ['a', 'b', 'c']
+        assert df['n'].isna().tolist() == [False, True, False]
+
+        arr = p('a{x, y} order {x}').to_numpy()
+        assert arr.dtype.names == ('x', 'y')
+        assert list(arr['x']) == [1, 2, 3]
+        assert list(arr['y']) == [1.5, 2.5, 3.5]
+
+        assert list(p('[1,2,3]').to_numpy()) == [1, 2, 3]
+        assert len(p('a[x > 5]').to_pandas()) == 0
+
+        # Backends that can't fetch by columns build them from the rows
+        db = p._interp.state.db
+        with patch.object(db, 'query_columns', partial(SqlInterface.query_columns, db)):
+            df = p('a{x, s, n} order {x}').to_pandas()
+            assert list(df.columns) == ['x', 's', 'n']
+            assert list(df['x']) == [1, 2, 3]
+            assert df['n'].isna().tolist() == [False, True, False]
+            assert list(p('a{x, y} order {x}').to_numpy()['y']) == [1.5, 2.5, 3.5]
+            assert list(p('[1,2,3]').to_numpy()) == [1, 2, 3]
+            assert len(p('a[x > 5]').to_pandas()) == 0
+
+        try:
+            import pyarrow
+        except ImportError:
+            return
+        t = p('a{x} order {x}').to_arrow()
+        assert t.column('x').to_pylist() == [1, 2, 3]
+
+
+class DuckTests(PreqlTests):
+    "Regressions specific to DuckDB (which isn't in NORMAL_TARGETS yet)"
+    uri = DUCK_URI
+
+    def setUp(self):
+        super().setUp()
+        try:
+            import duckdb
+        except ImportError:
+            raise SkipTest("duckdb is not installed")
+
+    def test_range(self):
+        # Ranges are compiled into a recursive CTE, which DuckDB only accepts with WITH RECURSIVE
+        p = self.Preql()
+        assert p('[1..10]').to_json() == list(range(1, 10))
+        assert p('count([1..100])') == 99
+        assert p('sum([1..10]{item * 2})') == 90
+        assert p('[1..5][item > 2]{item}').to_json() == [{'item': 3}, {'item': 4}]
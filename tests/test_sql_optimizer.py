@@ -0,0 +1,176 @@
+from unittest import TestCase
+
+from preql import settings
+from preql.context import context
+from preql.core.state import ThreadState
+from preql.core.pql_types import T, Id
+from preql.core.sql import (Select, TableName, AllFields, ColumnAlias, Name, Compare, BinOp,
+                            Primitive, FieldFunc, Desc, Subquery, CompiledSQL, create_list)
+from preql.sql_interface import SqlInterface, SqliteInterface, PostgresInterface, MysqlInterface, DuckInterface
+
+from .common import PreqlTests, SQLITE_URI
+
+
+def _interface(cls):
+    "Returns an interface that can compile SQL, without connecting to a database"
+    db = cls.__new__(cls)
+    SqlInterface.__init__(db)
+    return db
+
+def _compile(cls, sql, subqueries=None):
+    db = _interface(cls)
+    with context(state=ThreadState.from_components(None, db, None, autocommit=False)):
+        return db.compile_sql(sql, subqueries)
+
+
+a_type = T.table({'id': T.t_id, 'x': T.int, 's': T.string}, name=Id('a'))
+a = TableName(a_type, Id('a'))
+x = Name(T.int, 'x')
+y = Name(T.int, 'y')
+
+def _int(i):
+    return Primitive(T.int, str(i))
+
+def _select(table, fields=None, **kw):
+    return Select(table.type, table, fields or [AllFields(table.type)], **kw)
+
+# a[x > 1]{y: x + 1}[y > 2] order {^y} [..3]
+nested = _select(_select(_select(_select(
+    _select(a, conds=[Compare('>', [x, _int(1)])]),
+    [ColumnAlias(BinOp(T.int, '+', [x, _int(1)]), 'y')]),
+    conds=[Compare('>', [y, _int(2)])]),
+    order=[Desc(y)]),
+    offset=0, limit=3)
+
+# a{x => c: count(s)}[x > 1]
+grouped = _select(_select(a, [x, ColumnAlias(FieldFunc('count', Name(T.string, 's')), 'c')], group_by=[_int(1)]),
+                  conds=[Compare('>', [x, _int(1)])])
+
+# (a{x, s}[..10])[2..]{x}
+sliced = _select(_select(_select(a, [x, Name(T.string, 's')], limit=10), offset=2), [x])
+
+# WITH q AS (a[x > 1]) q{x}
+subq = Subquery('q', [Name(T.t_id, 'id'), x, Name(T.string, 's')], _select(a, conds=[Compare('>', [x, _int(1)])]))
+with_subquery = _select(TableName(a_type, Id('q')), [x]), {'q': subq}
+
+
+class GoldenSqlTests(TestCase):
+    "The SQL generated for each backend, with the optimizer on"
+
+    expected = {
+        SqliteInterface: [
+            "SELECT ([x] + 1) AS [y] FROM [a] WHERE ([x] > 1) AND (([x] + 1) > 2) ORDER BY ([x] + 1) DESC LIMIT 3 OFFSET 0",
+            "SELECT [x], count([s]) AS [c] FROM [a] WHERE ([x] > 1) GROUP BY 1",
+            "SELECT [x] FROM [a] LIMIT 8 OFFSET 2",
+            "SELECT [x] FROM [a] WHERE ([x] > 1)",
+        ],
+        PostgresInterface: [
+            'SELECT ("x" + 1) AS "y" FROM "a" WHERE ("x" > 1) AND (("x" + 1) > 2) ORDER BY ("x" + 1) DESC LIMIT 3 OFFSET 0',
+            'SELECT "x", count("s") AS "c" FROM "a" WHERE ("x" > 1) GROUP BY 1',
+            'SELECT "x" FROM "a" LIMIT 8 OFFSET 2',
+            'SELECT "x" FROM "a" WHERE ("x" > 1)',
+        ],
+        MysqlInterface: [
+            "SELECT (`x` + 1) AS `y` FROM `a` WHERE (`x` > 1) AND ((`x` + 1) > 2) ORDER BY (`x` + 1) DESC LIMIT 3 OFFSET 0",
+            "SELECT `x`, count(`s`) AS `c` FROM `a` WHERE (`x` > 1) GROUP BY 1",
+            "SELECT `x` FROM `a` LIMIT 8 OFFSET 2",
+            "SELECT `x` FROM `a` WHERE (`x` > 1)",
+        ],
+        DuckInterface: [
+            'SELECT ("x" + 1) AS "y" FROM "a" WHERE ("x" > 1) AND (("x" + 1) > 2) ORDER BY ("x" + 1) DESC LIMIT 3 OFFSET 0',
+            'SELECT "x", count("s") AS "c" FROM "a" WHERE ("x" > 1) GROUP BY 1',
+            'SELECT "x" FROM "a" LIMIT 8 OFFSET 2',
+            'SELECT "x" FROM "a" WHERE ("x" > 1)',
+        ],
+    }
+
+    def test_golden(self):
+        queries = [(nested, None), (grouped, None), (sliced, None), with_subquery]
+        for cls, expected in self.expected.items():
+            for (sql, subqueries), code in zip(queries, expected):
+                self.assertEqual(_compile(cls, sql, subqueries), code, cls.__name__)
+
+    def test_subqueries(self):
+        l1, subq1, _ = create_list('l1', [_int(1), _int(2)])
+        l2, subq2, _ = create_list('l2', [_int(1), _int(2)])
+        _l3, subq3, _ = create_list('l3', [_int(3)])
+        # Raw code references subqueries by name
+        raw = CompiledSQL(T.int, ['SELECT COUNT(*) FROM ', '[l2]'], None, True, False)
+        sql = _select(l1, conds=[Compare('>', [Name(T.int, 'item'), raw])])
+        subqueries = {'l1': subq1, 'l2': subq2, 'l3': subq3}
+
+        code = _compile(SqliteInterface, sql, subqueries)
+        assert code == "WITH l1([item]) AS (VALUES (1), (2))\n    SELECT * FROM [l1] WHERE ([item] > (SELECT COUNT(*) FROM [l1]))", code
+
+        orig = settings.Optimizer.DEDUP_SUBQUERIES, settings.Optimizer.DROP_UNUSED_SUBQUERIES
+        settings.Optimizer.DEDUP_SUBQUERIES = settings.Optimizer.DROP_UNUSED_SUBQUERIES = False
+        try:
+            code = _compile(SqliteInterface, sql, subqueries)
+        finally:
+            settings.Optimizer.DEDUP_SUBQUERIES, settings.Optimizer.DROP_UNUSED_SUBQUERIES = orig
+        assert code.count(' AS (VALUES') == 3, code
+
+    def test_rules_switch(self):
+        orig = settings.Optimizer.PUSH_LIMITS
+        settings.Optimizer.PUSH_LIMITS = False
+        try:
+            code = _compile(SqliteInterface, _select(_select(a, limit=10), offset=2))
+        finally:
+            settings.Optimizer.PUSH_LIMITS = orig
+        assert code == "SELECT * FROM (SELECT * FROM [a] LIMIT 10) LIMIT -1 OFFSET 2", code
+
+        orig = settings.optimize
+        settings.optimize = False
+        try:
+            code = _compile(SqliteInterface, sliced)
+        finally:
+            settings.optimize = orig
+        assert code.count('SELECT') == 3, code
+
+
+class OptimizerResultsTests(PreqlTests):
+    "The optimizer must not change the results of queries"
+    uri = SQLITE_URI
+    optimized = True
+
+    def test_same_results(self):
+        p = self.Preql()
+        p('table a {x: int, s: string}')
+        for i in range(20):
+            p('new a(x, s)', x=i % 7, s='s%d' % i)
+        queries = [
+            'a[x > 1]{y: x + 1, s}[y > 2] order {^y, s} [..5]',
+            'a{x => c: count(s)}[x > 1] order {x}',
+            '(a{x, s} order {s} [..10])[2..]{x}',
+            'a order {s} {x, s} {x => s} order {x}',
+            'a{x, z: x * 2}[z > 4][1..]{z} order {z}',
+            '(a order {s})[3..8][1..3]',
+            'a[x in [1, 2]] + a[x in [1, 2]]',
+            'a{x => s}[count(s) > 2] order {x}',
+            'a{x => s}{x, n: count(s)}[n > 2] order {x}',
+            'a{x => s}[x > 3][count(s) > 2] order {x}',
+        ]
+        for q in queries:
+            settings.optimize = False
+            try:
+                expected = p(q).to_json()
+            finally:
+                settings.optimize = True
+            self.assertEqual(p(q).to_json(), expected, q)
+
+    def test_function_call(self):
+        # The result of a (cached) function call is optimized together with the query around it
+        p = self.Preql()
+        p('''
+            table A {x: int, y: int}
+            func f() = A[x > 1]
+            func g(n) = A[x > n]
+        ''')
+        for x, y in [(1, 1), (2, 6), (3, 3), (4, 4)]:
+            p('new A(x, y)', x=x, y=y)
+
+        for _ in range(2):  # The second call uses the function cache
+            self.assertEqual(p('inspect_sql(f()[y < 5])'), 'SELECT * FROM [A] WHERE ([x] > 1) AND ([y] < 5)')
+            self.assertEqual(p('inspect_sql(g(2)[y < 5]{x})'), 'SELECT [x] FROM [A] WHERE ([x] > 2) AND ([y] < 5)')
+        self.assertEqual(p('f()[y < 5]{x}').to_json(), [{'x': 3}, {'x': 4}])
+        self.assertEqual(p('g(2)[y < 5]{x}').to_json(), [{'x': 3}, {'x': 4}])